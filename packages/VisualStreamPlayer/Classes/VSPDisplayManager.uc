@@ -35,6 +35,8 @@ var() Texture bgTex;
 // NOTE: Even if we were able to receive one more byte, there is,
 //			apparently, a bug that makes ScriptedTexture.drawText()
 //			fail to draw on the texture's bottom and right borders.
+// Larger displays (up to 255x255) need the streamer to split the frames
+// in chunks (max_datagram_size), e.g. 4095 on 469.
 var() byte pixRows;
 var() byte pixCols;
 
@@ -58,6 +60,17 @@ var() class<VSPResChangeManager> resChangeManClass;
 var VSPDisplayClientLink clientLink;
 var VSPDisplay display;
 
+// The frame being assembled from its chunks, shown once complete.
+var String chunkLines[255];
+// The sequence number of the frame being assembled.
+var byte chunkSeq;
+// Counts the frames assembled, and which frame each row was last
+// received for.
+var int chunkFrameIdx;
+var int chunkRowFrames[255];
+var int chunkRowCount;
+var bool bChunkComplete;
+
 
 replication {
 	reliable if ((role == ROLE_Authority) && bNetInitial)
@@ -122,6 +135,32 @@ simulated event postNetBeginPlay() {
 simulated function setFrame(String frame) {
 	local int i;
 	
+	if (asc(frame) == 1) {
+		// A delta frame, only the rows which changed were sent. Each
+		// row is prefixed by a char holding its index + 1.
+		frame = mid(frame, 1);
+		while (len(frame) > pixCols) {
+			i = asc(frame) - 1;
+			if (i < pixRows)
+				frameLines[i] = mid(frame, 1, pixCols);
+			// Discard the processed row.
+			frame = mid(frame, pixCols + 1);
+		}
+		return;
+	}
+	
+	if (asc(frame) == 2) {
+		// A chunk of a frame too large for a single datagram.
+		setFrameChunk(mid(frame, 1));
+		return;
+	}
+	
+	if (asc(frame) == 3) {
+		// A run-length encoded frame.
+		setFrameRle(mid(frame, 1));
+		return;
+	}
+	
 	// Chop the frame string and populate the frame lines.
 	for (i = 0; i < pixRows; i++) {
 		frameLines[i] = left(frame, pixCols);
@@ -131,6 +170,88 @@ simulated function setFrame(String frame) {
 }
 
 
+/*
+	Expand a run-length encoded frame: a run of the same glyph is the
+	escape char (27), the run length and the glyph, the other glyphs are
+	sent as is. Runs don't span rows.
+*/
+simulated function setFrameRle(String frame) {
+	local int i, j, n;
+	local String line, glyph, esc;
+	
+	esc = chr(27);
+	for (i = 0; i < pixRows; i++) {
+		line = "";
+		while ((len(line) < pixCols) && (frame != "")) {
+			if (asc(frame) == 27) {
+				n = asc(mid(frame, 1));
+				glyph = mid(frame, 2, 1);
+				for (j = 0; j < n; j++)
+					line = line $ glyph;
+				frame = mid(frame, 3);
+			}
+			else {
+				// Copy the glyphs up to the next run.
+				n = inStr(frame, esc);
+				if ((n < 0) || (n > (pixCols - len(line))))
+					n = pixCols - len(line);
+				line = line $ left(frame, n);
+				frame = mid(frame, n);
+			}
+		}
+		frameLines[i] = line;
+	}
+}
+
+
+/*
+	Add a chunk of a frame: the frame sequence number, the index of its
+	first row + 1, then the rows. The frame replaces the frame lines once
+	all its rows arrived, a frame left incomplete gets dropped when a
+	newer one starts and so do the late chunks of an older one.
+*/
+simulated function setFrameChunk(String chunk) {
+	local int seq, row;
+	
+	seq = asc(chunk);
+	row = asc(mid(chunk, 1)) - 1;
+	chunk = mid(chunk, 2);
+	
+	if (seq != chunkSeq) {
+		// The sequence numbers (1 to 255) wrap around, the half after
+		// the current one are newer frames, the other half older.
+		if ((chunkSeq != 0) && (((seq - chunkSeq + 255) % 255) > 127))
+			return;
+		// A newer frame, drop the one being assembled.
+		chunkSeq = seq;
+		chunkFrameIdx++;
+		chunkRowCount = 0;
+		bChunkComplete = false;
+	}
+	else if (bChunkComplete)
+		// A duplicate.
+		return;
+	
+	while ((len(chunk) >= pixCols) && (row < pixRows)) {
+		if (chunkRowFrames[row] != chunkFrameIdx) {
+			chunkRowFrames[row] = chunkFrameIdx;
+			chunkRowCount++;
+		}
+		chunkLines[row] = left(chunk, pixCols);
+		// Discard the processed row.
+		chunk = mid(chunk, pixCols);
+		row++;
+	}
+	
+	if (chunkRowCount >= pixRows) {
+		// All the rows arrived, show the frame.
+		for (row = 0; row < pixRows; row++)
+			frameLines[row] = chunkLines[row];
+		bChunkComplete = true;
+	}
+}
+
+
 defaultproperties {
 	remoteRole=ROLE_DumbProxy
 	bAlwaysRelevant=True
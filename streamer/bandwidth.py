@@ -0,0 +1,49 @@
+"""
+Bandwidth budgets of the remote displays, so that a video doesn't flood
+the connection of a player (or the uplink of the server): each display
+gets a token bucket filling at its budget, in bytes per second.
+
+A display whose bucket is empty skips the frames until it fills up
+again, its frame rate drops to what its budget allows and it always
+gets the newest frame rather than a backlog of old ones. The frame sizes
+vary (deltas, unchanged tiles), so a frame gets sent as soon as the
+bucket isn't empty and its actual size is taken afterwards, the bucket
+may go below zero: the rate averages to the budget.
+"""
+
+import time
+
+
+
+# The bytes a bucket holds when full, in seconds of budget, i.e. how
+# long a display may go over its budget (after a pause) before being
+# throttled.
+BURST_SECONDS = 0.5
+
+
+class TokenBucket:
+	"""A bucket of tokens (bytes) filling at rate bytes per second, up
+	to burst bytes (BURST_SECONDS of rate by default)."""
+
+	__slots__ = ('rate', 'burst', 'tokens', 'fill_ts')
+
+	def __init__(self, rate, burst=None):
+		self.rate = rate
+		self.burst = burst or (rate * BURST_SECONDS)
+		self.tokens = self.burst
+		self.fill_ts = time.monotonic()
+
+
+	def is_ready(self, now=None):
+		"""True if the bucket isn't empty at a given time (from
+		time.monotonic()), now by default."""
+
+		now = time.monotonic() if now is None else now
+		self.tokens = min(self.burst, self.tokens + (now - self.fill_ts) * self.rate)
+		self.fill_ts = now
+		return self.tokens > 0
+
+
+	def consume(self, size):
+		"""Take the bytes sent out of the bucket."""
+		self.tokens -= size
\ No newline at end of file
@@ -0,0 +1,700 @@
+"""
+Benchmarks of the streamer's hot paths, run offline with synthetic frames:
+
+	quantize	converting a tile, or the whole frame of a wall, to
+			characters, for several glyph counts and tile sizes
+	resize		fitting a source frame to the resolution of a wall
+	decode		decoding a video for a wall, with OpenCV then resizing,
+			or with ffmpeg scaling (see ffmpeg_source.py), and the
+			CPU time it takes (ffmpeg's included)
+	broadcast	sending a converted frame to every display of a wall,
+			straight through the socket or queued then flushed by
+			the fan-out sender (see fanout.py)
+	e2e		frames per second received by displays listening on
+			loopback, through the whole pipeline
+	wire		the bytes a frame of the example media takes on the
+			wire, raw and run-length encoded (see
+			frame_codec.encode_rle()), and the encoding time
+	image_cache	showing a still image and an AI generated image (by
+			a local stand-in of the generator) on a cold cache,
+			from the disk cache and from memory (see
+			image_cache.py)
+
+	py bench.py [--quick] [--only quantize,e2e] [--video video.mp4] [--output results.json] [--compare old.json] [font_tex_path]
+
+The results are printed as JSON (or written to --output), each one
+identified by its name and parameters, so that the results of two runs
+can be compared with --compare.
+The frames are generated from a fixed seed, so the runs are
+reproducible, the decode benchmark uses a synthetic MJPG video unless
+given --video. The e2e receivers run in the same process as the
+streamer, they take a share of the CPU like the displays of a local
+server would.
+"""
+
+import os
+import sys
+import time
+import json
+import socket
+import asyncio
+import platform
+import argparse
+import itertools
+import selectors
+import tempfile
+import threading
+import zlib
+import statistics
+
+import numpy as np
+import cv2
+
+from font_palette import get_font_palette
+from video_wall import VideoWall
+from registry import DisplayRegistry
+from sessions import StreamSession, SessionManager
+from ffmpeg_source import FFmpegSource, find_ffmpeg, probe_video
+from frame_codec import MIN_RUN
+from fanout import FanoutSender
+from image_cache import ImageCache
+
+
+
+DEFAULT_FONT_TEX_PATH = os.path.join(
+	os.path.dirname(os.path.abspath(__file__)),
+	'..',
+	'examples',
+	'media',
+	'indexed_color',
+	'palette_tex_color_1.bmp'
+)
+DEFAULT_MEDIA_DIR = os.path.join(
+	os.path.dirname(os.path.abspath(__file__)),
+	'..',
+	'examples',
+	'media',
+	'for_display'
+)
+# The example media measured by the wire benchmark: file name -> the
+# shape of the wall showing it. The synthetic frames (noisy gradients,
+# see make_frames()) hardly compress.
+WIRE_MEDIA = {
+	'color_cube_63x63.gif': (1, 1),
+	'color_cube_126x126.gif': (2, 2),
+	'2x2_grid_63x63_cell.png': (2, 2),
+	'synthetic': (2, 2)
+}
+# How long the stand-in of the AI image generator takes to answer,
+# a request takes seconds.
+GEN_IMG_DELAY = 1
+
+
+def measure(func, min_time=0.2, rounds=3):
+	"""Call a function repeatedly, for at least min_time seconds in each
+	round, and return the timing of a call."""
+
+	# Warm up (caches, lazy allocations).
+	func()
+
+	times = []
+	calls = 0
+	for _ in range(rounds):
+		round_calls = 0
+		start_ts = time.perf_counter()
+		while True:
+			func()
+			round_calls += 1
+			elapsed = time.perf_counter() - start_ts
+			if elapsed >= min_time:
+				break
+		times.append(elapsed / round_calls)
+		calls += round_calls
+
+	median = statistics.median(times)
+	return {
+		'calls': calls,
+		'median_ms': round(median * 1000, 4),
+		'best_ms': round(min(times) * 1000, 4),
+		'per_sec': round(1 / median, 2)
+	}
+
+
+def make_frames(res, count=8, seed=0):
+	"""Return count BGR frames of a given resolution: gradients moving
+	from a frame to the next one, with some noise."""
+
+	rng = np.random.default_rng(seed)
+	y, x = np.mgrid[0:res[0], 0:res[1]].astype(np.float32)
+	frames = []
+	for i in range(count):
+		phase = 2 * np.pi * i / count
+		frame = np.stack((
+			127.5 + 127.5 * np.sin(2 * np.pi * x / res[1] + phase),
+			127.5 + 127.5 * np.sin(2 * np.pi * y / res[0] + phase),
+			(x + y + 8 * i) % 256
+		), axis=-1)
+		frame += rng.normal(0, 8, frame.shape)
+		frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+
+	return frames
+
+
+def cycle(items):
+	"""Return a callable returning the items in turn."""
+	items = itertools.cycle(items)
+	return lambda: next(items)
+
+
+def bench_quantize(font_tex_path, glyph_counts, tile_sizes, lut_bits_list, wall_shape, min_time):
+	"""Convert single tiles and whole wall frames to characters."""
+
+	results = []
+	for lut_bits in lut_bits_list:
+		for glyph_count in glyph_counts:
+			font_pal = get_font_palette(font_tex_path, glyph_count, True, lut_bits)
+			if font_pal.lut_bits:
+				# Not part of the measures.
+				font_pal.get_lut()
+
+			for tile_size in tile_sizes:
+				params = {'glyph_count': glyph_count, 'tile_size': tile_size, 'lut_bits': lut_bits}
+
+				next_frame = cycle(make_frames((tile_size, tile_size)))
+				results.append({
+					'name': 'quantize_tile',
+					'params': params,
+					**measure(lambda: font_pal.quantize(next_frame()), min_time)
+				})
+
+				wall = VideoWall(wall_shape, (tile_size, tile_size))
+				next_frame = cycle(make_frames(wall.full_res))
+				results.append({
+					'name': 'quantize_frame',
+					'params': {**params, 'wall_shape': list(wall_shape)},
+					**measure(lambda: wall.convert_frame(next_frame(), font_pal), min_time)
+				})
+
+	return results
+
+
+def bench_resize(src_resolutions, wall_shapes, display_res, min_time):
+	"""Fit source frames to the resolution of walls."""
+
+	results = []
+	for src_res in src_resolutions:
+		next_frame = cycle(make_frames(src_res, count=2))
+		for wall_shape in wall_shapes:
+			wall = VideoWall(wall_shape, display_res)
+			dst_size = (wall.full_res[1], wall.full_res[0])
+			results.append({
+				'name': 'resize',
+				'params': {'src_res': list(src_res), 'wall_shape': list(wall_shape), 'display_res': list(display_res)},
+				**measure(lambda: cv2.resize(next_frame(), dst_size, interpolation=cv2.INTER_LINEAR), min_time)
+			})
+
+	return results
+
+
+def make_video(path, res, count=120, fps=30):
+	"""Write a synthetic MJPG video of count frames (see
+	make_frames())."""
+
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (res[1], res[0]))
+	for frame in itertools.islice(itertools.cycle(make_frames(res)), count):
+		writer.write(frame)
+	writer.release()
+
+
+def decode_video(open_src, wall_res, max_frames):
+	"""Decode the frames of a video, fitted to the resolution of a wall.
+	Return the timing of a frame, in time and CPU time.
+
+	The CPU time includes the subprocesses' (ffmpeg) on Unix only."""
+
+	start_times = os.times()
+	start_ts = time.perf_counter()
+
+	src = open_src()
+	count = 0
+	try:
+		while count < max_frames:
+			success, frame = src.read()
+			if not success:
+				break
+			if frame.shape[:2] != wall_res:
+				frame = cv2.resize(frame, (wall_res[1], wall_res[0]), interpolation=cv2.INTER_LINEAR)
+			count += 1
+	finally:
+		# Waits for ffmpeg, so that its CPU time gets counted.
+		src.release()
+
+	elapsed = time.perf_counter() - start_ts
+	# User, system, children's user and children's system times.
+	cpu_time = sum(os.times()[:4]) - sum(start_times[:4])
+
+	return {
+		'frames': count,
+		'fps': round(count / elapsed, 2),
+		'cpu_ms_per_frame': round(cpu_time / max(count, 1) * 1000, 3)
+	}
+
+
+def bench_decode(video_paths, wall_shapes, display_res, ffmpeg_path, max_frames):
+	"""Decode videos for walls with OpenCV and with ffmpeg."""
+
+	ffmpeg_path = find_ffmpeg(ffmpeg_path)
+	if not ffmpeg_path:
+		print('ffmpeg was not found, only OpenCV gets measured.', file=sys.stderr)
+
+	results = []
+	for video_path in video_paths:
+		fps, src_res = probe_video(video_path)
+
+		for wall_shape in wall_shapes:
+			wall = VideoWall(wall_shape, display_res)
+			decoders = {'cv2': lambda: cv2.VideoCapture(video_path)}
+			if ffmpeg_path:
+				decoders['ffmpeg'] = lambda: FFmpegSource(video_path, wall.full_res, ffmpeg_path, fps, src_res=src_res)
+
+			for decoder, open_src in decoders.items():
+				results.append({
+					'name': 'decode',
+					'params': {'video': os.path.basename(video_path), 'src_res': list(src_res), 'wall_shape': list(wall_shape), 'decoder': decoder},
+					**decode_video(open_src, wall.full_res, max_frames)
+				})
+
+	return results
+
+
+class ManualLoop:
+	"""Stand in for the event loop of the fan-out sender, running the
+	callbacks only when told, so that a flush gets timed without the
+	rest of an event loop."""
+
+	class Handle:
+		def cancel(self):
+			pass
+
+	def __init__(self):
+		self.callbacks = []
+
+
+	def call_soon(self, callback):
+		self.callbacks.append(callback)
+		return self.Handle()
+
+
+	def call_later(self, delay, callback):
+		return self.call_soon(callback)
+
+
+	def run_callbacks(self):
+		callbacks, self.callbacks = self.callbacks, []
+		for callback in callbacks:
+			callback()
+
+
+def bench_broadcast(font_pal, wall_shapes, displays_per_tile, display_res, min_time):
+	"""Send converted frames to every display of walls, to a loopback
+	socket nobody reads (the datagrams which don't fit its buffer get
+	dropped by the OS), through the socket or the fan-out sender."""
+
+	receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	receiver.bind(('127.0.0.1', 0))
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	loop = ManualLoop()
+	# Sender name -> (what the displays send through, flush).
+	senders = {
+		'socket': (sock, lambda: None),
+		'fanout': (FanoutSender(sock.dup(), loop), loop.run_callbacks)
+	}
+
+	# Mode -> (keyframe_interval, refresh_interval).
+	modes = {
+		'full': (None, 0),
+		'delta': (2, 0),
+		# The same frame again, the tiles get skipped.
+		'unchanged': (None, 60)
+	}
+
+	results = []
+	try:
+		for wall_shape in wall_shapes:
+			wall = VideoWall(wall_shape, display_res)
+			converted = [wall.convert_frame(frame, font_pal) for frame in make_frames(wall.full_res)]
+
+			for (count, (sender_name, (sender, flush))) in itertools.product(displays_per_tile, senders.items()):
+				wall = VideoWall(wall_shape, display_res)
+				positions = [position for position in np.ndindex(*wall_shape) for _ in range(count)]
+				for idx, position in enumerate(positions):
+					# Distinct addresses (the same port), as the
+					# fan-out sender keeps a slot per address.
+					addr = (f'127.0.{idx // 250}.{idx % 250 + 1}', receiver.getsockname()[1])
+					wall.add_display(sender, addr, position, send_last_frame=False)
+
+				for mode, (keyframe_interval, refresh_interval) in modes.items():
+					next_converted = cycle(converted if mode != 'unchanged' else converted[:1])
+
+					def broadcast():
+						wall.set_tiles(*next_converted())
+						wall.broadcast_last_frame(keyframe_interval, refresh_interval)
+						flush()
+
+					result = measure(broadcast, min_time)
+					result['datagrams_per_sec'] = round(result['per_sec'] * wall.matrix.size * count, 1) if mode != 'unchanged' else 0
+					results.append({
+						'name': 'broadcast',
+						'params': {'wall_shape': list(wall_shape), 'displays_per_tile': count, 'mode': mode, 'sender': sender_name},
+						**result
+					})
+
+	finally:
+		senders['fanout'][0].close()
+		sock.close()
+		receiver.close()
+
+	return results
+
+
+def run_e2e(font_pal, wall_shape, display_res, src_res, duration):
+	"""Stream synthetic frames as fast as possible to a wall of displays
+	listening on loopback and count the frames they receive."""
+
+	receivers = []
+	for _ in range(wall_shape[0] * wall_shape[1]):
+		receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		receiver.bind(('127.0.0.1', 0))
+		receiver.setblocking(False)
+		receivers.append(receiver)
+
+	counts = [0] * len(receivers)
+	received_bytes = [0]
+	counting = threading.Event()
+	done = threading.Event()
+
+	def receive():
+		with selectors.DefaultSelector() as selector:
+			for idx, receiver in enumerate(receivers):
+				selector.register(receiver, selectors.EVENT_READ, idx)
+			while not done.is_set():
+				for key, _ in selector.select(0.1):
+					try:
+						data = key.fileobj.recv(65536)
+					except BlockingIOError:
+						continue
+					if counting.is_set():
+						counts[key.data] += 1
+						received_bytes[0] += len(data)
+
+	async def stream():
+		loop = asyncio.get_running_loop()
+		registry = DisplayRegistry()
+		registry.set_walls([{'group': 'bench', 'shape': list(wall_shape), 'display_res': list(display_res)}])
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		for position, receiver in zip(np.ndindex(*wall_shape), receivers):
+			registry.add_display(sock, receiver.getsockname(), 'bench', position)
+
+		manager = SessionManager(registry.get_wall, loop)
+		manager.run()
+		frames = ((frame, None, None) for frame in itertools.cycle(make_frames(src_res)))
+		session = StreamSession('bench', None, frames, font_pal, refresh_interval=0)
+		# The synthetic source is never late, let it wait for room
+		# rather than dropping frames as fast as it can make them.
+		session.decoder.drop_oldest = False
+		manager.start(session)
+
+		# Warm up, then count.
+		await asyncio.sleep(min(duration, 0.5))
+		counting.set()
+		start_ts = time.perf_counter()
+		await asyncio.sleep(duration)
+		counting.clear()
+		elapsed = time.perf_counter() - start_ts
+
+		await manager.shutdown()
+		sock.close()
+		return elapsed
+
+	receiver_thread = threading.Thread(target=receive, daemon=True)
+	receiver_thread.start()
+	try:
+		elapsed = asyncio.run(stream())
+	finally:
+		done.set()
+		receiver_thread.join()
+		for receiver in receivers:
+			receiver.close()
+
+	return {
+		'fps': round(statistics.mean(counts) / elapsed, 2),
+		'min_display_fps': round(min(counts) / elapsed, 2),
+		'datagrams_per_sec': round(sum(counts) / elapsed, 1),
+		'mbytes_per_sec': round(received_bytes[0] / elapsed / (1 << 20), 3)
+	}
+
+
+def bench_e2e(font_pal, wall_shapes, display_res, src_res, duration):
+	"""Frames per second received by loopback displays."""
+
+	return [
+		{
+			'name': 'e2e',
+			'params': {'wall_shape': list(wall_shape), 'display_res': list(display_res), 'src_res': list(src_res)},
+			**run_e2e(font_pal, wall_shape, display_res, src_res, duration)
+		}
+		for wall_shape in wall_shapes
+	]
+
+
+def read_media(path, max_frames):
+	"""Return the frames of an image or a video, as the stream command
+	reads them."""
+
+	cap = cv2.VideoCapture(path)
+	frames = []
+	while len(frames) < max_frames:
+		ok, frame = cap.read()
+		if not ok:
+			break
+		frames.append(frame)
+	cap.release()
+
+	if not frames:
+		frame = cv2.imread(path)
+		if frame is not None:
+			frames.append(frame)
+	return frames
+
+
+def count_rle_rows(tile, row_len):
+	"""Return the rows of an encoded tile holding a run long enough
+	to be run-length encoded, the others are sent raw."""
+
+	glyphs = np.frombuffer(tile, dtype=np.uint8).reshape(-1, row_len)
+	same = glyphs[:, 1:] == glyphs[:, :-1]
+	has_run = same[:, :1 - MIN_RUN].copy()
+	for offset in range(1, MIN_RUN - 1):
+		has_run &= same[:, offset : offset + 1 - MIN_RUN or None]
+	return int(has_run.any(axis=1).sum())
+
+
+def bench_wire(font_tex_path, media_dir, display_res, max_frames):
+	"""Measure the bytes the frames of the example media take on the
+	wire, raw and run-length encoded (a tile is sent raw when that's
+	smaller), with and without the alpha glyph."""
+
+	results = []
+	for name, wall_shape in WIRE_MEDIA.items():
+		if name == 'synthetic':
+			frames = make_frames((wall_shape[0] * display_res[0], wall_shape[1] * display_res[1]))
+		else:
+			frames = read_media(os.path.join(media_dir, name), max_frames)
+		if not frames:
+			print(f'{name} was not found, skipped.', file=sys.stderr)
+			continue
+
+		for use_alpha in (True, False):
+			font_pal = get_font_palette(font_tex_path, 96, use_alpha)
+			wall = VideoWall(wall_shape, display_res)
+			raw_bytes = rle_bytes = rle_rows = 0
+			encode_time = 0
+
+			for frame in frames:
+				frame = cv2.resize(frame, (wall.full_res[1], wall.full_res[0]), interpolation=cv2.INTER_LINEAR)
+				tiles, _ = wall.convert_frame(frame, font_pal)
+
+				start_ts = time.perf_counter()
+				rle_tiles = wall.encode_rle_tiles(tiles)
+				encode_time += time.perf_counter() - start_ts
+
+				for position in np.ndindex(*wall_shape):
+					raw_bytes += len(tiles[position])
+					rle_bytes += len(rle_tiles[position] or tiles[position])
+					rle_rows += count_rle_rows(tiles[position], display_res[1])
+
+			tile_count = len(frames) * wall.matrix.size
+			results.append({
+				'name': 'wire',
+				'params': {'media': name, 'wall_shape': list(wall_shape), 'use_alpha': use_alpha},
+				'frames': len(frames),
+				'raw_bytes_per_frame': round(raw_bytes / len(frames), 1),
+				'rle_bytes_per_frame': round(rle_bytes / len(frames), 1),
+				'rle_ratio': round(rle_bytes / raw_bytes, 3),
+				'rle_rows_pct': round(rle_rows / (tile_count * display_res[0]) * 100, 1),
+				'encode_us_per_tile': round(encode_time / tile_count * 1e6, 1),
+				'per_sec': round(tile_count / encode_time, 2)
+			})
+
+	return results
+
+
+def fake_gen_img(prompt):
+	"""A stand-in for the AI image generator (see sources.load_ai()):
+	return a 256x256 image drawn from the prompt, after GEN_IMG_DELAY
+	seconds."""
+
+	time.sleep(GEN_IMG_DELAY)
+	return make_frames((256, 256), count=1, seed=zlib.crc32(prompt.encode()))[0]
+
+
+def bench_image_cache(font_pal, wall_shapes, display_res, min_time):
+	"""Show a 1080p still image and a generated image on walls: on a
+	cold cache (read or generated, then converted), from the disk cache
+	alone (as after a restart) and from memory."""
+
+	results = []
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		img_path = os.path.join(tmp_dir, 'slide.png')
+		cv2.imwrite(img_path, make_frames((1080, 1920), count=1)[0])
+
+		for wall_shape in wall_shapes:
+			wall = VideoWall(wall_shape, display_res)
+			for source, show in (
+				('image', lambda cache: cache.get_file_tiles(img_path, wall, font_pal)),
+				('prompt', lambda cache: cache.get_prompt_tiles('a lighthouse at dusk', fake_gen_img, wall, font_pal))
+			):
+				cache_dir = os.path.join(tmp_dir, f'{source}-{wall_shape[0]}x{wall_shape[1]}')
+
+				start_ts = time.perf_counter()
+				cache = ImageCache(cache_dir=cache_dir)
+				show(cache)
+				cold_time = time.perf_counter() - start_ts
+
+				disk_times = []
+				for _ in range(5):
+					start_ts = time.perf_counter()
+					show(ImageCache(cache_dir=cache_dir))
+					disk_times.append(time.perf_counter() - start_ts)
+
+				results.append({
+					'name': 'image_cache',
+					'params': {'source': source, 'wall_shape': list(wall_shape), 'display_res': list(display_res)},
+					'cold_ms': round(cold_time * 1000, 2),
+					'disk_ms': round(statistics.median(disk_times) * 1000, 4),
+					**measure(lambda: show(cache), min_time)
+				})
+
+	return results
+
+
+def get_result_key(result):
+	return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(old_results, results):
+	"""Print the change of each result against the same result of a
+	previous run."""
+
+	old_results = {get_result_key(result): result for result in old_results}
+	for result in results:
+		old_result = old_results.get(get_result_key(result))
+		if old_result is None:
+			continue
+		metric = 'fps' if 'fps' in result else 'per_sec'
+		old_value, value = old_result[metric], result[metric]
+		change = ((value / old_value) - 1) * 100 if old_value else 0
+		print(f'{result["name"]}\t{json.dumps(result["params"])}\t{metric}: {old_value} -> {value} ({change:+.1f}%)', file=sys.stderr)
+
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(add_help=False)
+	argparser.add_argument('--help', action='help', help='Show this help message and exit')
+	argparser.add_argument('--quick', action='store_true', help='Fewer cases and shorter measures, for a quick check')
+	argparser.add_argument('--only', type=str, default='quantize,resize,decode,broadcast,e2e,wire,image_cache', help='Comma separated benchmarks to run')
+	argparser.add_argument('--media_dir', type=str, default=DEFAULT_MEDIA_DIR, help='Directory of the example media measured by the wire benchmark')
+	argparser.add_argument('--video', type=str, nargs='+', default=[], help='Videos to decode (a synthetic 1080p MJPG video by default)')
+	argparser.add_argument('--ffmpeg_path', type=str, default='ffmpeg', help='ffmpeg executable')
+	argparser.add_argument('--lut_bits', type=int, nargs='+', default=[8, 0], help='Bits per channel of the color lookup table to measure (0 = no table)')
+	argparser.add_argument('--output', '-o', type=str, default='', help='JSON file to write the results to (stdout by default)')
+	argparser.add_argument('--compare', type=str, default='', help='JSON file of a previous run to compare the results against')
+	argparser.add_argument('font_tex_path', type=str, nargs='?', default=DEFAULT_FONT_TEX_PATH, help='Font texture path')
+	args = argparser.parse_args(sys.argv[1:])
+
+	benches = args.only.split(',')
+	min_time = 0.05 if args.quick else 0.2
+	display_res = (63, 63)
+	font_pal = get_font_palette(args.font_tex_path, 96, True, max(args.lut_bits))
+
+	results = []
+	if 'quantize' in benches:
+		results += bench_quantize(
+			args.font_tex_path,
+			[16, 96] if args.quick else [16, 32, 64, 96],
+			[31, 63],
+			args.lut_bits,
+			(4, 4),
+			min_time
+		)
+	if 'resize' in benches:
+		results += bench_resize(
+			[(480, 640), (1080, 1920)],
+			[(1, 1), (4, 4)] if args.quick else [(1, 1), (2, 2), (4, 4), (8, 8)],
+			display_res,
+			min_time
+		)
+	if 'decode' in benches:
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			video_paths = args.video
+			if not video_paths:
+				video_paths = [os.path.join(tmp_dir, 'synthetic_1080p.avi')]
+				make_video(video_paths[0], (1080, 1920), 60 if args.quick else 240)
+
+			results += bench_decode(
+				video_paths,
+				[(1, 1), (4, 4)] if args.quick else [(1, 1), (2, 2), (4, 4), (8, 8)],
+				display_res,
+				args.ffmpeg_path,
+				60 if args.quick else 240
+			)
+	if 'broadcast' in benches:
+		results += bench_broadcast(
+			font_pal,
+			[(1, 1), (4, 4)] if args.quick else [(1, 1), (2, 2), (4, 4), (8, 8)],
+			[1, 4] if args.quick else [1, 4, 16],
+			display_res,
+			min_time
+		)
+	if 'e2e' in benches:
+		results += bench_e2e(
+			font_pal,
+			[(1, 1), (4, 4)] if args.quick else [(1, 1), (2, 2), (4, 4), (8, 8)],
+			display_res,
+			(480, 640),
+			1 if args.quick else 3
+		)
+
+	if 'wire' in benches:
+		results += bench_wire(args.font_tex_path, args.media_dir, display_res, 30 if args.quick else 300)
+	if 'image_cache' in benches:
+		results += bench_image_cache(
+			font_pal,
+			[(1, 1), (4, 4)] if args.quick else [(1, 1), (2, 2), (4, 4), (8, 8)],
+			display_res,
+			min_time
+		)
+
+	report = {
+		'meta': {
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(),
+			'numpy': np.__version__,
+			'cv2': cv2.__version__,
+			'platform': platform.platform(),
+			'cpu_count': os.cpu_count(),
+			'args': vars(args)
+		},
+		'results': results
+	}
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent='\t')
+	else:
+		json.dump(report, sys.stdout, indent='\t')
+		print()
+
+	if args.compare:
+		with open(args.compare) as f:
+			compare(json.load(f)['results'], results)
\ No newline at end of file
@@ -0,0 +1,218 @@
+"""
+Capture the traffic of the streamer to a binary file, so that a run can
+be replayed exactly (see replay.py): the frame datagrams sent to the
+displays and the control messages received (the datagrams of the map and
+of the displays, and the commands typed on stdin).
+
+	magic (8 bytes) | header size (4 bytes) | header (JSON) | records
+
+The header holds the arguments of the streamer and its working
+directory. Each record is:
+
+	kind (1 byte) | time (8 bytes) | payload size (4 bytes) | payload
+
+the time being in seconds since the capture started. The payload of a
+frame datagram (DATAGRAM) is the address of the display, its group, its
+position, its resolution and the index of the datagram in its frame (a
+frame may be sent in several datagrams) followed by the datagram, the
+payload of a control message (CONTROL) is the address it came from
+followed by the message, the payload of a command (COMMAND) is the
+command line.
+"""
+
+import os
+import json
+import time
+import struct
+import threading
+from collections import namedtuple
+
+
+
+MAGIC = b'VSPCAPTR'
+VERSION = 1
+
+DATAGRAM = 1
+CONTROL = 2
+COMMAND = 3
+
+HEADER_SIZE = struct.Struct('<I')
+RECORD_HEADER = struct.Struct('<BdI')
+PORT = struct.Struct('<H')
+# Position (row, col) and resolution (rows, cols) of a display, and the
+# index of a datagram in its frame.
+DISPLAY = struct.Struct('<hhBBH')
+
+# The position of a display which is not registered (anymore).
+UNKNOWN_POSITION = (-1, -1)
+
+
+# A record of a capture, the fields which don't apply to its kind are
+# None.
+Record = namedtuple('Record', ['kind', 'ts', 'addr', 'group', 'position', 'display_res', 'part', 'data'])
+
+
+def pack_str(text):
+	data = text.encode()
+	return bytes([len(data)]) + data
+
+
+def unpack_str(data, offset):
+	size = data[offset]
+	return data[offset + 1:offset + 1 + size].decode(), offset + 1 + size
+
+
+def pack_addr(addr):
+	return pack_str(addr[0]) + PORT.pack(addr[1])
+
+
+def unpack_addr(data, offset):
+	host, offset = unpack_str(data, offset)
+	port, = PORT.unpack_from(data, offset)
+	return (host, port), offset + PORT.size
+
+
+class CaptureWriter:
+	"""Write the records of a capture to a file. It can be used from any
+	thread."""
+
+	def __init__(self, path, header=None):
+		self.path = path
+		self.file = open(path, 'wb', buffering=1 << 20)
+		self.lock = threading.Lock()
+		self.start_ts = time.monotonic()
+		self.record_count = 0
+
+		header = json.dumps({
+			'version': VERSION,
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'cwd': os.getcwd(),
+			**(header or {})
+		}).encode()
+		self.file.write(MAGIC + HEADER_SIZE.pack(len(header)) + header)
+
+
+	def write(self, kind, payload):
+		with self.lock:
+			if self.file is None:
+				return
+			self.file.write(RECORD_HEADER.pack(kind, time.monotonic() - self.start_ts, len(payload)))
+			self.file.write(payload)
+			self.record_count += 1
+
+
+	def write_datagram(self, addr, group, position, display_res, part, data):
+		self.write(DATAGRAM, pack_addr(addr) + pack_str(group) + DISPLAY.pack(*position, *display_res, part) + data)
+
+
+	def write_control(self, addr, data):
+		self.write(CONTROL, pack_addr(addr) + data)
+
+
+	def write_command(self, line):
+		self.write(COMMAND, line.encode())
+
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+
+class CaptureReader:
+	"""Read the records of a capture file."""
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, 'rb') as f:
+			if f.read(len(MAGIC)) != MAGIC:
+				raise ValueError('Not a capture file')
+			size, = HEADER_SIZE.unpack(f.read(HEADER_SIZE.size))
+			self.header = json.loads(f.read(size))
+			self.records_offset = f.tell()
+		if self.header['version'] != VERSION:
+			raise ValueError('Unsupported capture version')
+
+
+	def records(self, kinds=None):
+		"""Yield the records, of the given kinds only if any (the others
+		don't get read)."""
+
+		with open(self.path, 'rb', buffering=1 << 20) as f:
+			f.seek(self.records_offset)
+			while True:
+				record_header = f.read(RECORD_HEADER.size)
+				if len(record_header) < RECORD_HEADER.size:
+					# The end, or a capture cut short.
+					return
+				kind, ts, size = RECORD_HEADER.unpack(record_header)
+				if kinds and (kind not in kinds):
+					f.seek(size, os.SEEK_CUR)
+					continue
+
+				payload = f.read(size)
+				if len(payload) < size:
+					return
+
+				if kind == DATAGRAM:
+					addr, offset = unpack_addr(payload, 0)
+					group, offset = unpack_str(payload, offset)
+					row, col, res_rows, res_cols, part = DISPLAY.unpack_from(payload, offset)
+					yield Record(kind, ts, addr, group, (row, col), (res_rows, res_cols), part, payload[offset + DISPLAY.size:])
+				elif kind == CONTROL:
+					addr, offset = unpack_addr(payload, 0)
+					yield Record(kind, ts, addr, None, None, None, None, payload[offset:])
+				elif kind == COMMAND:
+					yield Record(kind, ts, None, None, None, None, None, payload)
+
+
+	def __iter__(self):
+		return self.records()
+
+
+class CaptureSender:
+	"""A sender recording the datagrams handed to it to a capture before
+	passing them on to another sender (see fanout.py), if any.
+
+	describe is a callable taking the address of a display and returning
+	its group, its position and its resolution, or None if it's not
+	registered."""
+
+	def __init__(self, writer, describe, sender=None):
+		self.writer = writer
+		self.describe = describe
+		self.sender = sender
+
+
+	@property
+	def counters(self):
+		return getattr(self.sender, 'counters', {})
+
+
+	def sendto(self, data, addr):
+		self.sendmany([data], addr)
+
+
+	def sendmany(self, datagrams, addr):
+		if self.writer:
+			group, position, display_res = self.describe(addr) or ('', UNKNOWN_POSITION, (0, 0))
+			for part, data in enumerate(datagrams):
+				self.writer.write_datagram(addr, group, position, display_res, part, data)
+
+		if self.sender:
+			self.sender.sendmany(datagrams, addr)
+
+
+	def is_pending(self, addr):
+		return bool(self.sender and self.sender.is_pending(addr))
+
+
+	def forget(self, addr):
+		if self.sender:
+			self.sender.forget(addr)
+
+
+	def close(self):
+		if self.sender:
+			self.sender.close()
\ No newline at end of file
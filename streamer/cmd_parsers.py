@@ -2,18 +2,40 @@ import argparse
 
 
 
+def non_negative_int(value):
+	"""An int argument which can't be negative."""
+	number = int(value)
+	if number < 0:
+		raise argparse.ArgumentTypeError(f'{value} is negative')
+	return number
+
+
 # Main program arguments.
 main_parser = argparse.ArgumentParser(add_help=False)
 main_parser.add_argument('--help', action='help', help='Show this help message and exit')
 main_parser.add_argument('--host', type=str, default='127.0.0.1')
 main_parser.add_argument('--port', type=int, default=6789)
 main_parser.add_argument('--verbose', '-v', action='store_true')
+main_parser.add_argument('--cache_dir', type=str, default='', help='Directory of the videos cached with "stream --cache" (glyph_cache next to the streamer by default)')
+main_parser.add_argument('--cache_size', type=int, default=4096, help='Max size of the cached videos in MiB, the least recently played ones get removed first')
+main_parser.add_argument('--image_cache_size', type=int, default=64, help='Max size in MiB of the still and generated images kept in memory converted for the walls, so that showing one again is instant (0 = none kept)')
+main_parser.add_argument('--image_cache_dir', type=str, default='', help='Directory the converted still and generated images get saved to as well, so that they survive a restart (none by default)')
+main_parser.add_argument('--image_cache_disk_size', type=int, default=1024, help='Max size of --image_cache_dir in MiB, the least recently shown images get removed first')
+main_parser.add_argument('--capture', type=str, default='', help='Record the frame datagrams sent and the control messages received to this file, to be replayed with replay.py')
+main_parser.add_argument('--replay', type=str, default='', help='Re-drive the control messages of a capture file rather than waiting for clients, the frames get captured (see --capture) instead of sent, used by "replay.py check"')
+main_parser.add_argument('--state_file', type=str, default='', help='Save the walls, the displays and the streams to this file as they change, and resume them from it when starting, so that a restart doesn\'t wait for the next map (none by default)')
+main_parser.add_argument('--metrics_port', type=int, default=0, help='Serve the metrics over HTTP on this port, at /metrics (Prometheus) and /metrics.json (0 = disabled)')
+main_parser.add_argument('--ffmpeg_path', type=str, default='ffmpeg', help='ffmpeg executable, used by "stream --decoder ffmpeg"')
+main_parser.add_argument('--preload', nargs='*', default=[], choices=['ai', 'youtube', 'camera'], help='Frame source backends to load at startup rather than when a stream first needs them')
+main_parser.add_argument('--metrics_host', type=str, default='127.0.0.1', help='Address the metrics are served on')
+main_parser.add_argument('--display_budget', type=float, default=0, help='Bandwidth budget of each display in KiB per second, a display over its budget skips frames (0 = no limit), a wall can set its own in SERVER INIT')
+main_parser.add_argument('--max_datagram_size', type=int, default=0, help='Max size of the datagrams sent to the displays, larger frames get split in chunks of rows (0 = a frame per datagram), a wall can set its own in SERVER INIT')
 
 
 # Commands and arguments that can be received by either clients or stdin
 # at run-time.
 
-# CMD: send
+# CMD: stream
 
 cmd_stream_parser = argparse.ArgumentParser(prog='stream', add_help=False)
 cmd_stream_parser.add_argument('--help', action='help', help='Show this help message')
@@ -29,4 +51,39 @@ cmd_stream_mutex_group.add_argument('--ai_prompt', '--ai', type=str, default='',
 # when reading them from an imported texture.
 cmd_stream_parser.add_argument('--glyph_count', type=int, default=96, help='Glyphs count (alpha character included)')
 cmd_stream_parser.add_argument('--use_alpha', action='store_true', help='Use the alpha color')
-cmd_stream_parser.add_argument('font_tex_path', type=str, help='Font texture path')
\ No newline at end of file
+cmd_stream_parser.add_argument('--fps', type=float, default=0, help='Max frames per second to send (0 = no limit)')
+cmd_stream_parser.add_argument('--delta', action='store_true', help='Send only the rows which changed (the displays must support delta frames)')
+cmd_stream_parser.add_argument('--rle', action='store_true', help='Run-length encode the frames when it makes them smaller (the displays must support run-length encoded frames)')
+cmd_stream_parser.add_argument('--keyframe_interval', type=float, default=2, help='Seconds between whole frames when sending only the changed rows')
+cmd_stream_parser.add_argument('--refresh_interval', type=float, default=1, help='Seconds before sending again a tile which didn\'t change (0 = always send)')
+cmd_stream_parser.add_argument('--cache', action='store_true', help='Play a local video from the glyph cache, converting it for the wall the first time (see glyph_cache.py)')
+cmd_stream_parser.add_argument('--decoder', type=str, default='cv2', choices=['cv2', 'ffmpeg'], help='Decode the videos with OpenCV, or with ffmpeg at the wall resolution which takes less CPU (OpenCV is used if ffmpeg is not found)')
+cmd_stream_parser.add_argument('--no_share', action='store_true', help='Decode the source for this group alone, even if another group plays it already (a video then starts from the beginning rather than in sync)')
+cmd_stream_parser.add_argument('--decode_queue', type=int, default=4, help='Frames decoded ahead of the conversion, a larger queue absorbs slower frames at the cost of memory')
+cmd_stream_parser.add_argument('--convert_queue', type=int, default=2, help='Frames converted ahead of the sending')
+cmd_stream_parser.add_argument('--workers', type=non_negative_int, default=0, help='Worker processes converting the frames, useful for large video walls (0 = convert in the streamer process)')
+cmd_stream_parser.add_argument('--lut_bits', type=int, default=8, choices=range(9), metavar='{0..8}', help='Bits per channel of the color lookup table, lower values use less memory but are less exact (0 = no table)')
+cmd_stream_parser.add_argument('font_tex_path', type=str, help='Font texture path')
+
+
+# CMD: stop
+
+cmd_stop_parser = argparse.ArgumentParser(prog='stop', add_help=False)
+cmd_stop_parser.add_argument('--help', action='help', help='Show this help message')
+cmd_stop_parser.add_argument('--group', '-g', type=str, default=None, help='Video wall group (all the groups if not set)')
+
+
+# CMD: budget
+
+cmd_budget_parser = argparse.ArgumentParser(prog='budget', add_help=False)
+cmd_budget_parser.add_argument('--help', action='help', help='Show this help message')
+cmd_budget_parser.add_argument('--group', '-g', type=str, default=None, help='Video wall group (all the groups if not set)')
+cmd_budget_parser.add_argument('kib_per_sec', type=float, help='Bandwidth budget of each display in KiB per second (0 = no limit)')
+
+
+# CMD: stats
+
+cmd_stats_parser = argparse.ArgumentParser(prog='stats', add_help=False)
+cmd_stats_parser.add_argument('--help', action='help', help='Show this help message')
+cmd_stats_parser.add_argument('--group', '-g', type=str, default=None, help='Video wall group (all the groups if not set)')
+cmd_stats_parser.add_argument('--json', action='store_true', help='Print the metrics as JSON')
\ No newline at end of file
@@ -0,0 +1,425 @@
+"""
+Simulated Unreal displays, to load-test the streamer without running the
+game.
+
+It plays the part of VSPDisplayServerLink (SERVER INIT with the walls of
+the groups, SERVER CMD) and of a VSPDisplayClientLink for each display
+(CLIENT INIT, a HEARTBEAT every 5 seconds, each display from its own
+port), and decodes the received frames into frame lines the way
+VSPDisplayManager.setFrame() does (see frame_codec.FrameDecoder).
+
+	py display_sim.py [--groups 4] [--shape 2 2] [--displays_per_tile 8] [--duration 10] [--stream "args" | --marker font_tex_path]
+
+It reports, for each display, the frames received per second, the jitter
+(standard deviation of the time between frames) and the frames which
+weren't valid, then a summary for each group and for all the displays.
+
+With --marker, each group plays a generated GIF whose frames are each a
+solid color of the palette, so that a display can tell which frame it
+received: the report then includes the frames lost (never received) and
+the latency, i.e. how late a frame arrived compared to its presentation
+time. The latency doesn't include the streamer's start-up time, the
+smallest lag observed on the displays of a group counts as no
+latency.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import selectors
+import statistics
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from frame_codec import FrameDecoder, CHUNK_MARKER
+
+
+
+# The interval between the heartbeats of a display, like
+# VSPDisplayClientLink.
+HEARTBEAT_INTERVAL = 5
+# The min distance between the colors of the marker frames, so that the
+# frames can be told apart once compressed and converted.
+MARKER_MIN_COLOR_DIST = 48
+
+
+def raise_open_files_limit():
+	"""Allow as many sockets as possible, each display has its own."""
+	try:
+		import resource
+		soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+		if soft < hard:
+			resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+	except (ImportError, ValueError, OSError):
+		# Windows, or not allowed.
+		pass
+
+
+def percentile(values, pct):
+	if not values:
+		return None
+	return float(np.percentile(values, pct))
+
+
+class SimDisplay:
+	"""A simulated remote display, with its own socket."""
+
+	def __init__(self, group, position, display_res, streamer_addr, host='127.0.0.1'):
+		self.group = group
+		self.position = position
+		self.streamer_addr = streamer_addr
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.bind((host, 0))
+		self.sock.setblocking(False)
+		self.decoder = FrameDecoder(*display_res)
+		self.display_res = display_res
+
+		self.next_heartbeat_ts = None
+		self.arrival_ts = []
+		self.received_bytes = 0
+		self.invalid = 0
+		# The index of each marker frame received, and the time it
+		# arrived at.
+		self.marker_frames = []
+
+
+	def send(self, data):
+		self.sock.sendto(json.dumps(data).encode(), self.streamer_addr)
+
+
+	def send_init(self):
+		self.send({'role': 'CLIENT', 'type': 'INIT', 'group': self.group, 'position': list(self.position)})
+
+
+	def send_heartbeat(self):
+		self.send({'role': 'CLIENT', 'type': 'HEARTBEAT'})
+
+
+	def receive(self, now, markers=None):
+		"""Receive the pending datagrams."""
+
+		while True:
+			try:
+				data = self.sock.recv(65536)
+			except (BlockingIOError, ConnectionResetError):
+				return
+
+			self.received_bytes += len(data)
+			reassembler = self.decoder.reassembler
+			frames = reassembler.frames
+			frame_lines = self.decoder.decode(data)
+			if (data[:1] == bytes([CHUNK_MARKER])) and (reassembler.frames == frames):
+				# A chunk which didn't complete a frame.
+				continue
+			self.arrival_ts.append(now)
+
+			if any(len(line) != self.display_res[1] for line in frame_lines):
+				# Missing or truncated rows.
+				self.invalid += 1
+			elif markers:
+				markers.identify(self, frame_lines, now)
+
+
+	def report(self, duration):
+		intervals = np.diff(self.arrival_ts) if len(self.arrival_ts) > 1 else []
+		return {
+			'group': self.group,
+			'position': list(self.position),
+			'port': self.sock.getsockname()[1],
+			'frames': len(self.arrival_ts),
+			'fps': round(len(self.arrival_ts) / duration, 2),
+			'kbytes_per_sec': round(self.received_bytes / duration / 1024, 2),
+			'interval_ms': round(float(np.mean(intervals)) * 1000, 3) if len(intervals) else None,
+			'jitter_ms': round(float(np.std(intervals)) * 1000, 3) if len(intervals) else None,
+			'invalid': self.invalid,
+			# The frames sent in chunks which never got complete.
+			'incomplete': self.decoder.reassembler.dropped_frames
+		}
+
+
+	def close(self):
+		self.sock.close()
+
+
+class MarkerVideo:
+	"""A GIF whose frames are solid colors of the palette, so that the
+	frames can be identified once received."""
+
+	def __init__(self, font_tex_path, glyph_count, use_alpha, fps, duration):
+		# Import here, the palette is needed only for the markers.
+		from font_palette import FontPalette
+
+		font_pal = FontPalette(font_tex_path, glyph_count, use_alpha, lut_bits=0)
+
+		# Pick the colors far enough from each other, among the ones
+		# converted to their own glyph.
+		self.colors = []
+		glyphs = []
+		for bgr in font_pal.bgr:
+			glyph = font_pal.quantize(np.reshape(bgr, (1, 1, 3)).astype(np.uint8))[0, 0]
+			if glyph in glyphs:
+				continue
+			if all(np.linalg.norm(bgr.astype(float) - color) >= MARKER_MIN_COLOR_DIST for color in self.colors):
+				self.colors.append(bgr.astype(float))
+				glyphs.append(glyph)
+		if len(self.colors) < 3:
+			raise ValueError('The palette has too few distinct colors for the markers')
+
+		# Glyph -> index of the color in the sequence.
+		self.color_idxs = {int(glyph): idx for idx, glyph in enumerate(glyphs)}
+		self.fps = fps
+		self.frame_count = int(duration * fps)
+
+		fd, self.path = tempfile.mkstemp(suffix='.gif', prefix='vsp_markers_')
+		os.close(fd)
+		frames = [
+			Image.new('RGB', (64, 64), tuple(int(c) for c in self.colors[i % len(self.colors)][::-1]))
+			for i in range(self.frame_count)
+		]
+		frames[0].save(
+			self.path,
+			save_all=True,
+			append_images=frames[1:],
+			duration=round(1000 / fps),
+			loop=0,
+			optimize=False
+		)
+
+		self.start_ts = None
+		# Group -> the lag of each frame received by the group's
+		# displays compared to its presentation time, from start_ts.
+		self.lags = {}
+
+
+	def identify(self, display, frame_lines, now):
+		"""Tell which frame a display received and record it."""
+
+		color_idx = self.color_idxs.get(frame_lines[0][0])
+		if color_idx is None:
+			# Not a marker (e.g. the blank frame at the end).
+			return
+
+		# Assume the frames move forward by less than a full cycle of
+		# colors since the previous one.
+		period = len(self.colors)
+		if display.marker_frames:
+			last_idx = display.marker_frames[-1][0]
+			frame_idx = last_idx + ((color_idx - last_idx) % period)
+		else:
+			frame_idx = color_idx
+
+		if display.marker_frames and (frame_idx == display.marker_frames[-1][0]):
+			# The same frame again (refreshed).
+			return
+
+		display.marker_frames.append((frame_idx, now))
+		if self.start_ts is not None:
+			self.lags.setdefault(display.group, []).append(now - self.start_ts - (frame_idx / self.fps))
+
+
+	def report(self, display):
+		"""The frames lost by a display, between the first and the last
+		ones it received."""
+
+		if not display.marker_frames:
+			return {'lost': None}
+
+		idxs = [frame_idx for frame_idx, _ in display.marker_frames]
+		expected = idxs[-1] - idxs[0] + 1
+		return {
+			'lost': expected - len(idxs),
+			'loss': round((expected - len(idxs)) / expected, 4)
+		}
+
+
+	def get_latency(self):
+		"""The latency of each frame received by the displays, in ms.
+
+		Each group started playing at its own time, so the lags are
+		compared within each group."""
+
+		latency = []
+		for lags in self.lags.values():
+			min_lag = min(lags)
+			latency += [(lag - min_lag) * 1000 for lag in lags]
+		return latency
+
+
+	def remove(self):
+		try:
+			os.remove(self.path)
+		except OSError:
+			pass
+
+
+def summarize(reports):
+	fps = [report['fps'] for report in reports]
+	jitters = [report['jitter_ms'] for report in reports if report['jitter_ms'] is not None]
+	summary = {
+		'displays': len(reports),
+		'fps_mean': round(statistics.mean(fps), 2) if fps else None,
+		'fps_min': min(fps) if fps else None,
+		'fps_p5': round(percentile(fps, 5), 2) if fps else None,
+		'jitter_ms_mean': round(statistics.mean(jitters), 3) if jitters else None,
+		'jitter_ms_max': max(jitters) if jitters else None,
+		'invalid': sum(report['invalid'] for report in reports),
+		'incomplete': sum(report['incomplete'] for report in reports),
+		'silent_displays': sum(1 for report in reports if not report['frames'])
+	}
+	lost = [report['lost'] for report in reports if report.get('lost') is not None]
+	if lost:
+		summary['lost'] = sum(lost)
+	return summary
+
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(add_help=False)
+	argparser.add_argument('--help', action='help', help='Show this help message and exit')
+	argparser.add_argument('--host', type=str, default='127.0.0.1', help='Streamer host')
+	argparser.add_argument('--port', type=int, default=6789, help='Streamer port')
+	argparser.add_argument('--groups', type=int, default=1, help='Video wall groups, named sim1, sim2...')
+	argparser.add_argument('--shape', type=int, nargs=2, default=[1, 1], metavar=('ROWS', 'COLS'), help='Shape of the wall of each group')
+	argparser.add_argument('--display_res', type=int, nargs=2, default=[63, 63], metavar=('ROWS', 'COLS'), help='Resolution of each display')
+	argparser.add_argument('--max_datagram_size', type=int, default=0, help='Max size of the datagrams sent to the displays, larger frames get split in chunks (0 = the streamer\'s setting)')
+	argparser.add_argument('--display_budget', type=float, default=0, help='Bandwidth budget of each display in KiB per second (0 = the streamer\'s setting)')
+	argparser.add_argument('--displays_per_tile', type=int, default=1, help='Displays showing each tile of a wall')
+	argparser.add_argument('--init_rate', type=float, default=1000, help='Displays registered per second (0 = all at once)')
+	argparser.add_argument('--duration', type=float, default=10, help='Seconds to receive the frames for')
+	argparser.add_argument('--no_server_init', action='store_true', help='Don\'t send the walls (a server sent them already), the groups must exist')
+	argparser.add_argument('--stream', type=str, default='', help='Arguments of a "stream" command sent to each group (-g is added)')
+	argparser.add_argument('--marker', type=str, default='', metavar='FONT_TEX_PATH', help='Stream marker frames to each group to measure the loss and the latency')
+	argparser.add_argument('--marker_fps', type=float, default=25, help='Frames per second of the marker frames')
+	argparser.add_argument('--glyph_count', type=int, default=96, help='Glyphs count of the marker stream')
+	argparser.add_argument('--use_alpha', action='store_true', help='Use the alpha color in the marker stream')
+	argparser.add_argument('--output', '-o', type=str, default='', help='JSON file to write the report to (stdout by default)')
+	args = argparser.parse_args(sys.argv[1:])
+
+	raise_open_files_limit()
+
+	streamer_addr = (args.host, args.port)
+	server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	groups = [f'sim{i + 1}' for i in range(args.groups)]
+
+	if not args.no_server_init:
+		# Like VSPDisplayServerLink.sendInit().
+		server_sock.sendto(json.dumps({
+			'role': 'SERVER',
+			'type': 'INIT',
+			'walls': [
+				{
+					'group': group,
+					'shape': args.shape,
+					'display_res': args.display_res,
+					**({'max_datagram_size': args.max_datagram_size} if args.max_datagram_size else {}),
+					**({'display_budget': args.display_budget} if args.display_budget else {})
+				}
+				for group in groups
+			]
+		}).encode(), streamer_addr)
+		time.sleep(0.1)
+
+	displays = []
+	for group in groups:
+		for position in np.ndindex(*args.shape):
+			for _ in range(args.displays_per_tile):
+				displays.append(SimDisplay(group, position, args.display_res, streamer_addr))
+
+	selector = selectors.DefaultSelector()
+	now = time.monotonic() + (len(displays) / args.init_rate if args.init_rate else 0)
+	for idx, display in enumerate(displays):
+		selector.register(display.sock, selectors.EVENT_READ, display)
+		display.send_init()
+		if args.init_rate:
+			# Don't overflow the streamer's receive buffer.
+			time.sleep(1 / args.init_rate)
+		# Spread the heartbeats.
+		display.next_heartbeat_ts = now + HEARTBEAT_INTERVAL * (idx / len(displays))
+	print(f'{len(displays)} displays registered in {len(groups)} group(s).', file=sys.stderr)
+
+	markers = None
+	stream_args = args.stream
+	if args.marker:
+		markers = MarkerVideo(args.marker, args.glyph_count, args.use_alpha, args.marker_fps, args.duration + 5)
+		stream_args = f'"{args.marker}" --vid "{markers.path}" --glyph_count {args.glyph_count} --refresh_interval 0'
+		if args.use_alpha:
+			stream_args += ' --use_alpha'
+
+	if stream_args:
+		# Give the displays' registration a head start.
+		time.sleep(0.1)
+		for group in groups:
+			server_sock.sendto(json.dumps({
+				'role': 'SERVER',
+				'type': 'CMD',
+				'cmd': 'stream',
+				'args': f'{stream_args} -g {group}'
+			}).encode(), streamer_addr)
+
+	start_ts = time.monotonic()
+	if markers:
+		markers.start_ts = start_ts
+	end_ts = start_ts + args.duration
+	try:
+		while True:
+			now = time.monotonic()
+			if now >= end_ts:
+				break
+
+			for key, _ in selector.select(min(0.1, end_ts - now)):
+				key.data.receive(time.monotonic(), markers)
+
+			now = time.monotonic()
+			for display in displays:
+				if now >= display.next_heartbeat_ts:
+					display.send_heartbeat()
+					display.next_heartbeat_ts += HEARTBEAT_INTERVAL
+
+	except KeyboardInterrupt:
+		args.duration = time.monotonic() - start_ts
+
+	if stream_args:
+		server_sock.sendto(json.dumps({'role': 'SERVER', 'type': 'CMD', 'cmd': 'stop', 'args': ''}).encode(), streamer_addr)
+
+	display_reports = []
+	for display in displays:
+		report = display.report(args.duration)
+		if markers:
+			report.update(markers.report(display))
+		display_reports.append(report)
+
+	report = {
+		'args': vars(args),
+		'summary': summarize(display_reports),
+		'groups': {
+			group: summarize([report for report in display_reports if report['group'] == group])
+			for group in groups
+		},
+		'displays': display_reports
+	}
+	if markers:
+		latency = markers.get_latency()
+		if latency:
+			report['summary'].update({
+				'latency_ms_mean': round(statistics.mean(latency), 3),
+				'latency_ms_p95': round(percentile(latency, 95), 3),
+				'latency_ms_max': round(max(latency), 3)
+			})
+		markers.remove()
+
+	for display in displays:
+		display.close()
+	selector.close()
+
+	print(json.dumps(report['summary']), file=sys.stderr)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent='\t')
+	else:
+		json.dump(report, sys.stdout, indent='\t')
+		print()
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+Send the frames to the displays without one display holding up the
+others: the datagrams get queued in a slot per display, where a newer
+datagram replaces the one not sent yet (the latest frame wins), and all
+the queued datagrams get flushed at once right after each tick of the
+event loop, through a non-blocking socket. A frame sent in several
+datagrams (see frame_codec.encode_chunks()) takes the slot as a whole.
+
+When the socket can't take more datagrams, the rest waits for the next
+flush, so the sender never falls behind by more than a frame per
+display, and a destination which errors (e.g. the Windows
+ConnectionResetError) is counted and skipped.
+FanoutSender quacks like a socket (sendto()), the displays use it as
+theirs.
+"""
+
+
+
+# The time to wait before flushing again when the socket is full.
+RETRY_INTERVAL = 0.001
+
+
+class SendCounters:
+	"""The datagrams of a display which didn't make it."""
+
+	__slots__ = ('dropped', 'errors', 'last_error')
+
+	def __init__(self):
+		# Replaced by a newer datagram before being sent.
+		self.dropped = 0
+		# Failed to be sent.
+		self.errors = 0
+		self.last_error = None
+
+
+	def to_dict(self):
+		return {'dropped': self.dropped, 'errors': self.errors, 'last_error': self.last_error}
+
+
+class FanoutSender:
+	"""Send the datagrams queued for many addresses in batches.
+
+	sock is the socket to send the datagrams from, it's made
+	non-blocking. It must be used from the event loop's thread."""
+
+	def __init__(self, sock, loop):
+		self.sock = sock
+		self.sock.setblocking(False)
+		self.loop = loop
+
+		# Address -> datagrams of a frame waiting to be sent.
+		self.pending = {}
+		# Address -> SendCounters.
+		self.counters = {}
+		self.flush_handle = None
+
+		# The times the socket was full.
+		self.would_block = 0
+
+
+	@classmethod
+	def from_transport(cls, transport, loop):
+		"""Return a sender using a duplicate of a datagram transport's
+		socket, so that the datagrams come from the address the
+		displays registered with."""
+		return cls(transport.get_extra_info('socket').dup(), loop)
+
+
+	def get_counters(self, addr):
+		counters = self.counters.get(addr)
+		if counters is None:
+			counters = self.counters[addr] = SendCounters()
+		return counters
+
+
+	def sendto(self, data, addr):
+		"""Queue a datagram for an address, replacing the one queued for
+		it if it wasn't sent yet. The datagram gets sent after the
+		current tick. Return its size, like socket.sendto()."""
+
+		self.sendmany([data], addr)
+		return len(data)
+
+
+	def sendmany(self, datagrams, addr):
+		"""Queue the datagrams of a frame (a list) for an address,
+		replacing the ones queued for it which weren't sent yet."""
+
+		queued = self.pending.get(addr)
+		if queued:
+			self.get_counters(addr).dropped += len(queued)
+		self.pending[addr] = datagrams
+
+		if self.flush_handle is None:
+			self.flush_handle = self.loop.call_soon(self.flush)
+
+
+	def is_pending(self, addr):
+		"""True if the last datagram queued for an address wasn't sent
+		yet, it may still get replaced."""
+		return addr in self.pending
+
+
+	def flush(self):
+		"""Send all the queued datagrams, until the socket is full."""
+
+		self.flush_handle = None
+		pending, self.pending = self.pending, {}
+		items = iter(pending.items())
+		sendto = self.sock.sendto
+
+		for addr, datagrams in items:
+			for idx, data in enumerate(datagrams):
+				try:
+					sendto(data, addr)
+
+				except BlockingIOError:
+					# Keep the rest for when the socket has room again.
+					self.pending = {addr: datagrams[idx:], **dict(items)}
+					self.would_block += 1
+					self.flush_handle = self.loop.call_later(RETRY_INTERVAL, self.flush)
+					return
+
+				except OSError as e:
+					counters = self.get_counters(addr)
+					counters.errors += 1
+					counters.last_error = str(e)
+
+
+	def forget(self, addr):
+		"""Drop the datagram and the counters of an address, when its
+		display goes away."""
+		self.pending.pop(addr, None)
+		self.counters.pop(addr, None)
+
+
+	def close(self):
+		"""Send what's left, as far as the socket takes it, and close
+		the socket."""
+
+		if self.flush_handle:
+			self.flush_handle.cancel()
+		self.flush()
+		if self.flush_handle:
+			self.flush_handle.cancel()
+			self.flush_handle = None
+		self.pending.clear()
+		self.sock.close()
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""
+A frame source decoding the videos with an ffmpeg subprocess which scales
+the frames to the resolution of the wall itself, so that 1080p or 4K
+frames don't get copied around only to be shrunk to a few dozen pixels
+afterwards.
+
+The frames come out of the pipe as raw BGR24 and get read into a ring of
+reused buffers rather than allocated one by one. The ring must hold the
+frames which are queued (see pipeline.py) or being converted while the
+next one gets read, hence buffer_count.
+FFmpegSource mimics cv2.VideoCapture (read(), grab(), get(), release())
+so that it plays through the same paths.
+"""
+
+import math
+import shutil
+import threading
+import subprocess as sp
+from collections import deque
+
+import numpy as np
+import cv2
+
+
+
+# The ffmpeg executable used when not specified.
+FFMPEG_PATH = 'ffmpeg'
+# The max time to wait for ffmpeg to exit once its output is closed.
+EXIT_TIMEOUT = 1
+
+
+class FFmpegError(Exception):
+	"""Raised when ffmpeg fails to decode a video."""
+
+
+def find_ffmpeg(ffmpeg_path=FFMPEG_PATH):
+	"""Return the path of the ffmpeg executable, None if it's not
+	found."""
+	return shutil.which(ffmpeg_path)
+
+
+def probe_video(path):
+	"""Return the frame rate (0 if unknown) and the resolution (None if
+	unknown) of a video. Only the header gets read."""
+
+	cap = cv2.VideoCapture(path)
+	try:
+		res = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+		return cap.get(cv2.CAP_PROP_FPS), (res if all(res) else None)
+	finally:
+		cap.release()
+
+
+def get_fast_decode_options(src_res, res):
+	"""Return the ffmpeg input options trading the details a wall much
+	smaller than the video can't show for decoding speed: decoding at
+	1/2, 1/4 or 1/8 of the size (JPEG based codecs) and skipping the
+	deblocking filter (H.264)."""
+
+	scale = min(src_res[0] / res[0], src_res[1] / res[1])
+	if scale < 2:
+		return []
+	return [
+		'-lowres', str(min(int(math.log2(scale)), 3)),
+		'-skip_loop_filter', 'all',
+		'-flags2', '+fast'
+	]
+
+
+class FFmpegSource:
+	"""Decode a video (local path or URL) with ffmpeg, scaled to res
+	(rows, cols).
+
+	fps is the frame rate of the video, as ffmpeg outputs every frame it
+	decodes as is. src_res is the resolution of the video, if known the
+	decoding gets faster when the wall is much smaller (see
+	get_fast_decode_options()). headers are the optional HTTP headers to
+	request a URL with."""
+
+	def __init__(self, path, res, ffmpeg_path=FFMPEG_PATH, fps=0, buffer_count=2, src_res=None, headers=None):
+		self.path = path
+		self.res = tuple(res)
+		self.fps = fps
+		self.frame_size = self.res[0] * self.res[1] * 3
+
+		self.buffers = [np.empty((*self.res, 3), dtype=np.uint8) for _ in range(max(buffer_count, 1))]
+		self.views = [memoryview(buffer).cast('B') for buffer in self.buffers]
+		self.buffer_idx = 0
+		self.frame_count = 0
+
+		cmd = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin']
+		if src_res:
+			cmd += get_fast_decode_options(src_res, self.res)
+		if headers:
+			cmd += ['-headers', ''.join(f'{key}: {value}\r\n' for key, value in headers.items())]
+		cmd += [
+			'-i', path,
+			# Video only.
+			'-an', '-sn', '-dn',
+			'-vf', f'scale={self.res[1]}:{self.res[0]}:flags=bilinear',
+			# One output frame per decoded frame, the pacer times
+			# them.
+			'-vsync', 'passthrough',
+			'-f', 'rawvideo',
+			'-pix_fmt', 'bgr24',
+			'pipe:1'
+		]
+		self.proc = sp.Popen(cmd, stdin=sp.DEVNULL, stdout=sp.PIPE, stderr=sp.PIPE, bufsize=0)
+		self.released = False
+
+		# The last lines ffmpeg printed, to report its errors. Its
+		# output gets drained so that it never blocks on it.
+		self.errors = deque(maxlen=4)
+		self.stderr_thread = threading.Thread(target=self.drain_stderr, name='ffmpeg-stderr', daemon=True)
+		self.stderr_thread.start()
+
+
+	def drain_stderr(self):
+		for line in self.proc.stderr:
+			line = line.decode(errors='replace').strip()
+			if line:
+				self.errors.append(line)
+
+
+	def isOpened(self):
+		return not self.released
+
+
+	def get(self, prop_id):
+		if prop_id == cv2.CAP_PROP_FPS:
+			return self.fps
+		if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+			return self.res[1]
+		if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+			return self.res[0]
+		return 0
+
+
+	def read_into(self, view):
+		"""Fill a buffer with the next frame. Return False at the end of
+		the video, raise FFmpegError if ffmpeg failed."""
+
+		pos = 0
+		while pos < self.frame_size:
+			count = self.proc.stdout.readinto(view[pos:])
+			if not count:
+				break
+			pos += count
+
+		if pos == self.frame_size:
+			self.frame_count += 1
+			return True
+
+		try:
+			returncode = self.proc.wait(EXIT_TIMEOUT)
+		except sp.TimeoutExpired:
+			returncode = None
+		if returncode and not self.released:
+			self.stderr_thread.join(EXIT_TIMEOUT)
+			raise FFmpegError(self.errors[-1] if self.errors else f'ffmpeg exited with code {returncode}')
+		return False
+
+
+	def grab(self):
+		"""Move past the next frame. Unlike cv2, ffmpeg decodes it
+		anyway, but it doesn't take a buffer."""
+		return self.read_into(self.views[self.buffer_idx])
+
+
+	def read(self):
+		"""Return (True, frame) with the next frame, or (False, None) at
+		the end of the video. The frame is one of the buffers, it gets
+		reused buffer_count frames later."""
+
+		if not self.read_into(self.views[self.buffer_idx]):
+			return False, None
+
+		frame = self.buffers[self.buffer_idx]
+		self.buffer_idx = (self.buffer_idx + 1) % len(self.buffers)
+		return True, frame
+
+
+	def release(self):
+		if self.released:
+			return
+		self.released = True
+
+		self.proc.stdout.close()
+		if self.proc.poll() is None:
+			self.proc.terminate()
+			try:
+				self.proc.wait(EXIT_TIMEOUT)
+			except sp.TimeoutExpired:
+				self.proc.kill()
+				self.proc.wait()
\ No newline at end of file
@@ -0,0 +1,241 @@
+import os
+import threading
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from PIL import Image
+
+from utils import quantize_frame
+
+
+
+# The palettes already loaded, so that new streams using the same font
+# texture don't need to process it again, the least recently requested
+# first.
+loaded_palettes = OrderedDict()
+loaded_palettes_lock = threading.Lock()
+# The max number of palettes kept loaded, each may hold a LUT of up to
+# 16 MiB.
+MAX_LOADED_PALETTES = 8
+
+
+class FontPalette:
+	"""The palette of a font texture, limited to the colors having a
+	glyph, used to convert images to characters.
+
+	Matching each pixel against the palette is replaced by a lookup
+	table (LUT) mapping any BGR color straight to its glyph, so that
+	converting an image takes a single fancy-index. The LUT is built
+	the first time it's needed and saved next to the font texture, so
+	it's built only once for each combination of font texture content,
+	glyph count, alpha usage and resolution.
+
+	lut_bits is the number of bits kept for each channel when looking
+	up a color: 8 makes a 256x256x256 table (16 MiB) which is exact,
+	lower values make smaller tables that map each color to the glyph
+	closest to the center of its bin. 0 disables the LUT.
+
+	Building a full table takes seconds, quantize() doesn't wait for it:
+	the table gets built in background (see prepare_lut()) while the
+	frames get matched against the palette directly, the center of the
+	bin of each pixel rather than the pixel itself for the smaller
+	tables, so that the glyphs are the same as the table's. With
+	build_lut False the table is only loaded once another process saved
+	it (the worker processes of tile_pool.py)."""
+
+	def __init__(self, font_tex_path, glyph_count=96, use_alpha=False, lut_bits=8, build_lut=True):
+		with open(font_tex_path, 'rb') as f:
+			font_tex_data = f.read()
+		# Used to tell if a saved LUT was built for this very texture.
+		self.digest = hashlib.sha1(font_tex_data).hexdigest()
+
+		font_tex = Image.open(font_tex_path)
+		# Extract the palette from the font texture.
+		raw_font_pal = font_tex.getpalette()
+		# Shape it as an array of RGB pixels.
+		font_pal_rgb = np.array(raw_font_pal).reshape(-1, 3)
+		# Convert each pixel from RGB to BGR as cv2 uses BGR by default.
+		font_pal_bgr = font_pal_rgb[:, ::-1]
+		# Leave only the pixels that are present in the font texture.
+		self.bgr = font_pal_bgr[(not use_alpha):glyph_count]
+
+		self.font_tex_path = font_tex_path
+		self.glyph_count = glyph_count
+		self.use_alpha = use_alpha
+		self.lut_bits = lut_bits
+
+		self.lut = None
+		# Held briefly to check or set the LUT.
+		self.lut_lock = threading.Lock()
+		# Held while building the LUT, so that it's built once.
+		self.build_lock = threading.Lock()
+		self.can_build_lut = build_lut
+		# Builds the LUT in background, see prepare_lut().
+		self.lut_thread = None
+
+
+	@property
+	def lut_path(self):
+		"""The path the LUT gets saved at, next to the font
+		texture."""
+		root, _ = os.path.splitext(self.font_tex_path)
+		return f'{root}.lut-{self.digest[:16]}-g{self.glyph_count}-a{int(self.use_alpha)}-b{self.lut_bits}.npy'
+
+
+	def build_lut(self):
+		"""Match a color of each bin of the color space against the
+		palette and return the resulting LUT."""
+
+		size = 1 << self.lut_bits
+		shift = 8 - self.lut_bits
+		# Use the center of each bin as its representative color.
+		channel = self.get_bin_centers(np.arange(size, dtype=np.uint8) << shift)
+
+		lut = np.empty((size, size, size), dtype=np.uint8)
+		# Process a plane at a time to limit the memory usage.
+		green, red = np.meshgrid(channel, channel, indexing='ij')
+		for blue_idx in range(size):
+			plane = np.stack(
+				(np.full_like(green, channel[blue_idx]), green, red),
+				axis=-1
+			)
+			lut[blue_idx] = quantize_frame(plane, self.bgr, use_alpha=self.use_alpha)
+
+		return lut
+
+
+	def load_lut(self):
+		"""Return the LUT saved next to the font texture, None if there
+		is none (or if it doesn't fit)."""
+
+		if not os.path.exists(self.lut_path):
+			return None
+
+		size = 1 << self.lut_bits
+		# Map the file rather than reading it, only the pages of the
+		# colors actually used get loaded.
+		try:
+			lut = np.load(self.lut_path, mmap_mode='r')
+		except (OSError, ValueError):
+			return None
+		if (lut.shape != (size,) * 3) or (lut.dtype != np.uint8):
+			return None
+		return lut
+
+
+	def get_lut(self):
+		"""Return the LUT, loading it from disk or building it (and
+		saving it) the first time it's needed."""
+
+		if self.lut is None:
+			with self.build_lock:
+				if self.lut is None:
+					lut = self.load_lut()
+
+					if lut is None:
+						print(f'Building the color lookup table for "{self.font_tex_path}"...')
+						lut = self.build_lut()
+
+						try:
+							# Write to a temporary file first so that other
+							# processes never load a partial table.
+							tmp_path = f'{self.lut_path}.{os.getpid()}.tmp'
+							with open(tmp_path, 'wb') as f:
+								np.save(f, lut)
+							os.replace(tmp_path, self.lut_path)
+						except OSError as e:
+							# Keep using the table from memory.
+							print(f'Could not save the color lookup table: {e}')
+
+					with self.lut_lock:
+						self.lut = lut
+
+		return self.lut
+
+
+	def prepare_lut(self):
+		"""Get the LUT ready without waiting for it: load it if it was
+		saved, otherwise start building it in background. Return the
+		LUT, None while it's being built."""
+
+		if self.lut is not None:
+			return self.lut
+
+		# The build holds build_lock, not this one.
+		with self.lut_lock:
+			if (self.lut is None) and (self.lut_thread is None):
+				self.lut = self.load_lut()
+				if (self.lut is None) and self.can_build_lut:
+					self.lut_thread = threading.Thread(target=self.build_in_background, name='lut-build', daemon=True)
+					self.lut_thread.start()
+
+		return self.lut
+
+
+	def get_bin_centers(self, values):
+		"""Return the center of the LUT bin of each channel value
+		(uint8), the color the LUT maps the whole bin as."""
+		shift = 8 - self.lut_bits
+		return ((values >> shift) << shift) + ((1 << shift) >> 1)
+
+
+	def build_in_background(self):
+		try:
+			self.get_lut()
+		except Exception as e:
+			# The frames keep being matched directly.
+			print(f'Could not build the color lookup table for "{self.font_tex_path}": {e}')
+
+
+	def quantize(self, frame):
+		"""Convert a BGR image (HxWx3) to the characters of the font
+		texture. Return an HxW uint8 array of ASCII codes."""
+
+		if not self.lut_bits:
+			return quantize_frame(frame, self.bgr, use_alpha=self.use_alpha)
+
+		frame = np.asarray(frame)
+		if frame.dtype != np.uint8:
+			frame = frame.astype(np.uint8)
+
+		lut = self.prepare_lut()
+		if lut is None:
+			# Not ready yet, match the colors the LUT would look up.
+			return quantize_frame(self.get_bin_centers(frame), self.bgr, use_alpha=self.use_alpha)
+
+		# Compute the flat LUT index of each pixel and pick the glyphs.
+		shift = 8 - self.lut_bits
+		bins = (frame >> shift).astype(np.intp)
+		idxs = (bins[..., 0] << (2 * self.lut_bits)) | (bins[..., 1] << self.lut_bits) | bins[..., 2]
+
+		return lut.reshape(-1)[idxs]
+
+
+def get_font_palette(font_tex_path, glyph_count=96, use_alpha=False, lut_bits=8, build_lut=True):
+	"""Return the palette of a font texture, loading it only if the
+	texture changed since the last time it was requested (or if it got
+	evicted by the palettes requested since)."""
+
+	stat = os.stat(font_tex_path)
+	key = (
+		os.path.abspath(font_tex_path),
+		stat.st_mtime_ns,
+		stat.st_size,
+		glyph_count,
+		use_alpha,
+		lut_bits
+	)
+
+	with loaded_palettes_lock:
+		font_pal = loaded_palettes.get(key)
+		if font_pal is None:
+			font_pal = FontPalette(font_tex_path, glyph_count, use_alpha, lut_bits, build_lut)
+			loaded_palettes[key] = font_pal
+			while len(loaded_palettes) > MAX_LOADED_PALETTES:
+				loaded_palettes.popitem(last=False)
+		else:
+			loaded_palettes.move_to_end(key)
+
+	return font_pal
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""
+Encodings of the frames sent to the remote displays and a reference
+decoder mirroring VSPDisplayManager.setFrame().
+
+A plain frame is the textual representation of a whole tile: pixRows
+rows of pixCols glyphs each, with no header. Glyphs are printable ASCII
+chars, so datagrams starting with a control char carry a header instead.
+
+A tile larger than a datagram can be (4095 bytes on UT 469, 1023 on 451)
+gets split in chunks of whole rows, each one carrying the sequence
+number of its frame, so that the rows of different frames never get
+mixed: a frame is shown once all its rows arrived, the rows of a frame
+left incomplete by a lost chunk and the chunks arriving after a newer
+frame started get dropped.
+
+A frame can also be run-length encoded, as the quantized frames often
+have long runs of the same glyph on a row (the alpha glyph, flat
+colors): a run is sent as the escape char, its length and the glyph,
+the rest as is, so that a row which doesn't compress is sent raw.
+"""
+
+import numpy as np
+
+
+
+# A delta frame: the marker followed by the rows which changed, each
+# prefixed by a byte holding its index + 1 (0 would end the string in
+# UnrealScript).
+DELTA_MARKER = 1
+# The max number of rows a delta frame can address, the taller tiles
+# get sent whole.
+MAX_DELTA_ROWS = 255 - 1
+# A chunk of a frame: the marker, the frame sequence number (1 to 255, 0
+# would end the string), the index of the chunk's first row + 1, then
+# the rows.
+CHUNK_MARKER = 2
+CHUNK_HEADER_SIZE = 3
+# The max sequence number, they wrap around to 1 after it.
+MAX_SEQ = 255
+# A run-length encoded frame: the marker followed by the rows, where a
+# run is the escape char, its length and its glyph. Runs don't span
+# rows.
+RLE_MARKER = 3
+RLE_ESCAPE = 27
+# The shortest run worth encoding, shorter runs would take as many or
+# more bytes.
+MIN_RUN = 4
+# The longest run, its length being a byte. The longer ones get split.
+MAX_RUN = 255
+
+
+def get_changed_rows(prev_data, data, row_len):
+	"""Return the indices of the rows which differ between two encoded
+	frames of the same size."""
+
+	prev_rows = np.frombuffer(prev_data, dtype=np.uint8).reshape(-1, row_len)
+	rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, row_len)
+	return np.flatnonzero((prev_rows != rows).any(axis=1))
+
+
+def encode_delta(prev_data, data, row_len):
+	"""Encode the rows of a frame which changed since the previous one
+	as a delta frame. Return None if no row changed.
+
+	Raise a ValueError if the frame has more than MAX_DELTA_ROWS
+	rows."""
+
+	if (len(data) // row_len) > MAX_DELTA_ROWS:
+		raise ValueError(f'A delta frame can\'t address more than {MAX_DELTA_ROWS} rows')
+
+	changed_rows = get_changed_rows(prev_data, data, row_len)
+	if not len(changed_rows):
+		return None
+
+	packet = bytearray([DELTA_MARKER])
+	for row in changed_rows:
+		packet.append(row + 1)
+		packet += data[row * row_len : (row + 1) * row_len]
+
+	return bytes(packet)
+
+
+def encode_rle(data, row_len):
+	"""Run-length encode a frame (see RLE_MARKER). Return None if it
+	wouldn't take fewer bytes than the raw frame."""
+
+	glyphs = np.frombuffer(data, dtype=np.uint8).reshape(-1, row_len)
+
+	# Find the runs, each row starts a new one.
+	starts = np.ones(glyphs.shape, dtype=bool)
+	starts[:, 1:] = glyphs[:, 1:] != glyphs[:, :-1]
+	start_idx = np.flatnonzero(starts)
+	lengths = np.diff(np.append(start_idx, glyphs.size))
+	values = glyphs.ravel()[start_idx]
+
+	parts = (lengths + MAX_RUN - 1) // MAX_RUN
+	if (parts > 1).any():
+		# Split the runs too long for their length to fit a byte (rows
+		# wider than MAX_RUN glyphs).
+		run_idxs = np.repeat(np.arange(len(lengths)), parts)
+		part_idxs = np.arange(len(run_idxs)) - np.repeat(np.cumsum(parts) - parts, parts)
+		lengths = np.minimum(lengths[run_idxs] - part_idxs * MAX_RUN, MAX_RUN)
+		values = values[run_idxs]
+
+	long_runs = lengths >= MIN_RUN
+	# A long run takes 3 bytes, the others get copied as they are.
+	sizes = np.where(long_runs, 3, lengths)
+	if (1 + sizes.sum()) >= len(data):
+		return None
+
+	encoded = np.empty(1 + sizes.sum(), dtype=np.uint8)
+	encoded[0] = RLE_MARKER
+	body = encoded[1:]
+	body[:] = np.repeat(values, sizes)
+	positions = (np.cumsum(sizes) - sizes)[long_runs]
+	body[positions] = RLE_ESCAPE
+	body[positions + 1] = lengths[long_runs]
+
+	return encoded.tobytes()
+
+
+def decode_rle_rows(data, pix_rows, pix_cols):
+	"""Expand the rows of a run-length encoded frame (marker
+	excluded). Return the rows."""
+
+	rows = []
+	pos = 0
+	for _ in range(pix_rows):
+		row = b''
+		while (len(row) < pix_cols) and (pos < len(data)):
+			if data[pos] == RLE_ESCAPE:
+				row += data[pos + 2 : pos + 3] * data[pos + 1]
+				pos += 3
+			else:
+				# Copy the glyphs up to the next run.
+				end = data.find(RLE_ESCAPE, pos, pos + pix_cols - len(row))
+				end = (pos + pix_cols - len(row)) if end < 0 else end
+				row += data[pos:end]
+				pos = end
+		rows.append(row)
+
+	return rows
+
+
+def next_seq(seq):
+	"""Return the sequence number following seq (0 before the first
+	frame)."""
+	return (seq % MAX_SEQ) + 1
+
+
+def is_newer_seq(seq, ref_seq):
+	"""True if seq follows ref_seq, allowing for the wrap around: the
+	half of the sequence numbers after ref_seq are considered newer,
+	the other half older."""
+	return 0 < ((seq - ref_seq) % MAX_SEQ) <= (MAX_SEQ // 2)
+
+
+def encode_chunks(data, row_len, max_size, seq):
+	"""Split an encoded frame in chunks of whole rows no larger than
+	max_size bytes, header included. Return the chunks."""
+
+	rows_per_chunk = (max_size - CHUNK_HEADER_SIZE) // row_len
+	if rows_per_chunk < 1:
+		raise ValueError(f'A datagram of {max_size} bytes can\'t hold a row of {row_len} glyphs')
+
+	chunk_len = rows_per_chunk * row_len
+	return [
+		bytes([CHUNK_MARKER, seq, (start // row_len) + 1]) + data[start : start + chunk_len]
+		for start in range(0, len(data), chunk_len)
+	]
+
+
+class FrameReassembler:
+	"""Put the chunks of the frames back together, the same way
+	VSPDisplayManager.setFrameChunk() does.
+
+	Only the latest frame gets assembled: a frame left incomplete is
+	dropped when a chunk of a newer one arrives, and so are the chunks
+	of the frames older than the one being assembled."""
+
+	def __init__(self, pix_rows, pix_cols):
+		self.pix_rows = pix_rows
+		self.pix_cols = pix_cols
+		# The sequence number of the frame being assembled, 0 before
+		# the first chunk.
+		self.seq = 0
+		self.rows = {}
+		self.complete = False
+
+		self.frames = 0
+		self.dropped_frames = 0
+		self.late_chunks = 0
+
+
+	def add_chunk(self, chunk):
+		"""Add a received chunk (marker included). Return the rows of
+		the frame it completed, None if it didn't complete one."""
+
+		seq, first_row = chunk[1], chunk[2] - 1
+		if seq != self.seq:
+			if self.seq and not is_newer_seq(seq, self.seq):
+				self.late_chunks += 1
+				return None
+			if self.rows and not self.complete:
+				self.dropped_frames += 1
+			self.seq = seq
+			self.rows = {}
+			self.complete = False
+		elif self.complete:
+			# A duplicate.
+			return None
+
+		data = chunk[CHUNK_HEADER_SIZE:]
+		for idx in range(len(data) // self.pix_cols):
+			row = first_row + idx
+			if row < self.pix_rows:
+				self.rows[row] = data[idx * self.pix_cols : (idx + 1) * self.pix_cols]
+
+		if len(self.rows) < self.pix_rows:
+			return None
+
+		self.complete = True
+		self.frames += 1
+		return [self.rows[row] for row in range(self.pix_rows)]
+
+
+class FrameDecoder:
+	"""Rebuild the frame lines of a remote display from the received
+	datagrams, the same way VSPDisplayManager.setFrame() does."""
+
+	def __init__(self, pix_rows, pix_cols):
+		self.pix_rows = pix_rows
+		self.pix_cols = pix_cols
+		self.frame_lines = [b''] * pix_rows
+		self.reassembler = FrameReassembler(pix_rows, pix_cols)
+
+
+	def decode(self, data):
+		"""Apply a received datagram to the frame lines."""
+
+		if data[:1] == bytes([DELTA_MARKER]):
+			# Replace only the received rows.
+			data = data[1:]
+			while len(data) > self.pix_cols:
+				row = data[0] - 1
+				if row < self.pix_rows:
+					self.frame_lines[row] = data[1 : self.pix_cols + 1]
+				data = data[self.pix_cols + 1:]
+
+		elif data[:1] == bytes([RLE_MARKER]):
+			self.frame_lines = decode_rle_rows(data[1:], self.pix_rows, self.pix_cols)
+
+		elif data[:1] == bytes([CHUNK_MARKER]):
+			# Show the frame once all its chunks arrived.
+			rows = self.reassembler.add_chunk(data)
+			if rows is not None:
+				self.frame_lines = rows
+
+		else:
+			# Chop the frame and populate the frame lines.
+			for row in range(self.pix_rows):
+				self.frame_lines[row] = data[:self.pix_cols]
+				data = data[self.pix_cols:]
+
+		return self.frame_lines
\ No newline at end of file
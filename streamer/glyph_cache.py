@@ -0,0 +1,373 @@
+"""
+A cache of local videos already converted to characters, so that replaying
+a video on the same wall doesn't decode, resize and convert its frames
+again.
+
+Each combination of video, wall layout and font palette is transcoded to
+a single file, which is memory-mapped when played:
+
+	magic (8 bytes) | header (JSON, padded to HEADER_SIZE) | frames | index
+
+Each frame holds the glyphs of every tile, tile after tile (tiles[0, 0],
+tiles[0, 1]...), followed by the digest of each tile. The index holds the
+offset, presentation time and duration of each frame; identical frames
+share the same offset.
+
+Run this module to pre-warm the cache:
+
+	py glyph_cache.py --shape 2 2 --display_res 63 63 [--use_alpha] font_tex_path vid_path [vid_path ...]
+"""
+
+import os
+import sys
+import mmap
+import json
+import time
+import hashlib
+import threading
+import argparse
+
+import numpy as np
+import cv2
+
+from video_wall import VideoWall
+from pacing import FramePacer, get_gif_frame_durations
+from font_palette import get_font_palette
+
+
+
+MAGIC = b'VSPGLYPH'
+VERSION = 1
+HEADER_SIZE = 4096
+# The size of the digest of each tile (see VideoWall.convert_frame()).
+DIGEST_SIZE = 8
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('pts', '<f8'), ('duration', '<f8')])
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glyph_cache')
+# In MiB.
+DEFAULT_CACHE_SIZE = 4096
+
+# The temporary files left by an interrupted transcoding get removed
+# after this time (in seconds).
+STALE_TMP_AGE = 3600
+
+# The cache files being transcoded in background (cache path -> thread),
+# so that two streams of the same video don't transcode it twice.
+transcoding = {}
+transcoding_lock = threading.Lock()
+# Set to interrupt the transcoding in background.
+transcoding_cancelled = threading.Event()
+
+
+def get_cache_path(cache_dir, vid_path, shape, display_res, font_pal):
+	"""Return the path of the cache file of a video converted for a
+	wall layout and a font palette.
+
+	The file name depends on the video's content (through its size and
+	modification time), so that a modified video doesn't play stale
+	frames."""
+
+	stat = os.stat(vid_path)
+	key = json.dumps([
+		VERSION,
+		os.path.abspath(vid_path),
+		stat.st_mtime_ns,
+		stat.st_size,
+		list(shape),
+		list(display_res),
+		font_pal.digest,
+		font_pal.glyph_count,
+		font_pal.use_alpha,
+		font_pal.lut_bits
+	])
+	name, _ = os.path.splitext(os.path.basename(vid_path))
+	digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+
+	return os.path.join(cache_dir, f'{name}-{digest}.glyphs')
+
+
+def transcode(vid_path, shape, display_res, font_pal, cache_path, cancelled=None):
+	"""Convert every frame of a video for a wall layout and save them to
+	a cache file. Return the number of frames, or None if cancelled
+	(an optional callable) returned True meanwhile."""
+
+	wall = VideoWall(shape, display_res)
+	src = cv2.VideoCapture(vid_path)
+	pacer = FramePacer(
+		fps=src.get(cv2.CAP_PROP_FPS),
+		durations=get_gif_frame_durations(vid_path)
+	)
+	if not pacer.paced:
+		# Not a video with a known timing, play it at 25 fps.
+		pacer.fps = 25
+
+	index = []
+	# Frame digest -> offset.
+	offsets = {}
+
+	os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+	# Write to a temporary file first so that no stream ever plays a
+	# partial file.
+	tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+	try:
+		with open(tmp_path, 'wb') as f:
+			# The header gets written once the frames are known.
+			f.write(bytes(len(MAGIC) + HEADER_SIZE))
+
+			for pts, duration in pacer.timeline():
+				if cancelled and cancelled():
+					return None
+
+				success, frame = src.read()
+				if not success:
+					break
+
+				frame = cv2.resize(
+					frame,
+					(wall.full_res[1], wall.full_res[0]),
+					interpolation=cv2.INTER_LINEAR
+				)
+				tiles, digests = wall.convert_frame(frame, font_pal)
+				data = b''.join(tiles.flat) + b''.join(digests.flat)
+
+				frame_digest = hashlib.blake2b(data, digest_size=16).digest()
+				offset = offsets.get(frame_digest)
+				if offset is None:
+					offset = f.tell()
+					f.write(data)
+					offsets[frame_digest] = offset
+
+				index.append((offset, pts, duration))
+
+			index_offset = f.tell()
+			f.write(np.array(index, dtype=INDEX_DTYPE).tobytes())
+
+			header = json.dumps({
+				'version': VERSION,
+				'vid_path': os.path.abspath(vid_path),
+				'shape': list(shape),
+				'display_res': list(display_res),
+				'frame_count': len(index),
+				'index_offset': index_offset
+			}).encode()
+			f.seek(0)
+			f.write(MAGIC + header.ljust(HEADER_SIZE))
+
+		os.replace(tmp_path, cache_path)
+
+	finally:
+		src.release()
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+
+	return len(index)
+
+
+def transcode_in_background(vid_path, shape, display_res, font_pal, cache_path, max_cache_size=DEFAULT_CACHE_SIZE):
+	"""Transcode a video in a thread, unless it's being transcoded
+	already, then evict the least recently used cache files."""
+
+	def run():
+		try:
+			frame_count = transcode(
+				vid_path,
+				shape,
+				display_res,
+				font_pal,
+				cache_path,
+				cancelled=transcoding_cancelled.is_set
+			)
+			if frame_count is not None:
+				print(f'Cached {frame_count} frames of "{vid_path}".')
+				evict(os.path.dirname(cache_path), max_cache_size, keep=cache_path)
+		except Exception as e:
+			print(f'Could not cache "{vid_path}": {e}')
+		finally:
+			with transcoding_lock:
+				transcoding.pop(cache_path, None)
+
+	with transcoding_lock:
+		if cache_path in transcoding:
+			return
+		thread = threading.Thread(target=run, name='transcode', daemon=True)
+		transcoding[cache_path] = thread
+	thread.start()
+
+
+def cancel_transcoding(timeout=1):
+	"""Interrupt the transcoding in background and wait for the
+	temporary files to be removed."""
+
+	transcoding_cancelled.set()
+	with transcoding_lock:
+		threads = list(transcoding.values())
+	for thread in threads:
+		thread.join(timeout)
+
+
+def evict(cache_dir, max_cache_size=DEFAULT_CACHE_SIZE, keep=None, exts=('.glyphs',)):
+	"""Remove the least recently used cache files (the files ending
+	with one of exts) until the cache fits in max_cache_size MiB.
+	Return the number of removed files.
+
+	The temporary files left by an interrupted transcoding get removed
+	too."""
+
+	try:
+		entries = [entry for entry in os.scandir(cache_dir) if entry.is_file()]
+	except FileNotFoundError:
+		return 0
+
+	now = time.time()
+	for entry in entries:
+		if entry.name.endswith('.tmp') and (now - entry.stat().st_mtime) > STALE_TMP_AGE:
+			try:
+				os.remove(entry.path)
+			except OSError:
+				pass
+
+	entries = [entry for entry in entries if entry.name.endswith(exts)]
+
+	# Playing a file marks it as used (see GlyphStream), oldest first.
+	entries.sort(key=lambda entry: entry.stat().st_mtime)
+	total_size = sum(entry.stat().st_size for entry in entries)
+	max_size = max_cache_size * (1 << 20)
+
+	count = 0
+	for entry in entries:
+		if total_size <= max_size:
+			break
+		if entry.path == keep:
+			continue
+		size = entry.stat().st_size
+		try:
+			os.remove(entry.path)
+		except OSError:
+			# In use (Windows), try the next one.
+			continue
+		total_size -= size
+		count += 1
+
+	return count
+
+
+class GlyphStream:
+	"""A video played from its cache file, the frames are already
+	converted to the tiles of a wall."""
+
+	def __init__(self, cache_path):
+		self.cache_path = cache_path
+		with open(cache_path, 'rb') as f:
+			self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		self.data = np.frombuffer(self.mmap, dtype=np.uint8)
+		if bytes(self.data[:len(MAGIC)]) != MAGIC:
+			raise ValueError('Not a glyph cache file')
+
+		header = json.loads(bytes(self.data[len(MAGIC):len(MAGIC) + HEADER_SIZE]))
+		if header['version'] != VERSION:
+			raise ValueError('Unsupported glyph cache version')
+
+		self.shape = tuple(header['shape'])
+		self.display_res = tuple(header['display_res'])
+		self.index = np.frombuffer(
+			self.data,
+			dtype=INDEX_DTYPE,
+			count=header['frame_count'],
+			offset=header['index_offset']
+		)
+		self.tile_size = self.display_res[0] * self.display_res[1]
+		self.tile_count = self.shape[0] * self.shape[1]
+
+		# Mark the file as used, for the eviction.
+		os.utime(cache_path)
+
+
+	@property
+	def durations(self):
+		return self.index['duration'].tolist()
+
+
+	def fits(self, wall):
+		"""True if the frames were converted for the layout of a
+		wall."""
+		return (wall.matrix.shape == self.shape) and (tuple(wall.display_res) == self.display_res)
+
+
+	def get_frame(self, frame_idx):
+		"""Return the tiles of a frame and their digests, laid out as
+		VideoWall.convert_frame() does."""
+
+		offset = int(self.index['offset'][frame_idx])
+		glyphs_size = self.tile_count * self.tile_size
+		glyphs = self.data[offset:offset + glyphs_size].reshape(self.tile_count, self.tile_size)
+		digests = self.data[offset + glyphs_size:offset + glyphs_size + self.tile_count * DIGEST_SIZE].reshape(self.tile_count, DIGEST_SIZE)
+
+		tiles = np.empty(shape=self.shape, dtype=object)
+		tile_digests = np.empty(shape=self.shape, dtype=object)
+		for i in range(self.tile_count):
+			tiles.flat[i] = glyphs[i].tobytes()
+			tile_digests.flat[i] = digests[i].tobytes()
+
+		return tiles, tile_digests
+
+
+	def __len__(self):
+		return len(self.index)
+
+
+	def release(self):
+		"""Unmap the file."""
+		self.data = None
+		self.index = None
+		try:
+			self.mmap.close()
+		except BufferError:
+			# Still referenced, let the GC unmap it.
+			pass
+
+
+def open_stream(cache_path):
+	"""Return the GlyphStream of a cache file, or None if the file
+	doesn't exist or can't be read."""
+
+	if not os.path.exists(cache_path):
+		return None
+	try:
+		return GlyphStream(cache_path)
+	except (OSError, ValueError, KeyError) as e:
+		print(f'Ignoring the glyph cache file "{cache_path}": {e}')
+		return None
+
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(add_help=False, description='Pre-warm the glyph cache.')
+	argparser.add_argument('--help', action='help', help='Show this help message and exit')
+	argparser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Glyph cache directory')
+	argparser.add_argument('--cache_size', type=int, default=DEFAULT_CACHE_SIZE, help='Max size of the glyph cache in MiB')
+	argparser.add_argument('--shape', type=int, nargs=2, required=True, metavar=('ROWS', 'COLS'), help='Video wall shape')
+	argparser.add_argument('--display_res', type=int, nargs=2, default=[63, 63], metavar=('ROWS', 'COLS'), help='Resolution of each display')
+	argparser.add_argument('--glyph_count', type=int, default=96, help='Glyphs count (alpha character included)')
+	argparser.add_argument('--use_alpha', action='store_true', help='Use the alpha color')
+	argparser.add_argument('--lut_bits', type=int, default=8, choices=range(9), metavar='{0..8}', help='Bits per channel of the color lookup table')
+	argparser.add_argument('--force', action='store_true', help='Transcode the videos even if they are cached already')
+	argparser.add_argument('font_tex_path', type=str, help='Font texture path')
+	argparser.add_argument('vid_paths', type=str, nargs='+', help='Local video paths')
+	args = argparser.parse_args(sys.argv[1:])
+
+	font_pal = get_font_palette(args.font_tex_path, args.glyph_count, args.use_alpha, args.lut_bits)
+
+	for vid_path in args.vid_paths:
+		cache_path = get_cache_path(args.cache_dir, vid_path, args.shape, args.display_res, font_pal)
+		if os.path.exists(cache_path) and not args.force:
+			print(f'"{vid_path}" is cached already: {cache_path}')
+			os.utime(cache_path)
+			continue
+
+		start_ts = time.perf_counter()
+		frame_count = transcode(vid_path, args.shape, args.display_res, font_pal, cache_path)
+		print(f'Cached {frame_count} frames of "{vid_path}" in {time.perf_counter() - start_ts:.1f}s: {cache_path}')
+
+	count = evict(args.cache_dir, args.cache_size, keep=cache_path)
+	if count:
+		print(f'Evicted {count} cache file(s).')
\ No newline at end of file
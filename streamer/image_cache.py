@@ -0,0 +1,336 @@
+"""
+A cache of the still images (stream --img) and the AI generated images
+(stream --ai) converted to characters, so that showing again a recent
+image or prompt sends its tiles right away rather than reading or
+generating the image (a slow request, and a billed one), resizing and
+converting it again.
+
+The converted tiles are keyed by the content of the image (or by the
+prompt), the wall layout and the font palette. The generated images are
+also kept by their prompt alone, so that a prompt shown on another wall
+isn't generated again.
+
+The entries are kept in memory up to a byte budget, the least recently
+used ones get evicted first. With a cache directory they also get saved
+to disk, where an entry evicted from memory can still be found, the
+least recently used files get removed once they exceed their own budget
+(see glyph_cache.evict()):
+
+	<key>.tiles	the glyphs of every tile, tile after tile, followed
+			by the digest of each tile (as a frame of a glyph
+			cache file)
+	<key>.npy	a generated image
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+from glyph_cache import DIGEST_SIZE, evict
+
+
+
+VERSION = 1
+# In MiB.
+DEFAULT_MEMORY_SIZE = 64
+DEFAULT_DISK_SIZE = 1024
+
+TILES_EXT = '.tiles'
+IMAGE_EXT = '.npy'
+# The image files whose content hash is remembered, so that showing one
+# again doesn't read it.
+MAX_FILE_KEYS = 1024
+
+
+def hash_bytes(data):
+	return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_tiles_key(image_key, wall, font_pal):
+	"""Return the key of an image converted for the layout of a wall and
+	a font palette."""
+
+	key = json.dumps([
+		VERSION,
+		image_key,
+		list(wall.matrix.shape),
+		list(wall.display_res),
+		font_pal.digest,
+		font_pal.glyph_count,
+		font_pal.use_alpha,
+		font_pal.lut_bits
+	])
+	return hash_bytes(key.encode())
+
+
+def convert_image(img, wall, font_pal):
+	"""Return the CachedTiles of an image converted for a wall, as a
+	stream session converts its frames."""
+
+	if img.shape[:2] != wall.full_res:
+		img = cv2.resize(
+			img,
+			(wall.full_res[1], wall.full_res[0]),
+			interpolation=cv2.INTER_LINEAR
+		)
+	tiles, digests = wall.convert_frame(img, font_pal)
+	return CachedTiles(tiles, digests, wall.display_res)
+
+
+class CachedTiles:
+	"""A still image already converted to the tiles of a wall, laid out
+	as VideoWall.convert_frame() does."""
+
+	def __init__(self, tiles, digests, display_res):
+		self.tiles = tiles
+		self.digests = digests
+		self.shape = tiles.shape
+		self.display_res = tuple(display_res)
+
+
+	@property
+	def size(self):
+		"""The size of the tiles in bytes."""
+		return self.tiles.size * (self.display_res[0] * self.display_res[1] + DIGEST_SIZE)
+
+
+	def fits(self, wall):
+		"""True if the image was converted for the layout of a wall."""
+		return (wall.matrix.shape == self.shape) and (tuple(wall.display_res) == self.display_res)
+
+
+	def to_bytes(self):
+		return b''.join(self.tiles.flat) + b''.join(self.digests.flat)
+
+
+	@classmethod
+	def from_bytes(cls, data, shape, display_res):
+		"""Return the CachedTiles saved by to_bytes(), None if the data
+		doesn't fit the layout."""
+
+		tile_count = shape[0] * shape[1]
+		tile_size = display_res[0] * display_res[1]
+		if len(data) != tile_count * (tile_size + DIGEST_SIZE):
+			return None
+
+		tiles = np.empty(shape=shape, dtype=object)
+		digests = np.empty(shape=shape, dtype=object)
+		digests_offset = tile_count * tile_size
+		for i in range(tile_count):
+			tiles.flat[i] = data[i * tile_size:(i + 1) * tile_size]
+			digests.flat[i] = data[digests_offset + i * DIGEST_SIZE:digests_offset + (i + 1) * DIGEST_SIZE]
+
+		return cls(tiles, digests, display_res)
+
+
+class ImageCache:
+	"""The images converted for the walls and the generated images, in
+	memory up to max_size MiB (0 = none kept) and in cache_dir up to
+	max_disk_size MiB if given.
+
+	It can be used from any thread. The misses get loaded and converted
+	outside of the lock, two threads missing the same entry at once both
+	load it."""
+
+	def __init__(self, max_size=DEFAULT_MEMORY_SIZE, cache_dir=None, max_disk_size=DEFAULT_DISK_SIZE):
+		self.max_size = max_size * (1 << 20)
+		self.cache_dir = cache_dir
+		self.max_disk_size = max_disk_size
+		# Key -> (entry, size), the least recently used first.
+		self.entries = OrderedDict()
+		self.size = 0
+		# (path, modification time, size) of an image file -> the hash
+		# of its content.
+		self.file_keys = OrderedDict()
+		self.lock = threading.Lock()
+
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+
+	def get(self, key, ext, read):
+		"""Return an entry from memory, or from disk (read is a callable
+		taking the path of the file and returning the entry, or None),
+		None if it's not cached."""
+
+		with self.lock:
+			item = self.entries.get(key)
+			if item is not None:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				return item[0]
+
+		entry = None
+		if self.cache_dir:
+			path = os.path.join(self.cache_dir, key + ext)
+			try:
+				entry = read(path)
+				# Mark the file as used, for the eviction.
+				os.utime(path)
+			except FileNotFoundError:
+				pass
+			except (OSError, ValueError) as e:
+				print(f'Ignoring the image cache file "{path}": {e}')
+
+		with self.lock:
+			if entry is None:
+				self.misses += 1
+				return None
+			self.disk_hits += 1
+		self.keep(key, entry)
+		return entry
+
+
+	def keep(self, key, entry):
+		"""Keep an entry in memory, evicting the least recently used
+		ones to make room."""
+
+		size = entry.size if isinstance(entry, CachedTiles) else entry.nbytes
+		with self.lock:
+			if size > self.max_size:
+				return
+			if key in self.entries:
+				self.size -= self.entries.pop(key)[1]
+			self.entries[key] = (entry, size)
+			self.size += size
+			while self.size > self.max_size:
+				_, (_, evicted_size) = self.entries.popitem(last=False)
+				self.size -= evicted_size
+				self.evictions += 1
+
+
+	def put(self, key, ext, entry, write):
+		"""Cache a new entry, in memory and on disk (write is a callable
+		taking a file and the entry)."""
+
+		self.keep(key, entry)
+		if not self.cache_dir:
+			return
+
+		path = os.path.join(self.cache_dir, key + ext)
+		# Write to a temporary file first so that no stream ever reads a
+		# partial file.
+		tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+		try:
+			os.makedirs(self.cache_dir, exist_ok=True)
+			with open(tmp_path, 'wb') as f:
+				write(f, entry)
+			os.replace(tmp_path, path)
+			evict(self.cache_dir, self.max_disk_size, keep=path, exts=(TILES_EXT, IMAGE_EXT))
+		except OSError as e:
+			print(f'Could not save "{path}" to the image cache: {e}')
+		finally:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+
+
+	def get_tiles(self, image_key, wall, font_pal, load_image):
+		"""Return the CachedTiles of an image converted for a wall, or
+		None if the image can't be loaded. load_image is a callable
+		returning the image (or None) on a miss."""
+
+		key = get_tiles_key(image_key, wall, font_pal)
+		tiles = self.get(key, TILES_EXT, lambda path: self.read_tiles(path, wall))
+		if tiles is None:
+			img = load_image()
+			if img is None:
+				return None
+			tiles = convert_image(img, wall, font_pal)
+			self.put(key, TILES_EXT, tiles, lambda f, tiles: f.write(tiles.to_bytes()))
+		return tiles
+
+
+	@staticmethod
+	def read_tiles(path, wall):
+		with open(path, 'rb') as f:
+			tiles = CachedTiles.from_bytes(f.read(), wall.matrix.shape, wall.display_res)
+		if tiles is None:
+			raise ValueError('It doesn\'t fit the wall')
+		return tiles
+
+
+	def get_file_tiles(self, img_path, wall, font_pal):
+		"""Return the CachedTiles of a still image file converted for a
+		wall, or None if it can't be read. The image is identified by its
+		content, a modified file doesn't show stale tiles. The content of
+		a file shown lately isn't read again unless the file changed
+		(its modification time or its size)."""
+
+		data = None
+		try:
+			stat = os.stat(img_path)
+			file_key = (os.path.abspath(img_path), stat.st_mtime_ns, stat.st_size)
+			with self.lock:
+				image_key = self.file_keys.get(file_key)
+
+			if image_key is None:
+				with open(img_path, 'rb') as f:
+					data = f.read()
+				image_key = 'file-' + hash_bytes(data)
+				with self.lock:
+					self.file_keys[file_key] = image_key
+					if len(self.file_keys) > MAX_FILE_KEYS:
+						self.file_keys.popitem(last=False)
+
+		except OSError as e:
+			print(f'Could not read "{img_path}": {e}')
+			return None
+
+		def load_image():
+			file_data = data
+			if file_data is None:
+				# Known file, but its tiles were evicted.
+				try:
+					with open(img_path, 'rb') as f:
+						file_data = f.read()
+				except OSError as e:
+					print(f'Could not read "{img_path}": {e}')
+					return None
+			# As cv2.imread() would.
+			return cv2.imdecode(np.frombuffer(file_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+		return self.get_tiles(image_key, wall, font_pal, load_image)
+
+
+	def get_generated_image(self, prompt, gen_img):
+		"""Return the image generated for a prompt, generating it with
+		gen_img (a callable taking the prompt) on a miss."""
+
+		key = 'prompt-' + hash_bytes(prompt.encode())
+		img = self.get(key, IMAGE_EXT, lambda path: np.load(path, allow_pickle=False))
+		if img is None:
+			img = gen_img(prompt)
+			self.put(key, IMAGE_EXT, img, np.save)
+		return img
+
+
+	def get_prompt_tiles(self, prompt, gen_img, wall, font_pal):
+		"""Return the CachedTiles of the image generated for a prompt,
+		converted for a wall."""
+
+		return self.get_tiles(
+			'prompt-' + hash_bytes(prompt.encode()),
+			wall,
+			font_pal,
+			lambda: self.get_generated_image(prompt, gen_img)
+		)
+
+
+	def stats(self):
+		with self.lock:
+			return {
+				'entries': len(self.entries),
+				'size_mib': round(self.size / (1 << 20), 2),
+				'max_size_mib': round(self.max_size / (1 << 20), 2),
+				'hits': self.hits,
+				'disk_hits': self.disk_hits,
+				'misses': self.misses,
+				'evictions': self.evictions
+			}
\ No newline at end of file
@@ -0,0 +1,389 @@
+"""
+Runtime metrics of the streamer, cheap enough to be always on: the time
+each stage (decode, resize, quantize, encode, send) takes on a frame, as
+histograms, and the throughput of each video wall group.
+
+The metrics are kept by group name, so that they survive the walls being
+replaced (SERVER INIT) and the streams ending. Each metric is updated
+from a single thread (the stage's one), so no lock is needed: the
+frames dropped are counted apart by each stage for that reason.
+"""
+
+import time
+import json
+import asyncio
+from bisect import bisect_left
+from collections import deque
+
+
+
+STAGES = ('decode', 'resize', 'quantize', 'encode', 'send')
+# The upper bounds of the buckets of the timing histograms, in seconds.
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# The window the achieved fps is computed over, in seconds.
+FPS_WINDOW = 5
+
+
+class Histogram:
+	"""Count the observed values in fixed buckets."""
+
+	def __init__(self, buckets=TIME_BUCKETS):
+		self.buckets = buckets
+		# The last count is for the values above the last bucket.
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+
+	def observe(self, value):
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.sum += value
+		self.count += 1
+
+
+	def quantile(self, q):
+		"""Return the upper bound of the bucket holding the q-quantile,
+		None if no value was observed (or inf)."""
+
+		if not self.count:
+			return None
+		target = q * self.count
+		cumulative = 0
+		for bound, count in zip(self.buckets, self.counts):
+			cumulative += count
+			if cumulative >= target:
+				return bound
+		return float('inf')
+
+
+	def to_dict(self):
+		def to_ms(value):
+			# inf is not valid JSON.
+			if value == float('inf'):
+				return '+Inf'
+			return value and value * 1000
+
+		return {
+			'count': self.count,
+			'sum': round(self.sum, 6),
+			'mean_ms': round(self.sum / self.count * 1000, 3) if self.count else None,
+			'p50_ms': to_ms(self.quantile(0.5)),
+			'p95_ms': to_ms(self.quantile(0.95)),
+			'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts))
+		}
+
+
+class RateMeter:
+	"""Count the events of the last FPS_WINDOW seconds."""
+
+	def __init__(self, window=FPS_WINDOW):
+		self.window = window
+		self.timestamps = deque()
+
+
+	def mark(self, now=None):
+		now = time.monotonic() if now is None else now
+		self.timestamps.append(now)
+		self.expire(now)
+
+
+	def expire(self, now):
+		while self.timestamps and (now - self.timestamps[0]) > self.window:
+			self.timestamps.popleft()
+
+
+	def rate(self, now=None):
+		now = time.monotonic() if now is None else now
+		self.expire(now)
+		return len(self.timestamps) / self.window
+
+
+class GroupMetrics:
+	"""The metrics of a video wall group."""
+
+	def __init__(self):
+		self.stages = {stage: Histogram() for stage in STAGES}
+		self.frames_sent = 0
+		# Stage -> frames dropped by it: decode (the queue was full,
+		# live sources), convert and send (the frames got stale).
+		self.frames_dropped = dict.fromkeys(('decode', 'convert', 'send'), 0)
+		self.bytes_sent = 0
+		self.datagrams_sent = 0
+		self.heartbeat_expiries = 0
+		self.fps = RateMeter()
+
+
+	def timed(self, stage):
+		"""Return a context manager timing a stage."""
+		return StageTimer(self.stages[stage])
+
+
+	def count_sent(self, datagrams, sent_bytes):
+		"""Count a frame sent to the displays."""
+		self.frames_sent += 1
+		self.datagrams_sent += datagrams
+		self.bytes_sent += sent_bytes
+		self.fps.mark()
+
+
+class StageTimer:
+
+	def __init__(self, histogram):
+		self.histogram = histogram
+
+
+	def __enter__(self):
+		self.start_ts = time.perf_counter()
+
+
+	def __exit__(self, *exc_info):
+		self.histogram.observe(time.perf_counter() - self.start_ts)
+
+
+class Metrics:
+	"""The metrics of all the groups."""
+
+	def __init__(self):
+		self.groups = {}
+		self.start_ts = time.monotonic()
+
+
+	def group(self, name):
+		"""Return the metrics of a group, creating them the first
+		time."""
+		group_metrics = self.groups.get(name)
+		if group_metrics is None:
+			group_metrics = self.groups.setdefault(name, GroupMetrics())
+		return group_metrics
+
+
+	def get_snapshot(self, walls=None, sessions=None):
+		"""Return the metrics as a dict that can be dumped as JSON.
+
+		walls and sessions are the group name -> video wall and the
+		group name -> stream session dicts, for the live figures."""
+
+		walls = walls or {}
+		sessions = sessions or {}
+		now = time.monotonic()
+
+		groups = {}
+		for name in sorted(set(self.groups) | set(walls)):
+			group_metrics = self.group(name)
+			group = {
+				'fps': round(group_metrics.fps.rate(now), 2),
+				'frames_sent': group_metrics.frames_sent,
+				'frames_dropped': sum(group_metrics.frames_dropped.values()),
+				'dropped_by_stage': dict(group_metrics.frames_dropped),
+				'bytes_sent': group_metrics.bytes_sent,
+				'datagrams_sent': group_metrics.datagrams_sent,
+				'heartbeat_expiries': group_metrics.heartbeat_expiries,
+				'displays': 0,
+				'streaming': name in sessions,
+				'stages': {stage: histogram.to_dict() for stage, histogram in group_metrics.stages.items()}
+			}
+
+			wall = walls.get(name)
+			if wall is not None:
+				group['shape'] = list(wall.matrix.shape)
+				group['displays'] = sum(len(displays) for displays in wall.matrix.flat)
+				group.update(get_display_stats(wall))
+
+			session = sessions.get(name)
+			if session is not None:
+				group['pipeline'] = session.stats()
+
+			groups[name] = group
+
+		return {
+			'uptime': round(now - self.start_ts, 3),
+			'groups': groups
+		}
+
+
+def get_display_stats(wall):
+	"""Return the figures of a wall's displays: the datagrams which
+	didn't make it (see fanout.FanoutSender) and the frames skipped to
+	stay within the bandwidth budget (see bandwidth.py), in total and
+	for each display concerned."""
+
+	now = time.monotonic()
+	totals = {
+		'display_budget_kib': wall.display_budget / 1024,
+		'send_dropped': 0,
+		'send_errors': 0,
+		'frames_throttled': 0,
+		'failing_displays': [],
+		'throttled_displays': []
+	}
+	for displays in wall.matrix.flat:
+		for disp in displays:
+			addr = f'{disp.addr[0]}:{disp.addr[1]}'
+
+			counters = getattr(disp.sock, 'counters', {}).get(disp.addr)
+			if counters is not None and (counters.dropped or counters.errors):
+				totals['send_dropped'] += counters.dropped
+				totals['send_errors'] += counters.errors
+				totals['failing_displays'].append({'addr': addr, **counters.to_dict()})
+
+			if disp.throttled:
+				totals['frames_throttled'] += disp.throttled
+				totals['throttled_displays'].append({
+					'addr': addr,
+					'fps': round(disp.fps.rate(now), 2),
+					'throttled': disp.throttled
+				})
+
+	return totals
+
+
+def format_snapshot(snapshot):
+	"""Return a snapshot as human readable text."""
+
+	lines = [f'Uptime: {snapshot["uptime"]:.0f}s']
+	for name, group in snapshot['groups'].items():
+		lines.append(
+			f'Group "{name}": {group["fps"]} fps'
+			f', {group["frames_sent"]} frames sent, {group["frames_dropped"]} dropped'
+			f', {group["displays"]} displays ({group["heartbeat_expiries"]} expired)'
+			f', {group["bytes_sent"] / (1 << 20):.2f} MiB in {group["datagrams_sent"]} datagrams'
+		)
+		if group.get('failing_displays'):
+			lines.append(
+				f'\t{group["send_dropped"]} datagrams replaced before being sent, {group["send_errors"]} failed'
+				f', on {len(group["failing_displays"])} displays:'
+			)
+			for disp in group['failing_displays']:
+				last_error = f' ({disp["last_error"]})' if disp['last_error'] else ''
+				lines.append(f'\t\t{disp["addr"]}: {disp["dropped"]} replaced, {disp["errors"]} failed{last_error}')
+		if group.get('display_budget_kib'):
+			lines.append(
+				f'\tbudget {group["display_budget_kib"]:g} KiB/s per display'
+				f', {group["frames_throttled"]} frames throttled on {len(group["throttled_displays"])} displays'
+				+ (':' if group['throttled_displays'] else '')
+			)
+			for disp in group['throttled_displays']:
+				lines.append(f'\t\t{disp["addr"]}: {disp["fps"]} fps, {disp["throttled"]} throttled')
+		for stage, histogram in group['stages'].items():
+			if histogram['count']:
+				lines.append(
+					f'\t{stage:<10} mean {histogram["mean_ms"]:.3f} ms'
+					f', p95 <= {histogram["p95_ms"]} ms ({histogram["count"]} frames)'
+				)
+		if 'pipeline' in group:
+			pipeline = group['pipeline']
+			lines.append(
+				f'\tqueued {pipeline["decode"]["queued"]}/{pipeline["decode"]["queue_size"]} decoded'
+				f', {pipeline["convert"]["queued"]}/{pipeline["convert"]["queue_size"]} converted'
+			)
+	if 'image_cache' in snapshot:
+		image_cache = snapshot['image_cache']
+		lines.append(
+			f'Image cache: {image_cache["entries"]} images, {image_cache["size_mib"]}/{image_cache["max_size_mib"]} MiB'
+			f', {image_cache["hits"]} hits, {image_cache["disk_hits"]} disk hits, {image_cache["misses"]} misses'
+			f', {image_cache["evictions"]} evicted'
+		)
+	for key, source in snapshot.get('shared_sources', {}).items():
+		lines.append(f'Shared source "{key}": {source["frames"]} frames read for the groups ' + ', '.join(f'"{group}"' for group in source['groups']))
+
+	return '\n'.join(lines)
+
+
+def format_prometheus(snapshot):
+	"""Return a snapshot in the Prometheus text format."""
+
+	lines = []
+
+	def add_metric(name, metric_type, help_text, samples):
+		lines.append(f'# HELP vsp_{name} {help_text}')
+		lines.append(f'# TYPE vsp_{name} {metric_type}')
+		for labels, value in samples:
+			labels_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+			lines.append(f'vsp_{name}{{{labels_text}}} {value}')
+
+	groups = snapshot['groups']
+	for key, metric_type, help_text in (
+		('fps', 'gauge', f'Frames sent per second over the last {FPS_WINDOW} seconds.'),
+		('displays', 'gauge', 'Displays registered.'),
+		('frames_sent', 'counter', 'Frames sent.'),
+		('bytes_sent', 'counter', 'Bytes sent to the displays.'),
+		('datagrams_sent', 'counter', 'Datagrams sent to the displays.'),
+		('heartbeat_expiries', 'counter', 'Displays removed for missing heartbeats.'),
+		('send_dropped', 'counter', 'Datagrams replaced by newer ones before being sent, for the displays registered.'),
+		('send_errors', 'counter', 'Datagrams which failed to be sent, for the displays registered.'),
+		('frames_throttled', 'counter', 'Frames skipped to stay within the bandwidth budget, for the displays registered.')
+	):
+		name = key if metric_type == 'gauge' else f'{key}_total'
+		add_metric(name, metric_type, help_text, [({'group': group_name}, group.get(key, 0)) for group_name, group in groups.items()])
+
+	add_metric('frames_dropped_total', 'counter', 'Frames dropped by a stage before being sent.', [
+		({'group': group_name, 'stage': stage}, count)
+		for group_name, group in groups.items()
+		for stage, count in group['dropped_by_stage'].items()
+	])
+
+	add_metric('display_fps', 'gauge', f'Frames per second sent to a throttled display over the last {FPS_WINDOW} seconds.', [
+		({'group': group_name, 'addr': disp['addr']}, disp['fps'])
+		for group_name, group in groups.items()
+		for disp in group.get('throttled_displays', [])
+	])
+
+	lines.append('# HELP vsp_stage_seconds Time spent by a stage on a frame.')
+	lines.append('# TYPE vsp_stage_seconds histogram')
+	for group_name, group in groups.items():
+		for stage, histogram in group['stages'].items():
+			labels = f'group="{group_name}",stage="{stage}"'
+			cumulative = 0
+			for bound, count in histogram['buckets'].items():
+				cumulative += count
+				lines.append(f'vsp_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+			lines.append(f'vsp_stage_seconds_sum{{{labels}}} {histogram["sum"]}')
+			lines.append(f'vsp_stage_seconds_count{{{labels}}} {histogram["count"]}')
+
+	add_metric('uptime_seconds', 'gauge', 'Time since the streamer started.', [({}, snapshot['uptime'])])
+
+	return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(get_snapshot, host='127.0.0.1', port=9100):
+	"""Serve the metrics over HTTP, in the Prometheus text format at
+	/metrics and as JSON at /metrics.json. Return the server.
+
+	get_snapshot is called in the event loop."""
+
+	async def handle(reader, writer):
+		try:
+			request_line = await asyncio.wait_for(reader.readline(), 5)
+			# Skip the headers.
+			while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+				pass
+
+			parts = request_line.decode('latin-1').split()
+			path = parts[1] if len(parts) > 1 else ''
+			if path == '/metrics':
+				status, content_type = '200 OK', 'text/plain; version=0.0.4'
+				body = format_prometheus(get_snapshot())
+			elif path == '/metrics.json':
+				status, content_type = '200 OK', 'application/json'
+				body = json.dumps(get_snapshot())
+			else:
+				status, content_type, body = '404 Not Found', 'text/plain', 'Not found\n'
+
+			body = body.encode()
+			writer.write(
+				f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode()
+				+ body
+			)
+			await writer.drain()
+
+		except (asyncio.TimeoutError, ConnectionError):
+			pass
+
+		finally:
+			writer.close()
+
+	return await asyncio.start_server(handle, host, port)
+
+
+# The metrics of the streamer.
+metrics = Metrics()
\ No newline at end of file
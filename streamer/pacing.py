@@ -0,0 +1,171 @@
+import time
+
+from PIL import Image, ImageSequence
+
+
+
+# Browsers play GIF frames with a very short duration at this duration
+# instead, and GIF authors rely on it.
+GIF_MIN_FRAME_DURATION = 0.02
+GIF_DEFAULT_FRAME_DURATION = 0.1
+
+
+def get_gif_frame_durations(path):
+	"""Return the duration of each frame of a GIF in seconds, or None
+	if the file is not a GIF."""
+
+	try:
+		with Image.open(path) as img:
+			if img.format != 'GIF':
+				return None
+
+			durations = []
+			for frame in ImageSequence.Iterator(img):
+				duration = frame.info.get('duration', 0) / 1000
+				if duration < GIF_MIN_FRAME_DURATION:
+					duration = GIF_DEFAULT_FRAME_DURATION
+				durations.append(duration)
+
+			return durations
+
+	except OSError:
+		# Not an image PIL can read (e.g. a video).
+		return None
+
+
+class FramePacer:
+	"""Schedule the frames of a source on a monotonic clock.
+
+	The presentation time of each frame is based on the source's native
+	timing, either a constant fps or a duration for each frame (GIF).
+	Sources without timing (live sources such as a camera) are sent as
+	soon as their frames are available.
+
+	Frames which are already late (the next frame is due) are skipped,
+	so that playback keeps in sync with the wall-clock rather than
+	drifting when decoding or encoding is slow. max_fps optionally caps
+	the rate at which frames get sent.
+
+	The pacer doesn't track which frame is the current one, each frame
+	carries its own presentation time (see timeline()), so that it can
+	be shared by the stages of a pipeline running in different
+	threads."""
+
+	def __init__(self, fps=0, durations=None, max_fps=0, max_stall=0.5):
+		self.fps = fps
+		self.durations = durations
+		self.max_fps = max_fps
+		# The max time without sending a frame, after which late frames
+		# are sent anyway. Prevents a source which can't be decoded in
+		# real time from never being displayed.
+		self.max_stall = max_stall
+
+		# The clock starts with the first frame.
+		self.start_ts = None
+		# The time at which the next frame can be sent because of
+		# max_fps.
+		self.next_slot = None
+		self.last_sent_ts = None
+		# The pacer this one was forked from, if any (see fork()).
+		self.parent = None
+
+
+	@property
+	def paced(self):
+		"""True if the source has a native timing to follow."""
+		return bool(self.durations) or (self.fps > 0)
+
+
+	def clock(self):
+		"""The time elapsed since the first frame."""
+		if self.parent is not None:
+			return self.parent.clock()
+		if self.start_ts is None:
+			self.start_ts = time.monotonic()
+		return time.monotonic() - self.start_ts
+
+
+	def frame_duration(self, frame_idx):
+		"""The duration of a frame."""
+		if self.durations:
+			return self.durations[min(frame_idx, len(self.durations) - 1)]
+		return 1 / self.fps
+
+
+	def timeline(self):
+		"""Yield the presentation time (relative to the first frame) and
+		the duration of each frame of the source, or (None, None) for
+		sources without timing."""
+
+		frame_idx = 0
+		pts = 0.0
+		while True:
+			if not self.paced:
+				yield None, None
+				continue
+
+			duration = self.frame_duration(frame_idx)
+			yield pts, duration
+			pts += duration
+			frame_idx += 1
+
+
+	def time_until_due(self, pts=None):
+		"""The time left before a frame can be sent."""
+		now = self.clock()
+		target = pts if self.paced else now
+		if self.next_slot is not None:
+			target = max(target, self.next_slot)
+		return target - now
+
+
+	def should_skip(self, pts=None, duration=None):
+		"""True if a frame should not be processed any further, either
+		because it is late or because of max_fps."""
+
+		now = self.clock()
+
+		if not self.paced:
+			# Live sources can only be skipped because of max_fps.
+			return (self.next_slot is not None) and (now < self.next_slot)
+
+		# Before the first frame is sent, the stall counts from the
+		# start of the clock.
+		last_sent_ts = self.last_sent_ts or 0.0
+		if (now - last_sent_ts) >= self.max_stall:
+			# We've been skipping for too long, show something.
+			return False
+
+		next_pts = pts + duration
+		if now >= next_pts:
+			# The next frame is already due.
+			return True
+
+		if (self.next_slot is not None) and (next_pts <= self.next_slot):
+			# A later frame will still be on time for the next slot.
+			return True
+
+		return False
+
+
+	def mark_sent(self):
+		"""Mark a frame as sent."""
+		now = self.clock()
+		if self.max_fps:
+			self.next_slot = now + (1 / self.max_fps)
+		self.last_sent_ts = now
+		if self.parent is not None:
+			# So that the source isn't skipping frames while they get
+			# sent.
+			self.parent.last_sent_ts = max(self.parent.last_sent_ts or 0.0, now)
+
+
+	def fork(self, max_fps=0):
+		"""Return a pacer for another consumer of the same frames (see
+		source_mux.py): it runs on this pacer's clock, with its own
+		max_fps, and the frames it sends count as sent for this pacer
+		too."""
+
+		pacer = FramePacer(self.fps, self.durations, max_fps, self.max_stall)
+		pacer.parent = self
+		return pacer
\ No newline at end of file
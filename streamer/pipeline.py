@@ -0,0 +1,158 @@
+"""
+The stages a stream's frames go through, each one running on its own:
+
+	decode -> [decoded queue] -> resize & convert -> [converted queue] -> send
+
+Decoding runs ahead in a thread of its own (OpenCV releases the GIL
+while decoding), converting runs in the scheduler's worker thread and
+sending in the event loop, so that each stage works on a frame while the
+others work on the previous or the next ones.
+
+The queues are bounded: a stage which is ahead of the next one waits for
+room (backpressure), unless its frames are live, in which case the
+oldest frame gets dropped. Any stage drops the frames which got stale,
+i.e. when the next frame is already due (see FramePacer).
+"""
+
+import time
+import queue
+import threading
+from collections import namedtuple
+
+
+
+# The decoded queue depth used when not specified.
+DECODE_QUEUE_SIZE = 4
+# The converted queue depth used when not specified.
+CONVERT_QUEUE_SIZE = 2
+
+
+# A frame converted for a wall, waiting to be sent: the tiles and their
+# digests (see VideoWall.set_frame()), its timing (see
+# FramePacer.timeline()) and the run-length encoded tiles, if any (see
+# VideoWall.encode_rle_tiles()).
+ConvertedFrame = namedtuple('ConvertedFrame', ['wall', 'tiles', 'digests', 'pts', 'rle_tiles'], defaults=[None])
+
+
+class DecodeStage:
+	"""Decode the frames of a source ahead, in a thread of its own, into
+	a bounded queue.
+
+	frames is an iterator yielding (frame, pts, duration) tuples, see
+	streamer.get_frames(). release is an optional callable releasing the
+	source, called by the thread once it's done with it, so that the
+	source never gets released while it's being read.
+	If drop_oldest is True, the oldest queued frame is dropped to make
+	room for a new one rather than waiting (live sources).
+	notify is an optional callable, called from the decoding thread
+	whenever a frame gets queued or the source is exhausted.
+	metrics is an optional GroupMetrics (see metrics.py) the decoding
+	times and the dropped frames get counted in."""
+
+	def __init__(self, frames, release=None, queue_size=DECODE_QUEUE_SIZE, drop_oldest=False, notify=None, metrics=None):
+		self.frames = frames
+		self.release = release
+		self.queue = queue.Queue(maxsize=max(queue_size, 1))
+		self.drop_oldest = drop_oldest
+		self.notify = notify
+		self.metrics = metrics
+		self.thread = threading.Thread(target=self.run, name='decode', daemon=True)
+
+		# Set once no more frames will be queued.
+		self.finished = False
+		self.stopped = False
+		# The frames dropped because the queue was full.
+		self.dropped = 0
+		# The time spent waiting for room in the queue.
+		self.blocked_time = 0.0
+		# The error which stopped the decoding, if any.
+		self.error = None
+
+
+	def start(self):
+		self.thread.start()
+
+
+	def stop(self):
+		"""Tell the thread to stop asap. It releases the source on its
+		own."""
+		self.stopped = True
+
+
+	@property
+	def exhausted(self):
+		"""True if all the frames have been taken from the queue."""
+		return self.finished and self.queue.empty()
+
+
+	def get(self):
+		"""Return the next decoded frame, or None if none is queued."""
+		try:
+			return self.queue.get_nowait()
+		except queue.Empty:
+			return None
+
+
+	def put(self, item):
+		"""Queue a decoded frame, waiting for room or dropping the
+		oldest frame when the queue is full."""
+
+		start_ts = time.monotonic()
+		while not self.stopped:
+			try:
+				if self.drop_oldest:
+					self.queue.put_nowait(item)
+				else:
+					# Wait in short steps to remain responsive.
+					self.queue.put(item, timeout=0.1)
+				break
+
+			except queue.Full:
+				if self.drop_oldest:
+					try:
+						self.queue.get_nowait()
+						self.dropped += 1
+						if self.metrics:
+							self.metrics.frames_dropped['decode'] += 1
+					except queue.Empty:
+						pass
+
+		self.blocked_time += time.monotonic() - start_ts
+
+
+	def run(self):
+		try:
+			frames = iter(self.frames)
+			while not self.stopped:
+				start_ts = time.perf_counter()
+				item = next(frames, None)
+				if item is None:
+					break
+				if self.metrics:
+					self.metrics.stages['decode'].observe(time.perf_counter() - start_ts)
+
+				self.put(item)
+				if self.notify:
+					self.notify()
+
+		except Exception as e:
+			self.error = e
+
+		finally:
+			self.finished = True
+			if hasattr(self.frames, 'close'):
+				self.frames.close()
+			if self.release:
+				self.release()
+			if self.notify:
+				self.notify()
+
+
+	def stats(self):
+		"""Return the stage's backpressure figures."""
+		return {
+			'queued': self.queue.qsize(),
+			'queue_size': self.queue.maxsize,
+			'dropped': self.dropped,
+			'blocked_time': round(self.blocked_time, 3)
+		}
\ No newline at end of file
@@ -0,0 +1,220 @@
+import time
+
+from video_wall import VideoWall
+from metrics import metrics
+
+
+
+# The interval between the sweeps removing the dead displays.
+EXPIRY_INTERVAL = 1
+
+
+def forget_display(disp):
+	"""Drop what the sender of a display which went away keeps for it
+	(see fanout.FanoutSender)."""
+	forget = getattr(disp.sock, 'forget', None)
+	if forget:
+		forget(disp.addr)
+
+
+class DisplayRegistry:
+	"""The video walls and the remote displays, indexed by group and by
+	address so that looking them up doesn't depend on how many of them
+	there are.
+
+	It must be used from the event loop's thread, except for get_wall()
+	which can be called from any thread."""
+
+	def __init__(self, max_heartbeat_interval=10, max_datagram_size=0, display_budget=0):
+		# Group name -> video wall.
+		self.walls = {}
+		# Address -> (video wall, position, display).
+		self.displays = {}
+		self.max_heartbeat_interval = max_heartbeat_interval
+		# The max size of the datagrams sent to the displays of the
+		# walls which don't set theirs (0 = no limit).
+		self.max_datagram_size = max_datagram_size
+		# The bandwidth budget of each display, in bytes per second, for
+		# the walls which don't set theirs (0 = no limit).
+		self.display_budget = display_budget
+		self.expiry_handle = None
+
+
+	def get_wall(self, group):
+		"""Return the video wall of a group, if any."""
+		return self.walls.get(group)
+
+
+	def set_walls(self, walls_data):
+		"""Replace the video walls with the ones described in the data
+		sent by the server (SERVER INIT), forgetting all the
+		displays.
+
+		A wall can set the max size of the datagrams sent to its
+		displays (max_datagram_size), e.g. to use displays larger than
+		a datagram can hold, and the bandwidth budget of its displays
+		in KiB per second (display_budget, see bandwidth.py)."""
+
+		walls = {}
+		for wall_data in walls_data:
+			wall = VideoWall(
+				tuple(wall_data['shape']),
+				tuple(wall_data['display_res']),
+				name = wall_data['group'],
+				max_heartbeat_interval=self.max_heartbeat_interval,
+				max_datagram_size=wall_data.get('max_datagram_size', self.max_datagram_size),
+				display_budget=(wall_data['display_budget'] * 1024) if ('display_budget' in wall_data) else self.display_budget
+			)
+			walls[wall.name] = wall
+
+		for addr, (_, _, disp) in self.displays.items():
+			forget_display(disp)
+
+		# Replace the whole dict so that other threads never see it
+		# half-built.
+		self.walls = walls
+		self.displays = {}
+
+
+	def snapshot(self):
+		"""Return the walls, as they are now, and the displays, as
+		JSON-compatible data (see state.py)."""
+
+		return {
+			'walls': [
+				{
+					'group': wall.name,
+					'shape': list(wall.matrix.shape),
+					'display_res': list(wall.display_res),
+					'max_datagram_size': wall.max_datagram_size,
+					'display_budget': wall.display_budget / 1024
+				}
+				for wall in self.walls.values()
+			],
+			'displays': [
+				{
+					'addr': list(addr),
+					'group': wall.name,
+					'position': list(position)
+				}
+				for addr, (wall, position, _) in self.displays.items()
+			]
+		}
+
+
+	def restore(self, sock, state):
+		"""Replace the walls and the displays with the ones of a
+		snapshot(), the displays being sent their frames through sock.
+		The displays get the usual time to send a heartbeat before they
+		expire. Return the number of walls and of displays restored."""
+
+		self.set_walls(state['walls'])
+		displays = [
+			self.add_display(sock, tuple(display['addr']), display['group'], tuple(display['position']))
+			for display in state['displays']
+		]
+		return len(self.walls), sum(disp is not None for disp in displays)
+
+
+	def set_display_budget(self, rate, group=None):
+		"""Limit the bandwidth each display of a group takes to rate
+		bytes per second (0 = no limit), or of all the groups, and of
+		the walls to come, if group is None. Return the number of walls
+		changed."""
+
+		if group is None:
+			self.display_budget = rate
+		walls = [wall for name, wall in self.walls.items() if group in (None, name)]
+		for wall in walls:
+			wall.set_display_budget(rate)
+		return len(walls)
+
+
+	def add_display(self, sock, addr, group, position):
+		"""Add a remote display to the wall of a group (CLIENT INIT) and
+		replicate the wall's last frame to it.
+
+		A display which registers again is not duplicated, it just
+		gets the last frame again. Return the display, or None if the
+		group doesn't exist. Raise a ValueError if the position is
+		outside of the wall."""
+
+		wall = self.walls.get(group)
+		if wall is None:
+			return None
+
+		# The position comes from the network, a negative index would
+		# wrap around onto another screen.
+		if (len(position) != 2) or not all(isinstance(p, int) and (0 <= p < size) for p, size in zip(position, wall.matrix.shape)):
+			raise ValueError(f'Position {position} outside of the wall of group "{group}"')
+
+		entry = self.displays.get(addr)
+		if entry:
+			old_wall, old_position, disp = entry
+			if (old_wall is wall) and (old_position == position):
+				disp.heartbeat()
+				if wall.last_tiles is not None:
+					disp.send_frame(wall.last_tiles[position], wall.last_digests[position])
+				return disp
+
+			# The display moved, remove it from its old position.
+			self.remove_display(addr)
+
+		disp = wall.add_display(sock, addr, position, send_last_frame=True)
+		self.displays[addr] = (wall, position, disp)
+
+		return disp
+
+
+	def remove_display(self, addr):
+		"""Remove the display at an address, if any."""
+
+		entry = self.displays.pop(addr, None)
+		if entry:
+			wall, position, disp = entry
+			wall.remove_display(disp, position)
+			forget_display(disp)
+
+
+	def heartbeat(self, addr):
+		"""Mark the display at an address alive (CLIENT HEARTBEAT).
+		Return False if there is no display at that address."""
+
+		entry = self.displays.get(addr)
+		if entry:
+			entry[2].heartbeat()
+		return entry is not None
+
+
+	def expire(self):
+		"""Remove the displays we didn't receive a heartbeat from
+		recently. Return their number."""
+
+		now = time.monotonic()
+		dead_addrs = [
+			addr
+			for addr, (_, _, disp) in self.displays.items()
+			if not disp.is_alive(now)
+		]
+		for addr in dead_addrs:
+			metrics.group(self.displays[addr][0].name).heartbeat_expiries += 1
+			self.remove_display(addr)
+
+		return len(dead_addrs)
+
+
+	def start_expiry(self, loop, interval=EXPIRY_INTERVAL):
+		"""Sweep the dead displays away every interval seconds, within
+		an event loop."""
+
+		def sweep():
+			self.expire()
+			self.expiry_handle = loop.call_later(interval, sweep)
+
+		self.expiry_handle = loop.call_later(interval, sweep)
+
+
+	def stop_expiry(self):
+		if self.expiry_handle:
+			self.expiry_handle.cancel()
+			self.expiry_handle = None
\ No newline at end of file
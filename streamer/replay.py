@@ -0,0 +1,358 @@
+"""
+Replay a capture of the streamer's traffic (see streamer.py --capture
+and capture.py), to compare two versions of the streamer under the same
+load:
+
+	check	run the streamer on the control messages of the capture
+		(streamer.py --replay, at the captured pace) and check the
+		datagrams it sends to each display against the captured
+		ones, in order
+	play	send the captured datagrams to receivers listening on
+		loopback, through the fan-out sender (see fanout.py), at the
+		captured pace or as fast as possible, and report the
+		throughput
+
+	py replay.py check capture.vspcap [--streamer_args "--rle ..."] [--output report.json]
+	py replay.py play capture.vspcap [--speed 0]
+
+check runs the streamer with the captured arguments (but the address,
+the metrics server and the capture ones) in the captured working
+directory, --streamer_args being appended. A datagram sent is the same
+as a captured one (bit-exact), or equivalent to it, i.e. the display
+shows the same frame after it (e.g. a whole frame sent where its changed
+rows were, as a keyframe fell on another frame), or unexpected. The
+captured datagrams matched by none count as missing, e.g. the frames
+skipped because the replay ran late. Any unexpected datagram makes
+check exit with 1.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import shlex
+from bisect import bisect_left
+
+from capture import CaptureReader, DATAGRAM
+from frame_codec import FrameDecoder, CHUNK_MARKER
+from fanout import FanoutSender, RETRY_INTERVAL
+
+
+
+STREAMER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamer.py')
+# The streamer arguments which don't carry over to a replay, they take
+# a value.
+SKIPPED_ARGS = ('--host', '--port', '--metrics_host', '--metrics_port', '--capture', '--replay')
+# The time the replaying streamer gets on top of the capture's duration.
+REPLAY_TIMEOUT = 60
+
+
+def get_streamer_argv(header, extra_args=()):
+	"""Return the arguments of the captured streamer, but the skipped
+	ones, followed by extra_args."""
+
+	argv = []
+	skip_value = False
+	for arg in header.get('argv', []):
+		if skip_value:
+			skip_value = False
+			continue
+		name = arg.split('=', 1)[0]
+		if name in SKIPPED_ARGS:
+			skip_value = '=' not in arg
+			continue
+		argv.append(arg)
+
+	return argv + list(extra_args)
+
+
+def get_free_port():
+	with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+		sock.bind(('127.0.0.1', 0))
+		return sock.getsockname()[1]
+
+
+def digest(data):
+	return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def read_displays(capture):
+	"""Return, for each display (address) of a capture, its group and
+	position, and the digest of each datagram sent to it along with the
+	digest of the frame it shows afterwards (see
+	frame_codec.FrameDecoder), None for a chunk which doesn't complete a
+	frame."""
+
+	displays = {}
+	for record in capture.records(kinds=(DATAGRAM,)):
+		display = displays.get(record.addr)
+		if (display is None) or (display['display_res'] != record.display_res):
+			display = displays[record.addr] = {
+				'group': record.group,
+				'position': list(record.position),
+				'display_res': record.display_res,
+				'decoder': FrameDecoder(*record.display_res),
+				'datagrams': [],
+				'frames': []
+			}
+
+		reassembler = display['decoder'].reassembler
+		frame_count = reassembler.frames
+		frame_lines = display['decoder'].decode(record.data)
+		complete = (record.data[:1] != bytes([CHUNK_MARKER])) or (reassembler.frames > frame_count)
+		display['datagrams'].append(digest(record.data))
+		display['frames'].append(digest(b''.join(frame_lines)) if complete else None)
+
+	return displays
+
+
+def index_digests(digests):
+	"""Return digest -> the indices it's found at, in order."""
+	index = {}
+	for idx, value in enumerate(digests):
+		index.setdefault(value, []).append(idx)
+	return index
+
+
+def find_next(index, value, start):
+	"""Return the first index of a digest from start on, or None."""
+	indices = index.get(value, ())
+	pos = bisect_left(indices, start)
+	return indices[pos] if pos < len(indices) else None
+
+
+def match_display(captured, replayed):
+	"""Match the datagrams sent to a display in a replay against the
+	captured ones, in order. Return the counts.
+
+	The chunks of a frame which aren't the same as the captured ones
+	are as equivalent as the frame they complete."""
+
+	datagram_index = index_digests(captured['datagrams'])
+	frame_index = index_digests(captured['frames'])
+
+	same = equivalent = unexpected = 0
+	# The captured datagrams matched.
+	matched = 0
+	first_unexpected = None
+	# The chunks waiting for their frame to be complete.
+	chunks = []
+	next_idx = 0
+	for idx, (datagram, frame) in enumerate(zip(replayed['datagrams'], replayed['frames'])):
+		match_idx = find_next(datagram_index, datagram, next_idx)
+		if match_idx is not None:
+			same += 1
+			matched += 1
+			next_idx = match_idx + 1
+			continue
+
+		if frame is None:
+			chunks.append(idx)
+			continue
+
+		match_idx = find_next(frame_index, frame, next_idx)
+		if match_idx is not None:
+			equivalent += 1 + len(chunks)
+			# The captured chunks of the frame match too.
+			first_idx = match_idx
+			while (first_idx > next_idx) and (captured['frames'][first_idx - 1] is None):
+				first_idx -= 1
+			matched += match_idx + 1 - first_idx
+			next_idx = match_idx + 1
+		else:
+			unexpected += 1 + len(chunks)
+			if first_unexpected is None:
+				first_unexpected = (chunks or [idx])[0]
+		chunks = []
+
+	if chunks:
+		# A frame never completed.
+		unexpected += len(chunks)
+		if first_unexpected is None:
+			first_unexpected = chunks[0]
+
+	return {
+		'captured': len(captured['datagrams']),
+		'sent': len(replayed['datagrams']),
+		'same': same,
+		'equivalent': equivalent,
+		'missing': len(captured['datagrams']) - matched,
+		'unexpected': unexpected,
+		'first_unexpected': first_unexpected
+	}
+
+
+def check(capture_path, streamer_args, timeout=None):
+	"""Replay a capture with the streamer and return the report of the
+	datagrams it sent."""
+
+	capture = CaptureReader(capture_path)
+	duration = max((record.ts for record in capture.records()), default=0)
+	cwd = capture.header.get('cwd')
+	if not (cwd and os.path.isdir(cwd)):
+		cwd = os.path.dirname(STREAMER_PATH)
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		replay_path = os.path.join(tmp_dir, 'replay.vspcap')
+		argv = [
+			sys.executable,
+			STREAMER_PATH,
+			*get_streamer_argv(capture.header, streamer_args),
+			'--host', '127.0.0.1',
+			'--port', str(get_free_port()),
+			'--replay', os.path.abspath(capture_path),
+			'--capture', replay_path
+		]
+		print(f'Replaying {duration:.1f}s of traffic: {" ".join(argv[1:])}', file=sys.stderr)
+
+		start_ts = time.monotonic()
+		# The streamer's output goes to stderr, the report to stdout.
+		with subprocess.Popen(argv, cwd=cwd, stdin=subprocess.DEVNULL, stdout=sys.stderr) as proc:
+			try:
+				proc.wait(timeout or duration + REPLAY_TIMEOUT)
+			except subprocess.TimeoutExpired:
+				proc.kill()
+				raise
+		elapsed = time.monotonic() - start_ts
+
+		captured = read_displays(capture)
+		replayed = read_displays(CaptureReader(replay_path))
+
+	displays = []
+	for addr in sorted(set(captured) | set(replayed), key=str):
+		empty = {'datagrams': [], 'frames': []}
+		display = captured.get(addr) or replayed.get(addr)
+		displays.append({
+			'addr': f'{addr[0]}:{addr[1]}',
+			'group': display['group'],
+			'position': display['position'],
+			**match_display(captured.get(addr, empty), replayed.get(addr, empty))
+		})
+
+	summary = {
+		key: sum(display[key] for display in displays)
+		for key in ('captured', 'sent', 'same', 'equivalent', 'missing', 'unexpected')
+	}
+	return {
+		'capture': capture.header,
+		'elapsed': round(elapsed, 3),
+		'summary': {'displays': len(displays), **summary},
+		'displays': displays
+	}
+
+
+async def play(capture_path, speed):
+	"""Send the datagrams of a capture to receivers on loopback, one per
+	captured display, at speed times the captured pace (0 = as fast as
+	possible). Return the report."""
+
+	capture = CaptureReader(capture_path)
+	# The datagrams of each frame, as they were handed to the sender.
+	frames = []
+	for record in capture.records(kinds=(DATAGRAM,)):
+		if record.part == 0 or not frames:
+			frames.append((record.ts, record.addr, []))
+		frames[-1][2].append(record.data)
+
+	loop = asyncio.get_running_loop()
+	receivers = {}
+	received = {'datagrams': 0, 'bytes': 0}
+
+	def receive(sock):
+		try:
+			while True:
+				data = sock.recv(65536)
+				received['datagrams'] += 1
+				received['bytes'] += len(data)
+		except BlockingIOError:
+			pass
+
+	for _, addr, _ in frames:
+		if addr not in receivers:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			sock.bind(('127.0.0.1', 0))
+			sock.setblocking(False)
+			loop.add_reader(sock, receive, sock)
+			receivers[addr] = sock
+	sender = FanoutSender(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), loop)
+	receiver_addrs = {addr: sock.getsockname() for addr, sock in receivers.items()}
+
+	datagram_count = sum(len(datagrams) for _, _, datagrams in frames)
+	byte_count = sum(len(data) for _, _, datagrams in frames for data in datagrams)
+	first_ts = frames[0][0] if frames else 0
+	start_ts = loop.time()
+	for ts, addr, datagrams in frames:
+		addr = receiver_addrs[addr]
+		if speed:
+			delay = start_ts + (ts - first_ts) / speed - loop.time()
+			if delay > 0:
+				await asyncio.sleep(delay)
+		elif sender.is_pending(addr):
+			# As fast as possible, without replacing a frame not sent
+			# yet.
+			await asyncio.sleep(0)
+			while sender.is_pending(addr):
+				await asyncio.sleep(RETRY_INTERVAL)
+		sender.sendmany(datagrams, addr)
+
+	while sender.pending:
+		await asyncio.sleep(RETRY_INTERVAL)
+	elapsed = loop.time() - start_ts
+	# Let the receivers catch up.
+	await asyncio.sleep(0.1)
+
+	for sock in receivers.values():
+		loop.remove_reader(sock)
+		sock.close()
+	sender.close()
+
+	return {
+		'capture': capture.header,
+		'speed': speed,
+		'displays': len(receivers),
+		'frames': len(frames),
+		'datagrams': datagram_count,
+		'bytes': byte_count,
+		'elapsed': round(elapsed, 3),
+		'datagrams_per_sec': round(datagram_count / elapsed, 1) if elapsed else None,
+		'mib_per_sec': round(byte_count / elapsed / (1 << 20), 2) if elapsed else None,
+		'dropped': sum(counters.dropped for counters in sender.counters.values()),
+		'errors': sum(counters.errors for counters in sender.counters.values()),
+		'received': received['datagrams'],
+		'received_bytes': received['bytes']
+	}
+
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(add_help=False)
+	argparser.add_argument('--help', action='help', help='Show this help message and exit')
+	argparser.add_argument('--streamer_args', type=str, default='', help='check: arguments given to the streamer on top of the captured ones')
+	argparser.add_argument('--speed', type=float, default=1, help='play: times the captured pace (0 = as fast as possible)')
+	argparser.add_argument('--output', '-o', type=str, default='', help='JSON file to write the report to (stdout by default)')
+	argparser.add_argument('mode', type=str, choices=['check', 'play'], help='Check the frames the streamer sends, or play the captured frames')
+	argparser.add_argument('capture_path', type=str, help='Capture file (see streamer.py --capture)')
+	args = argparser.parse_args(sys.argv[1:])
+
+	if args.mode == 'check':
+		report = check(args.capture_path, shlex.split(args.streamer_args))
+		summary = report['summary']
+	else:
+		report = asyncio.run(play(args.capture_path, args.speed))
+		summary = {key: value for key, value in report.items() if key != 'capture'}
+
+	print(json.dumps(summary), file=sys.stderr)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent='\t')
+	else:
+		print(json.dumps(report, indent='\t'))
+
+	if (args.mode == 'check') and report['summary']['unexpected']:
+		sys.exit(1)
\ No newline at end of file
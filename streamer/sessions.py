@@ -0,0 +1,440 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from glyph_cache import GlyphStream
+from image_cache import CachedTiles
+from metrics import metrics
+from pipeline import DecodeStage, ConvertedFrame, DECODE_QUEUE_SIZE, CONVERT_QUEUE_SIZE
+
+
+# The max time the scheduler sleeps when no stream needs it.
+IDLE_INTERVAL = 1
+# The max time to wait for the sources to be released when shutting
+# down.
+RELEASE_TIMEOUT = 1
+
+
+def release_frame_src(src):
+	"""Release the resources held by a frame source."""
+	if hasattr(src, 'release'):
+		# cv2.VideoCapture.
+		src.release()
+	elif hasattr(src, 'stop'):
+		# CamGear.
+		src.stop()
+
+
+class StreamSession:
+	"""A stream of frames playing on a video wall group.
+
+	The frames go through a pipeline (see pipeline.py): they get decoded
+	ahead by a thread of the session, then converted and sent when the
+	session gets ticked by the SessionManager which plays all the
+	sessions."""
+
+	def __init__(self, group, frame_src, frames, font_pal, pacer=None, clear=False, keyframe_interval=None, refresh_interval=0, encoder_pool=None, decode_queue_size=DECODE_QUEUE_SIZE, convert_queue_size=CONVERT_QUEUE_SIZE, rle=False, release=None):
+		self.group = group
+		self.frame_src = frame_src
+		# An iterator yielding the frames of the source with their
+		# timing.
+		self.frames = frames
+		self.metrics = metrics.group(group)
+		# Live sources drop their oldest frames rather than falling
+		# behind.
+		self.decoder = DecodeStage(
+			frames,
+			# A shared source (see source_mux.py) gets released its own way.
+			release=release or (lambda: release_frame_src(frame_src)),
+			queue_size=decode_queue_size,
+			drop_oldest=not (pacer and pacer.paced),
+			metrics=self.metrics
+		)
+		self.font_pal = font_pal
+		# Converts the frames with worker processes, if set.
+		self.encoder_pool = encoder_pool
+		self.pacer = pacer
+		# Send a blank frame when the session ends.
+		self.clear = clear
+		self.keyframe_interval = keyframe_interval
+		self.refresh_interval = refresh_interval
+		# Run-length encode the frames too (see
+		# frame_codec.encode_rle()), the displays get whichever is
+		# smaller.
+		self.rle = rle
+
+		# The converted frames waiting to be sent.
+		self.converted = deque()
+		self.convert_queue_size = max(convert_queue_size, 1)
+		# True while a frame is being converted.
+		self.busy = False
+		self.finished = False
+		self.released = False
+
+		# The frames dropped after being decoded because they got
+		# stale.
+		self.stale_dropped = 0
+		self.sent = 0
+
+
+	def start(self, notify=None):
+		"""Start decoding the frames. notify is called from the
+		decoding thread when a frame is ready to be converted."""
+		self.decoder.notify = notify
+		self.decoder.start()
+
+
+	@property
+	def wants_frame(self):
+		"""True if a decoded frame is ready and there is room to
+		convert it."""
+		return (
+			(not self.busy)
+			and (len(self.converted) < self.convert_queue_size)
+			and (not self.decoder.queue.empty())
+		)
+
+
+	@property
+	def done(self):
+		"""True if all the frames of the source have been sent."""
+		return self.decoder.exhausted and (not self.converted) and (not self.busy)
+
+
+	def prepare(self, get_wall):
+		"""Convert the next decoded frame for the wall, dropping the
+		decoded frames which got stale meanwhile.
+
+		This may block (converting), the scheduler calls it outside of
+		the event loop.
+		get_wall is a callable returning the wall of a group, if any.
+		Return True if a frame was converted."""
+
+		while not self.finished:
+			item = self.decoder.get()
+			if item is None:
+				return False
+
+			frame, pts, duration = item
+			if self.pacer and self.pacer.should_skip(pts, duration):
+				# The frame got late while waiting, don't waste time
+				# converting it.
+				self.stale_dropped += 1
+				self.metrics.frames_dropped['convert'] += 1
+				continue
+
+			wall = get_wall(self.group)
+			if wall is None:
+				# The group doesn't exist (yet), drop the frame.
+				return False
+
+			break
+
+		else:
+			return False
+
+		if isinstance(self.frame_src, (GlyphStream, CachedTiles)):
+			# The frame was converted already.
+			if not self.frame_src.fits(wall):
+				# The wall changed since the frame was cached.
+				return False
+			self.add_converted(wall, *frame, pts)
+			return True
+
+		# Reshape the image to fit the wall full resolution, unless it
+		# was decoded at that resolution already (see ffmpeg_source.py).
+		# We use cv2 to resize cause numpy would require additional steps.
+		if frame.shape[:2] != wall.full_res:
+			with self.metrics.timed('resize'):
+				frame = cv2.resize(
+					frame,
+					(wall.full_res[1], wall.full_res[0]),
+					interpolation=cv2.INTER_LINEAR
+				)
+		with self.metrics.timed('quantize'):
+			tiles, digests = wall.convert_frame(frame, self.encoder_pool or self.font_pal)
+		self.add_converted(wall, tiles, digests, pts)
+
+		return True
+
+
+	def add_converted(self, wall, tiles, digests, pts):
+		"""Queue a converted frame to be sent, run-length encoding it
+		first if needed."""
+
+		rle_tiles = None
+		if self.rle:
+			with self.metrics.timed('encode'):
+				rle_tiles = wall.encode_rle_tiles(tiles)
+		self.converted.append(ConvertedFrame(wall, tiles, digests, pts, rle_tiles))
+
+
+	def send(self):
+		"""Send the oldest converted frame if it's due, dropping the
+		converted frames which got stale (a later one is due already).
+
+		Return the time (in seconds) after which the frame will be due,
+		0 if it was sent, None if no frame is waiting to be sent."""
+
+		if self.pacer:
+			while (len(self.converted) > 1) and (self.pacer.time_until_due(self.converted[1].pts) <= 0):
+				self.converted.popleft()
+				self.stale_dropped += 1
+				self.metrics.frames_dropped['send'] += 1
+
+		if not self.converted:
+			return None
+
+		frame = self.converted[0]
+		if self.pacer:
+			delay = self.pacer.time_until_due(frame.pts)
+			if delay > 0:
+				# Come back when the frame is due.
+				return delay
+			self.pacer.mark_sent()
+
+		self.converted.popleft()
+		with self.metrics.timed('send'):
+			frame.wall.set_tiles(frame.tiles, frame.digests, frame.rle_tiles)
+			datagrams, sent_bytes = frame.wall.broadcast_last_frame(self.keyframe_interval, self.refresh_interval)
+		self.metrics.count_sent(datagrams, sent_bytes)
+		self.sent += 1
+
+		return 0
+
+
+	def stats(self):
+		"""Return the session's pipeline figures, the queues filling up
+		tell which stage holds the others back."""
+		return {
+			'decode': self.decoder.stats(),
+			'convert': {
+				'queued': len(self.converted),
+				'queue_size': self.convert_queue_size
+			},
+			'stale_dropped': self.stale_dropped,
+			'sent': self.sent
+		}
+
+
+	def close(self, get_wall=None, clear=False):
+		"""End the session and release its source.
+
+		If clear is True the wall's screens get cleared by sending a
+		blank frame."""
+
+		if self.finished:
+			return
+		self.finished = True
+		self.decoder.stop()
+		self.converted.clear()
+
+		if clear and get_wall:
+			wall = get_wall(self.group)
+			if wall is not None:
+				frame = np.zeros((*wall.full_res, 3), dtype=np.uint8)
+				wall.set_frame(frame, self.font_pal)
+				wall.broadcast_last_frame(self.keyframe_interval, self.refresh_interval)
+
+		if not self.busy:
+			self.release()
+
+
+	def release(self):
+		"""Release the session's resources. The decoding thread releases
+		the source on its own once it stops. The encoder pool must not
+		be in use anymore."""
+
+		if self.released:
+			return
+		self.released = True
+
+		self.decoder.stop()
+		if self.encoder_pool:
+			self.encoder_pool.shutdown()
+
+
+class SessionManager:
+	"""Play a stream session for each video wall group.
+
+	A single scheduler, running in the event loop shared with the network
+	traffic, ticks all the active sessions, so that playing on more
+	groups doesn't add more threads contending for the CPU. Converting the
+	frames happens in a worker thread so that the event loop stays
+	responsive, while the sessions decode the next frames in their own
+	threads.
+	Starting a session on a group preempts the one playing on it.
+
+	start() and stop() can be called from any thread."""
+
+	def __init__(self, get_wall, loop):
+		self.get_wall = get_wall
+		self.loop = loop
+		# Group name -> session.
+		self.sessions = {}
+		# Decodes and converts the frames.
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frames')
+		# Set to wake up the scheduler when the sessions change.
+		self.wakeup = asyncio.Event()
+		self.stopped = False
+		# Set by run().
+		self.loop_thread_id = None
+		self.task = None
+
+
+	def call_in_loop(self, func, *args):
+		"""Call a function in the event loop's thread and return its
+		result."""
+
+		if threading.get_ident() == self.loop_thread_id:
+			return func(*args)
+
+		future = Future()
+		def callback():
+			try:
+				future.set_result(func(*args))
+			except Exception as e:
+				future.set_exception(e)
+		self.loop.call_soon_threadsafe(callback)
+
+		return future.result()
+
+
+	def start(self, session):
+		"""Start playing a session, replacing the one playing on the
+		same group, if any."""
+		self.call_in_loop(self._start, session)
+
+
+	def _start(self, session):
+		old_session = self.sessions.get(session.group)
+		if old_session:
+			# The new session takes over the screens, no need to
+			# clear them.
+			old_session.close()
+		self.sessions[session.group] = session
+		session.start(self.notify)
+		self.wakeup.set()
+
+
+	def notify(self):
+		"""Wake up the scheduler. Can be called from any thread."""
+		try:
+			self.loop.call_soon_threadsafe(self.wakeup.set)
+		except RuntimeError:
+			# The event loop is closed.
+			pass
+
+
+	def stop(self, group=None):
+		"""Stop the session playing on a group, or all the sessions if
+		group is None. Return the number of stopped sessions."""
+		return self.call_in_loop(self._stop, group)
+
+
+	def _stop(self, group=None):
+		groups = list(self.sessions) if (group is None) else [group]
+		count = 0
+		for group in groups:
+			session = self.sessions.pop(group, None)
+			if session:
+				session.close(self.get_wall, clear=session.clear)
+				count += 1
+
+		self.wakeup.set()
+		return count
+
+
+	async def shutdown(self):
+		"""Stop all the sessions and the scheduler."""
+
+		sessions = list(self.sessions.values())
+		self._stop()
+		self.stopped = True
+		self.wakeup.set()
+		if self.task:
+			await self.task
+		self.executor.shutdown()
+
+		for session in sessions:
+			# The sessions which were converting a frame.
+			session.release()
+			# Give the sources a chance to be released properly.
+			await asyncio.to_thread(session.decoder.thread.join, RELEASE_TIMEOUT)
+
+
+	def run(self):
+		"""Start the scheduler in the event loop. Must be called from
+		the event loop's thread."""
+		self.loop_thread_id = threading.get_ident()
+		self.task = self.loop.create_task(self.schedule())
+
+
+	def convert(self, session):
+		"""Convert the next decoded frame of a session in the worker
+		thread, while the event loop goes on sending."""
+
+		session.busy = True
+		future = self.loop.run_in_executor(self.executor, session.prepare, self.get_wall)
+		future.add_done_callback(lambda future: self.on_converted(session, future))
+
+
+	def on_converted(self, session, future):
+		session.busy = False
+		try:
+			future.result()
+		except Exception as e:
+			print(f'Stream on group "{session.group}" failed: {e}')
+			self.end(session)
+
+		if session.finished:
+			# The session was stopped or replaced meanwhile.
+			session.release()
+
+		self.wakeup.set()
+
+
+	def end(self, session):
+		"""End a session which is done playing."""
+		session.close(self.get_wall, clear=session.clear)
+		if self.sessions.get(session.group) is session:
+			del self.sessions[session.group]
+
+
+	async def schedule(self):
+		"""The scheduler, tick the sessions until shut down."""
+
+		while not self.stopped:
+			timeout = IDLE_INTERVAL
+
+			for session in list(self.sessions.values()):
+				if session.finished:
+					# The session was stopped or replaced meanwhile.
+					continue
+
+				if session.wants_frame:
+					self.convert(session)
+
+				delay = session.send()
+				if delay is not None:
+					timeout = min(timeout, delay)
+
+				if session.done:
+					# All the frames have been sent.
+					if session.decoder.error:
+						print(f'Stream on group "{session.group}" failed: {session.decoder.error}')
+					self.end(session)
+
+			if timeout > 0:
+				try:
+					await asyncio.wait_for(self.wakeup.wait(), timeout)
+				except asyncio.TimeoutError:
+					pass
+			else:
+				# Let the network traffic in before the next tick.
+				await asyncio.sleep(0)
+			self.wakeup.clear()
\ No newline at end of file
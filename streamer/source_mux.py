@@ -0,0 +1,263 @@
+"""
+Share a frame source (a video, a YouTube video, the camera) between the
+groups playing it, so that it gets decoded once no matter how many walls
+show it: each group converts the shared frames for its own wall (its
+resolution, its palette).
+
+A SharedSource reads its frames in a thread of its own and hands each
+of them to every subscription. The subscriptions are iterators yielding
+(frame, pts, duration) like streamer.get_frames(), so that the sessions
+play them as any other source (see pipeline.DecodeStage). The source
+gets released once its last subscriber leaves.
+
+A paced source (a video) waits for every subscriber to have room for
+the next frame, the groups play it in sync. A live source (the camera)
+never waits, a subscriber which falls behind loses its oldest frames.
+A group starting again a video it's playing already gets a source of its
+own, so that the video restarts rather than going on.
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+
+
+# The frames queued for each subscriber, the decoding stage of its
+# session queues more.
+SUBSCRIPTION_QUEUE_SIZE = 2
+# The max time the threads wait at once, so that they notice when the
+# source stops.
+WAIT_INTERVAL = 0.1
+
+
+class Subscription:
+	"""The frames of a shared source for a group."""
+
+	def __init__(self, source, group):
+		self.source = source
+		self.group = group
+		self.queue = deque()
+		self.closed = False
+		# The frames dropped because the queue was full (live sources).
+		self.dropped = 0
+
+
+	def __iter__(self):
+		return self
+
+
+	def __next__(self):
+		"""Return the next frame, waiting for it. Raise StopIteration
+		once the source has no more frames."""
+
+		with self.source.cond:
+			while not self.queue:
+				if self.closed or self.source.finished:
+					raise StopIteration
+				self.source.cond.wait(WAIT_INTERVAL)
+
+			item = self.queue.popleft()
+			# There is room for the reader again.
+			self.source.cond.notify_all()
+			return item
+
+
+	def close(self):
+		"""Leave the source, releasing it if this was the last
+		subscription."""
+		self.source.unsubscribe(self)
+
+
+class SharedSource:
+	"""A frame source read once for all its subscribers.
+
+	frames is an iterator yielding (frame, pts, duration) tuples (see
+	streamer.get_frames()), timed by pacer, and release releases the
+	source (called by the reading thread once done with it). If
+	copy_frames is True each frame gets copied before being handed out,
+	for the sources reusing their buffers (see ffmpeg_source.py).
+	on_close is called once the source got released."""
+
+	def __init__(self, key, frame_src, frames, pacer, release, copy_frames=False, on_close=None):
+		self.key = key
+		self.frame_src = frame_src
+		self.frames = frames
+		self.pacer = pacer
+		# The subscribers cap their own rate (see FramePacer.fork()).
+		if pacer:
+			pacer.max_fps = 0
+		self.release = release
+		self.copy_frames = copy_frames
+		self.on_close = on_close
+
+		self.cond = threading.Condition()
+		self.subscriptions = []
+		self.thread = threading.Thread(target=self.run, name='shared-decode', daemon=True)
+		self.finished = False
+		self.stopped = False
+		self.frame_count = 0
+
+
+	@property
+	def paced(self):
+		return bool(self.pacer and self.pacer.paced)
+
+
+	@property
+	def groups(self):
+		return [subscription.group for subscription in self.subscriptions]
+
+
+	def subscribe(self, group, max_fps=0):
+		"""Subscribe a group to the frames to come. Return the
+		subscription and the pacer timing them for the group, (None,
+		None) if the source stopped already (its last subscriber left,
+		or it has no more frames)."""
+
+		subscription = Subscription(self, group)
+		with self.cond:
+			if self.stopped or self.finished:
+				return None, None
+			self.subscriptions.append(subscription)
+			if not self.thread.is_alive():
+				self.thread.start()
+
+		return subscription, (self.pacer.fork(max_fps) if self.pacer else None)
+
+
+	def unsubscribe(self, subscription):
+		with self.cond:
+			if subscription.closed:
+				return
+			subscription.closed = True
+			if subscription in self.subscriptions:
+				self.subscriptions.remove(subscription)
+			if not self.subscriptions:
+				self.stopped = True
+				if not self.thread.is_alive():
+					# Never started, or done already.
+					self.close()
+			self.cond.notify_all()
+
+
+	def has_room(self):
+		return all(len(subscription.queue) < SUBSCRIPTION_QUEUE_SIZE for subscription in self.subscriptions)
+
+
+	def put(self, item):
+		"""Hand a frame to every subscriber."""
+
+		with self.cond:
+			if self.paced:
+				while not (self.stopped or self.has_room()):
+					self.cond.wait(WAIT_INTERVAL)
+
+			for subscription in self.subscriptions:
+				if len(subscription.queue) >= SUBSCRIPTION_QUEUE_SIZE:
+					subscription.queue.popleft()
+					subscription.dropped += 1
+				subscription.queue.append(item)
+			self.cond.notify_all()
+
+
+	def run(self):
+		try:
+			for frame, pts, duration in self.frames:
+				if self.stopped:
+					break
+				if self.copy_frames and isinstance(frame, np.ndarray):
+					frame = frame.copy()
+				self.put((frame, pts, duration))
+				self.frame_count += 1
+
+		except Exception as e:
+			print(f'Failed to read a shared source: {e}')
+
+		finally:
+			with self.cond:
+				self.finished = True
+				self.cond.notify_all()
+			self.close()
+
+
+	def close(self):
+		"""Release the source, once."""
+
+		with self.cond:
+			if self.release is None:
+				return
+			release, self.release = self.release, None
+
+		release()
+		if self.on_close:
+			self.on_close(self)
+
+
+	def stats(self):
+		return {
+			'groups': self.groups,
+			'frames': self.frame_count,
+			'dropped': {subscription.group: subscription.dropped for subscription in self.subscriptions}
+		}
+
+
+class SourceMux:
+	"""The shared sources, by key (see streamer.get_share_key()). It can
+	be used from any thread."""
+
+	def __init__(self):
+		self.sources = {}
+		self.lock = threading.Lock()
+
+
+	def join(self, key, group, max_fps=0):
+		"""Subscribe a group to the source playing for a key (see
+		SharedSource.subscribe()). Return the source, the subscription
+		and the pacer, or None if there is no source to share, the
+		source to be opened anew then."""
+
+		source = self.find(key, group)
+		if source is None:
+			return None
+		# The source may stop in the meantime, subscribe() tells.
+		subscription, pacer = source.subscribe(group, max_fps)
+		if subscription is None:
+			return None
+		return source, subscription, pacer
+
+
+	def find(self, key, group):
+		"""Return the source playing for a key, to be shared with a
+		group, None if there is none (or if the group plays it already
+		and it's a video, which starts again then)."""
+
+		with self.lock:
+			source = self.sources.get(key)
+		if (source is None) or source.stopped or source.finished:
+			return None
+		if source.paced and (group in source.groups):
+			return None
+		return source
+
+
+	def add(self, key, frame_src, frames, pacer, release, copy_frames=False):
+		"""Share a source newly opened. Return it."""
+
+		source = SharedSource(key, frame_src, frames, pacer, release, copy_frames, on_close=self.remove)
+		with self.lock:
+			self.sources[key] = source
+		return source
+
+
+	def remove(self, source):
+		with self.lock:
+			if self.sources.get(source.key) is source:
+				del self.sources[source.key]
+
+
+	def stats(self):
+		with self.lock:
+			sources = list(self.sources.values())
+		return {' '.join(map(str, source.key)): source.stats() for source in sources}
\ No newline at end of file
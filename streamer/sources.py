@@ -0,0 +1,173 @@
+"""
+The frame source backends which depend on heavy or optional modules (the
+AI image generator, YouTube videos, the camera), loaded as plugins the
+first time a stream needs them rather than when the streamer starts, so
+that it starts listening as soon as possible.
+
+openai used to be imported upfront on the main thread, as importing it
+(or letting its submodules load lazily) from a task caused issues. The
+backends get loaded from the commands' threads instead, never from the
+event loop, one at a time under a lock, and a backend gets fully loaded
+(submodules included) before it's used. --preload loads backends on the
+main thread at startup, as before.
+"""
+
+import os
+import sys
+import threading
+import importlib
+import subprocess as sp
+from importlib.util import find_spec
+from types import SimpleNamespace
+
+
+
+# Held while a backend gets loaded, so that no two threads import
+# modules for the backends at the same time.
+load_lock = threading.Lock()
+
+
+class BackendUnavailable(Exception):
+	"""Raised when a backend can't be loaded as a module it needs is
+	missing or not configured."""
+
+
+class SourceBackend:
+	"""A frame source backend, loaded the first time it's needed.
+
+	load is a callable importing the backend's modules and returning its
+	API (a namespace), it runs once, unless it fails."""
+
+	def __init__(self, name, load):
+		self.name = name
+		self.load_api = load
+		# Set once loaded.
+		self.api = None
+
+
+	@property
+	def loaded(self):
+		return self.api is not None
+
+
+	def load(self):
+		"""Return the backend's API, loading it the first time. Raise
+		BackendUnavailable if it can't be loaded.
+
+		This may block (importing, installing), it must not be called
+		from the event loop."""
+
+		if self.api is None:
+			with load_lock:
+				if self.api is None:
+					self.api = self.load_api()
+		return self.api
+
+
+def load_ai():
+	if not find_spec('openai'):
+		raise BackendUnavailable('In order to generate an image with the AI you need the module "openai" and it was not found, the module needs to be installed manually.')
+
+	api_key = os.environ.get('OPENAI_API_KEY')
+	if not api_key:
+		raise BackendUnavailable('In order to generate an image using the "openai" module you need to set the "OPENAI_API_KEY" environment variable.')
+
+	from io import BytesIO
+	from base64 import b64decode
+
+	import numpy as np
+	from PIL import Image
+	from openai import OpenAI, APIError, BadRequestError
+
+	client = OpenAI(api_key=api_key)
+	# Force the submodule load now rather than while generating an
+	# image.
+	_ = client.images
+
+	def gen_img(prompt):
+		"""Request the AI to generate an image based on a prompt and
+		return it."""
+
+		# By default the response will contain a URL rather than the
+		# image bytes.
+		imgs_resp = client.images.generate(
+			n=1,
+			# We use the standard square resolution UE1 uses for the
+			# textures.
+			size="256x256",
+			prompt=prompt,
+			response_format='b64_json'
+		)
+		img_data = b64decode(imgs_resp.data[0].b64_json)
+
+		return np.array(Image.open(BytesIO(img_data)))
+
+	return SimpleNamespace(gen_img=gen_img, APIError=APIError, BadRequestError=BadRequestError)
+
+
+def load_youtube():
+	if not (find_spec('vidgear') and find_spec('yt_dlp')):
+		# Install the needed libraries.
+		print('In order to stream a video from YouTube you need both the modules "vidgear" and "yt_dlp" and they were not found. Installing them...')
+		sp.check_call([
+			sys.executable,
+			'-m',
+			'pip',
+			'install',
+			'vidgear',
+			'yt_dlp'
+		])
+		# Let the import system find the new modules.
+		importlib.invalidate_caches()
+
+	import yt_dlp
+	from vidgear.gears import CamGear
+
+	def get_stream(url, min_height=0):
+		"""Return the direct URL of the smallest video stream of a page
+		which is at least min_height tall (or the largest one), with its
+		frame rate, its resolution (if known) and the HTTP headers to
+		request it with."""
+
+		options = {
+			'quiet': True,
+			'format': f'worstvideo[height>={min_height}]/bestvideo/best'
+		}
+		with yt_dlp.YoutubeDL(options) as ydl:
+			info = ydl.extract_info(url, download=False)
+
+		return (
+			info['url'],
+			info.get('fps') or 0,
+			(info['height'], info['width']) if (info.get('height') and info.get('width')) else None,
+			info.get('http_headers')
+		)
+
+	return SimpleNamespace(CamGear=CamGear, get_stream=get_stream)
+
+
+def load_camera():
+	import cv2
+
+	def open_camera(index=0):
+		"""Return the feed of a camera."""
+		return cv2.VideoCapture(index, cv2.CAP_DSHOW)
+
+	return SimpleNamespace(open_camera=open_camera)
+
+
+# Backend name -> backend.
+BACKENDS = {
+	'ai': SourceBackend('ai', load_ai),
+	'youtube': SourceBackend('youtube', load_youtube),
+	'camera': SourceBackend('camera', load_camera)
+}
+
+
+def preload(names):
+	"""Load some backends now, e.g. on the main thread at startup."""
+	for name in names:
+		try:
+			BACKENDS[name].load()
+		except BackendUnavailable as e:
+			print(e)
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""
+Save the state of the streamer to a file and load it back (streamer.py
+--state_file), so that a streamer restarted in the middle of a map (it
+crashed, it got updated) goes on with its walls, its displays and its
+streams at once, rather than waiting for the server to send the walls
+again at the next map:
+
+	{
+		"version": 1,
+		"registry": {
+			"walls": [the walls, as sent by the server],
+			"displays": [{"addr": [host, port], "group": ..., "position": [row, col]}]
+		},
+		"streams": {group: [the arguments of its stream command]}
+	}
+
+The streams get started again from their command, a video plays from its
+beginning.
+"""
+
+import os
+import json
+import threading
+
+
+
+VERSION = 1
+# The max interval between two saves of a changing state, in seconds.
+SAVE_INTERVAL = 1
+
+
+class StateFile:
+	"""The file the state gets saved to. It can be used from any
+	thread."""
+
+	def __init__(self, path):
+		self.path = path
+		# The content of the file, to write it only when the state
+		# changed.
+		self.saved = None
+		self.lock = threading.Lock()
+
+
+	def load(self):
+		"""Return the state saved, None if there is none (or if it can't
+		be read)."""
+
+		try:
+			with open(self.path, 'rb') as f:
+				data = f.read()
+			state = json.loads(data)
+			if state.get('version') != VERSION:
+				raise ValueError('Unsupported state version')
+		except FileNotFoundError:
+			return None
+		except (OSError, ValueError, AttributeError) as e:
+			print(f'Ignoring the state file "{self.path}": {e}')
+			return None
+
+		with self.lock:
+			self.saved = data
+		return state
+
+
+	def save(self, state):
+		"""Save a state, unless it didn't change since the last save.
+		Return True if it got written."""
+
+		data = json.dumps({'version': VERSION, **state}, indent='\t').encode()
+		with self.lock:
+			if data == self.saved:
+				return False
+
+			# Write to a temporary file first so that a streamer stopping
+			# meanwhile never leaves a partial file.
+			tmp_path = f'{self.path}.{os.getpid()}.tmp'
+			try:
+				with open(tmp_path, 'wb') as f:
+					f.write(data)
+				os.replace(tmp_path, self.path)
+				self.saved = data
+			except OSError as e:
+				print(f'Could not save the state to "{self.path}": {e}')
+				return False
+			finally:
+				if os.path.exists(tmp_path):
+					os.remove(tmp_path)
+
+		return True
\ No newline at end of file
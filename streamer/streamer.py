@@ -1,73 +1,160 @@
-#import time
-from importlib.util import find_spec
-import os
 import sys
-import subprocess as sp
 import threading
-import socket
+import itertools
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import json
 import shlex
-from io import BytesIO
-from base64 import b64decode
 
 import numpy as np
 import cv2
 
-from PIL import Image
-# Set these optional classes with dummy values so that we can quickly check if they
-# were imported.
-CamGear = None
-OpenAI = None
-# We check BadRequestError in a task so we need a dummy version of it in case openai
-# is not installed.
-class BadRequestError(Exception): pass
-# openai needs to be imported here as there is an issue when importing it in a task.
-if find_spec('openai'):
-	from openai import OpenAI as OpenAIClass
-	from openai import BadRequestError as BadRequestErrorClass
-	OpenAI, BadRequestError = OpenAIClass, BadRequestErrorClass
-
-from video_wall import VideoWall
-from cmd_parsers import main_parser, cmd_stream_parser
-
-
-
-def gen_img(prompt):
-	"""Request the AI to generate an image based on a prompt and return it."""
-	
-	global ai_client
-	
-	if ai_client:
-		# By default the response will contain a URL rather than the image bytes.
-
-		imgs_resp = ai_client.images.generate(
-			n=1,
-			# We use the standard square resolution UE1 uses for the textures.
-			size="256x256",
-			prompt=prompt,
-			response_format='b64_json'
-		)
-		img_data = b64decode(imgs_resp.data[0].b64_json)
-		img = np.array(Image.open(BytesIO(img_data)))
-		
-		return img
+from registry import DisplayRegistry
+from font_palette import get_font_palette
+from pacing import FramePacer, get_gif_frame_durations
+from sessions import StreamSession, SessionManager, release_frame_src
+from source_mux import SourceMux
+from image_cache import CachedTiles, ImageCache
+from tile_pool import TileEncoderPool, shutdown_executors
+from ffmpeg_source import FFmpegSource, find_ffmpeg, probe_video
+from glyph_cache import DEFAULT_CACHE_DIR, GlyphStream, get_cache_path, open_stream, transcode_in_background, cancel_transcoding
+from metrics import metrics, format_snapshot, serve_metrics
+# The AI, YouTube and camera sources get loaded when first needed.
+from sources import BACKENDS, BackendUnavailable, preload
+from fanout import FanoutSender
+from capture import CaptureWriter, CaptureReader, CaptureSender, CONTROL, COMMAND
+from state import StateFile, SAVE_INTERVAL
+from cmd_parsers import main_parser, cmd_stream_parser, cmd_stop_parser, cmd_stats_parser, cmd_budget_parser
+
+
+
+# The time the frames get to go out after the last control message
+# replayed (see replay_task()).
+REPLAY_TAIL = 2
+
+
+def open_ffmpeg_source(args, get_video):
+	"""Return a source decoding a video with ffmpeg at the resolution of
+	the stream's wall, or None if ffmpeg or the wall is not available,
+	in which case the video is to be decoded by OpenCV.
+	
+	get_video is a callable taking the resolution of the wall and
+	returning the path (or URL) of the video, its frame rate, its
+	resolution (or None) and the HTTP headers to request it with (or
+	None)."""
+	
+	ffmpeg_path = find_ffmpeg(main_args.ffmpeg_path)
+	if not ffmpeg_path:
+		print('ffmpeg was not found, decoding the video with OpenCV.')
+		return None
+	
+	wall = registry.get_wall(args.group)
+	if wall is None:
+		print(f'The group "{args.group}" doesn\'t exist yet, decoding the video with OpenCV.')
+		return None
+	
+	path, fps, src_res, headers = get_video(wall.full_res)
+	return FFmpegSource(
+		path,
+		wall.full_res,
+		ffmpeg_path,
+		fps=fps,
+		# The frames queued for the conversion, the one being
+		# converted and the one being read.
+		buffer_count=max(args.decode_queue, 1) + 2,
+		src_res=src_res,
+		headers=headers
+	)
+
+
+def get_metrics_snapshot():
+	"""Return the metrics along with the live figures of the video walls
+	and the sessions. Must be called from the event loop's thread."""
+	snapshot = metrics.get_snapshot(registry.walls, session_manager.sessions)
+	snapshot['shared_sources'] = source_mux.stats()
+	snapshot['image_cache'] = image_cache.stats()
+	return snapshot
+	
+	
+def get_share_key(args):
+	"""Return the key of the source of a stream among the shared
+	sources (see source_mux.py), or None if the source is not to be
+	shared: still images and the cached videos (converted for a given
+	wall already) are not."""
+	
+	if args.use_camera:
+		return ('camera', 0)
+	if (not args.vid_path) or (args.cache and not args.vid_path.startswith('http')):
+		return None
+	if args.decoder == 'ffmpeg':
+		# ffmpeg decodes at the resolution of the wall, the walls of
+		# another resolution can't share the frames.
+		wall = registry.get_wall(args.group)
+		return (args.vid_path, args.decoder, wall.full_res if wall else None)
+	return (args.vid_path, args.decoder)
 	
 	
 def handle_cmd(cmd, args=[]):
 	"""Process a command.
 	
-	Some commands start async tasks, the command 'stop' tells them to stop asap."""
+	The command 'stream' starts a stream session on a group, the command
+	'stop' stops the session of a group (or of all the groups), the
+	command 'stats' prints the metrics (see metrics.py), the command
+	'budget' sets the bandwidth budget of the displays of a group (see
+	bandwidth.py) and the command 'quit' tells all the tasks to stop
+	asap."""
 	
-	global CamGear
-	global ai_client
-	global BadRequestError
 	global stop
+	global session_manager
+	global registry
+	global main_args
+	global stream_cmds
 
 	
-	if cmd == 'stop':
+	if cmd == 'quit':
 		# Flag the tasks to stop asap.
 		print('Stopping...')
-		stop = True
+		request_stop()
+		
+	elif cmd == 'stop':
+		try:
+			args = cmd_stop_parser.parse_args(args)
+			count = session_manager.stop(args.group)
+			# Not to be played again on a restart.
+			if args.group is None:
+				stream_cmds.clear()
+			else:
+				stream_cmds.pop(args.group, None)
+			print(f'Stopped {count} stream(s).')
+		
+		except SystemExit:
+			# argparser attempted to exit the program cause the help was
+			# printed.
+			pass
+		
+	elif cmd == 'budget':
+		try:
+			args = cmd_budget_parser.parse_args(args)
+			count = session_manager.call_in_loop(registry.set_display_budget, args.kib_per_sec * 1024, args.group)
+			print(f'Set the budget of {count} group(s).')
+		
+		except SystemExit:
+			pass
+		
+	elif cmd == 'stats':
+		try:
+			args = cmd_stats_parser.parse_args(args)
+			snapshot = session_manager.call_in_loop(get_metrics_snapshot)
+			if args.group is not None:
+				snapshot['groups'] = {
+					name: group
+					for name, group in snapshot['groups'].items()
+					if name == args.group
+				}
+			print(json.dumps(snapshot, indent='\t') if args.json else format_snapshot(snapshot))
+		
+		except SystemExit:
+			pass
 		
 	else:
 		if cmd.startswith('stream'):
@@ -76,92 +163,233 @@ def handle_cmd(cmd, args=[]):
 			# arguments.
 			
 			try:
+				cmd_args = args
 				args = cmd_stream_parser.parse_args(args)
 				
+				# Load the font texture's palette, or reuse it if a
+				# previous stream loaded it already.
+				font_pal = get_font_palette(
+					args.font_tex_path,
+					args.glyph_count,
+					args.use_alpha,
+					args.lut_bits
+				)
+				
 				# Obtain the frames source.
 
 				frame_src = None
+				# Used to send the frames of a sequence on time.
+				# Still images don't need it.
+				pacer = None
+				# The source may be playing on another group already,
+				# its frames are shared then rather than decoded again.
+				share_key = None if args.no_share else get_share_key(args)
+				# Subscribed right away, so that the source can't be
+				# released in the meantime. Each group gets the frames
+				# with a pacer of its own, for its own max fps.
+				joined = source_mux.join(share_key, args.group, args.fps) if share_key else None
+				shared = None
+				subscription = None
+
+				if joined is not None:
+					shared, frames, pacer = joined
+					subscription = frames
+					frame_src = shared.frame_src
+					print('Sharing the source of the groups ' + ', '.join(f'"{group}"' for group in shared.groups if group != args.group) + '.')
 
-				if args.img_path:
-					# Get a still image.
-					frame_src = cv2.imread(args.img_path)
+				elif args.img_path:
+					# Get a still image, converted for the wall already
+					# if it was shown on a wall of the same layout lately
+					# (see image_cache.py).
+					wall = registry.get_wall(args.group)
+					if wall is None:
+						frame_src = cv2.imread(args.img_path)
+					else:
+						frame_src = image_cache.get_file_tiles(args.img_path, wall, font_pal)
 
 				
 				elif args.vid_path:
 					# Get a video.
 					if not args.vid_path.startswith('http'):
-						# A local path was received so load the video from it.
-						frame_src = cv2.VideoCapture(args.vid_path)
-						#fps = vid.get(cv2.CAP_PROP_FPS)
+						# A local path was received.
+						cache_path = None
+						if args.cache:
+							# Play the video from the glyph cache if it was
+							# converted for this wall already.
+							wall = registry.get_wall(args.group)
+							if wall is None:
+								print(f'The group "{args.group}" doesn\'t exist yet, the video won\'t be cached.')
+							else:
+								cache_path = get_cache_path(
+									main_args.cache_dir or DEFAULT_CACHE_DIR,
+									args.vid_path,
+									wall.matrix.shape,
+									wall.display_res,
+									font_pal
+								)
+								frame_src = open_stream(cache_path)
+								
+						if frame_src is not None:
+							pacer = FramePacer(durations=frame_src.durations, max_fps=args.fps)
+						else:
+							# Load the video from the path.
+							if args.decoder == 'ffmpeg':
+								frame_src = open_ffmpeg_source(
+									args,
+									lambda full_res: (args.vid_path, *probe_video(args.vid_path), None)
+								)
+							if frame_src is None:
+								frame_src = cv2.VideoCapture(args.vid_path)
+							# GIF frames may each have their own duration.
+							pacer = FramePacer(
+								fps=frame_src.get(cv2.CAP_PROP_FPS),
+								durations=get_gif_frame_durations(args.vid_path),
+								max_fps=args.fps
+							)
+							
+							if cache_path:
+								# Convert the whole video for the next plays.
+								print('Caching the video in background...')
+								transcode_in_background(
+									args.vid_path,
+									wall.matrix.shape,
+									wall.display_res,
+									font_pal,
+									cache_path,
+									main_args.cache_size
+								)
 					else:
 						# A URL was received so load the video from it.
 						# (Assuming it's a YouTube URL).
-						# Install the needed library if not installed yet.
-						if not (find_spec('vidgear') and find_spec('yt_dlp')):
-							print('In order to stream a video from YouTube you need both the modules "vidgear" and "yt_dlp" and they were not found. Installing them...')
-							sp.check_call([
-								sys.executable,
-								'-m',
-								'pip',
-								'install',
-								'vidgear',
-								'yt_dlp'
-							])
-							
-						if not CamGear:
-							vidgear = __import__('vidgear.gears', fromlist=[''])
-							CamGear = getattr(vidgear, 'CamGear')
-							
-						frame_src = CamGear(
-							source=args.vid_path,
-							stream_mode=True,
-							logging=True
-						).start()
+						# The needed libraries get installed if not
+						# installed yet.
+						youtube = BACKENDS['youtube'].load()
+						if args.decoder == 'ffmpeg':
+							# Pick the smallest stream which fits the
+							# wall.
+							frame_src = open_ffmpeg_source(
+								args,
+								lambda full_res: youtube.get_stream(args.vid_path, full_res[0])
+							)
+							if frame_src is not None:
+								pacer = FramePacer(fps=frame_src.fps, max_fps=args.fps)
+						
+						if frame_src is None:
+							frame_src = youtube.CamGear(
+								source=args.vid_path,
+								stream_mode=True,
+								logging=True
+							).start()
+							pacer = FramePacer(fps=frame_src.framerate, max_fps=args.fps)
 						
 						
 				elif args.ai_prompt:
 					# Get an AI generated still image.
-					if not find_spec('openai'):
-						print('In order to generate an image with the AI you need the module "openai" and it was not found.')
-						print('the module needs to be installed manually.')
-					else:							
-						if ai_client:
-							print('Generating image...')
-							frame_src = gen_img(args.ai_prompt)
+					ai = BACKENDS['ai'].load()
+					
+					def gen_img(prompt):
+						# Only called when the prompt isn't cached.
+						print('Generating image...')
+						return ai.gen_img(prompt)
+					
+					try:
+						wall = registry.get_wall(args.group)
+						if wall is None:
+							frame_src = image_cache.get_generated_image(args.ai_prompt, gen_img)
 						else:
-							print('In order to generate an image using the "openai" module you need to set the "OPENAI_API_KEY" environment variable.')
+							frame_src = image_cache.get_prompt_tiles(args.ai_prompt, gen_img, wall, font_pal)
+					except ai.BadRequestError as e:
+						# OpenAI error.
+						#traceback.print_exc()
+						print(e.body['message'])
+					except ai.APIError as e:
+						# The request didn't get through.
+						print(e.message)
 					
 					
 				elif args.use_camera:
 					# Get the camera feed.
-					frame_src = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+					frame_src = BACKENDS['camera'].load().open_camera(0)
+					# The feed is live, its frames are due as soon as they
+					# are captured.
+					pacer = FramePacer(max_fps=args.fps)
 							
 
 				# frame_src may be a numpy array and they can't be converted to bool
 				# directly.
 				if frame_src is not None:
 					# Stream the frames.
-					print('Streaming in background...')
-					# Start streaming the frames.
-					sender_thread = threading.Thread(
-						target=sender_task,
-						args=(
+					try:
+						if font_pal.lut_bits and not isinstance(frame_src, (GlyphStream, CachedTiles)):
+							# Load the LUT, or start building it in
+							# background, the frames get matched against
+							# the palette directly until it's ready.
+							font_pal.prepare_lut()
+						
+						release = None
+						if shared is None:
+							frames = get_frames(frame_src, pacer)
+							if share_key:
+								shared = source_mux.add(
+									share_key,
+									frame_src,
+									frames,
+									pacer,
+									lambda: release_frame_src(frame_src),
+									# ffmpeg reuses its frame buffers.
+									copy_frames=isinstance(frame_src, FFmpegSource)
+								)
+								frames, pacer = shared.subscribe(args.group, args.fps)
+								subscription = frames
+						if subscription is not None:
+							release = subscription.close
+						
+						print('Streaming in background...')
+						# Start streaming the frames, replacing the stream
+						# playing on the group if any.
+						session = StreamSession(
 							args.group,
 							frame_src,
-							args.glyph_count,
-							args.use_alpha,
-							args.font_tex_path,
+							frames,
+							font_pal,
+							pacer=pacer,
 							# Clear the screen if we are streaming a video.
-							args.vid_path
+							clear=bool(args.vid_path),
+							keyframe_interval=args.keyframe_interval if args.delta else None,
+							refresh_interval=args.refresh_interval,
+							# Convert large walls with several processes.
+							encoder_pool=TileEncoderPool(font_pal, args.workers) if (args.workers and not isinstance(frame_src, (GlyphStream, CachedTiles))) else None,
+							decode_queue_size=args.decode_queue,
+							convert_queue_size=args.convert_queue,
+							rle=args.rle,
+							release=release
 						)
-					)
-					sender_thread.start()
+						session_manager.start(session)
+					
+					except BaseException:
+						# The session never started, let go of its
+						# source. A paced shared source would wait for
+						# the subscription forever, holding up the other
+						# groups.
+						if subscription is not None:
+							subscription.close()
+						elif shared is not None:
+							shared.close()
+						else:
+							release_frame_src(frame_src)
+						raise
+					
+					# Kept to play it again on a restart (see
+					# state.py).
+					stream_cmds[args.group] = (cmd_args, session, registry.get_wall(args.group))
 			
 			
-			except BadRequestError as e:
-				# OpenAI error.
-				#traceback.print_exc()
-				print(e.body['message'])
+			except BackendUnavailable as e:
+				print(e)
+			
+			except (OSError, ValueError, TypeError) as e:
+				# A missing file, a font texture which isn't indexed...
+				print(f'Could not stream: {e}')
 		
 			except SystemExit:
 				# argparser attempted to exit the program cause the help was
@@ -169,51 +397,84 @@ def handle_cmd(cmd, args=[]):
 				pass
 				
 
-def get_frames(src):
-	"""A generator that yields the next frame if any."""
+def get_frames(src, pacer=None):
+	"""A generator that yields the next frame if any, along with its
+	presentation time and duration (see FramePacer.timeline()).
 	
-	global CamGear
+	If a pacer is given, the frames it flags to be skipped are not
+	decoded (when the source allows it) nor yielded."""
 	
-	success = True
+	timeline = pacer.timeline() if pacer else itertools.repeat((None, None))
 
 	if isinstance(src, np.ndarray):
 		# The source is a single image, yield it and stop.
-		yield src
+		yield src, None, None
+		
+	elif isinstance(src, CachedTiles):
+		# A single image, already converted.
+		yield (src.tiles, src.digests), None, None
 		
-	elif isinstance(src, cv2.VideoCapture):
+	elif isinstance(src, (cv2.VideoCapture, FFmpegSource)):
 		# Yield either video frames or the webcam feed frames.
-		while success:
+		for pts, duration in timeline:
+			if pacer and pacer.should_skip(pts, duration):
+				# Move past the frame without decoding it.
+				if not src.grab():
+					break
+				continue
+			
 			success, frame = src.read()
-			if success:
-				yield frame
+			if not success:
+				break
+			yield frame, pts, duration
+			
+	elif isinstance(src, GlyphStream):
+		# Yield the frames of a cached video, already converted.
+		for frame_idx, (pts, duration) in zip(range(len(src)), timeline):
+			if pacer and pacer.should_skip(pts, duration):
+				continue
+			
+			yield src.get_frame(frame_idx), pts, duration
 				
-	elif CamGear and isinstance(src, CamGear):
+	elif BACKENDS['youtube'].loaded and isinstance(src, BACKENDS['youtube'].api.CamGear):
 		# Yield a YouTube video frames.
-		while success:
+		for pts, duration in timeline:
 			frame = src.read()
-			success = frame is not None
-			if success:
-				yield frame
+			if frame is None:
+				break
+			if pacer and pacer.should_skip(pts, duration):
+				# Frames get decoded in the background, just drop it.
+				continue
+			
+			yield frame, pts, duration
 				
 				
-def listen_task(host, port):
-	"""Listen for data and commands coming from remote display managers."""
+class ListenProtocol(asyncio.DatagramProtocol):
+	"""Receive data and commands coming from remote display managers.
 	
-	global stop
-	global video_walls
-	global main_args
-
+	Data is handled right away in the event loop, commands are handled
+	by a worker thread as they may take a while (e.g. installing a module
+	or generating an image)."""
 	
-	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-	sock.bind((host, port))
-	# Check for new data each second.
-	sock.settimeout(1)
+	def __init__(self, cmd_executor):
+		self.cmd_executor = cmd_executor
+		self.transport = None
+		# Sends the frames to the displays, set once listening.
+		self.sender = None
+		
 	
-	print(f'Listening for clients on {host}:{port}\n')
+	def connection_made(self, transport):
+		self.transport = transport
+		
 	
-	while not stop:
+	def datagram_received(self, data, addr):
+		global registry
+		global main_args
+		
+		if capture:
+			capture.write_control(addr, data)
+		
 		try:
-			data, addr = sock.recvfrom(1024)
 			data = json.loads(data)
 			
 			if main_args.verbose:
@@ -222,24 +483,18 @@ def listen_task(host, port):
 			if data['role'] == 'SERVER':
 				# Data or command coming from the server.
 				if data['type'] == 'INIT':
-					# Initialize the video walls list.
-					
-					# Delete old walls.
-					video_walls = []
-					
-					# Create the video wall instances.
-					for wall_data in data['walls']:
-						wall = VideoWall(
-							tuple(wall_data['shape']),
-							tuple(wall_data['display_res']),
-							name = wall_data['group']
-						)
-						video_walls.append(wall)
+					# Replace the old walls with the received ones.
+					registry.set_walls(data['walls'])
 						
 				elif data['type'] == 'CMD':
 					# We received a command with arguments, forward it as if it
 					# was received from stdin.
-					handle_cmd(data['cmd'], shlex.split(data['args']))
+					asyncio.get_running_loop().run_in_executor(
+						self.cmd_executor,
+						handle_cmd,
+						data['cmd'],
+						shlex.split(data['args'])
+					)
 					
 					
 			elif data['role'] == 'CLIENT':
@@ -247,78 +502,220 @@ def listen_task(host, port):
 				if data['type'] == 'INIT':
 					# Initialize a display and add it to video wall's matrix based
 					# on the received group name.
-					for wall in video_walls:
-						if wall.name == data['group']:
-							wall.add_display(sock, addr, tuple(data['position']), send_last_frame=True)
-							break
+					registry.add_display(
+						self.sender or self.transport,
+						addr,
+						data['group'],
+						tuple(data['position'])
+					)
 							
 				elif data['type'] == 'HEARTBEAT':
 					# Update the heartbeat timestamp to keep the remote display alive.
-					for wall in video_walls:
-						for disp_list in wall.matrix.flatten():
-							for disp in disp_list:
-								if disp.addr == addr:
-									disp.heartbeat()
-				
-			
-		except TimeoutError:
-			# Keep listening.
-			pass
-			
-		except ConnectionResetError as e:
-			# This error is created by Windows when calling sendto() but stored
-			# until recvfrom() gets called.
-			pass
+					registry.heartbeat(addr)
+		
+		except (ValueError, KeyError, TypeError) as e:
+			# Malformed data, ignore it.
+			if main_args.verbose:
+				print(f'From: {addr}\tInvalid data: {e}')
 			
+	
+	def error_received(self, exc):
+		# Windows reports a ConnectionResetError when a previous
+		# sendto() reached a closed port, keep listening.
+		pass
+		
+
+async def listen_task(host, port):
+	"""Listen for data and commands coming from remote display managers and
+	play the streams, until the tasks get told to stop."""
+	
+	global stop_event
+	global session_manager
+	global registry
+	
+	loop = asyncio.get_running_loop()
+	stop_event = asyncio.Event()
+	if stop:
+		# Told to stop before the loop started.
+		stop_event.set()
+	
+	cmd_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='commands')
+	transport, protocol = await loop.create_datagram_endpoint(
+		lambda: ListenProtocol(cmd_executor),
+		local_addr=(host, port)
+	)
+	replay = None
+	if main_args.replay:
+		# The frames of a replay get captured, not sent.
+		protocol.sender = CaptureSender(capture, describe_display)
+		replay = loop.create_task(replay_task(main_args.replay, protocol, cmd_executor))
+	else:
+		# Send the frames without waiting on the slow displays.
+		protocol.sender = FanoutSender.from_transport(transport, loop)
+		if capture:
+			protocol.sender = CaptureSender(capture, describe_display, protocol.sender)
+	
+	# Play the streams in the same event loop.
+	session_manager.run()
+	# Remove the dead displays periodically.
+	registry.start_expiry(loop)
+	
+	state_saver = None
+	if state_file:
+		# Resume what a previous run was playing.
+		state = state_file.load()
+		if state:
+			restore_state(state, protocol, cmd_executor)
+		state_saver = loop.create_task(state_task())
+	
+	metrics_server = None
+	if main_args.metrics_port:
+		metrics_server = await serve_metrics(get_metrics_snapshot, main_args.metrics_host, main_args.metrics_port)
+		print(f'Serving the metrics on http://{main_args.metrics_host}:{main_args.metrics_port}/metrics')
+	
+	print(f'Listening for clients on {host}:{port}\n')
+	
+	await stop_event.wait()
+	
 	# Stop command received, end the task.
-			
+	if replay:
+		# The capture may end with a quit command.
+		replay.cancel()
+	if state_saver:
+		state_saver.cancel()
+		# Saved before the streams stop, so that they play again on the
+		# next start.
+		state_file.save(get_state())
+	await session_manager.shutdown()
+	await asyncio.to_thread(cancel_transcoding)
+	# The worker processes converting the frames of large walls.
+	await asyncio.to_thread(shutdown_executors)
+	registry.stop_expiry()
+	if metrics_server:
+		metrics_server.close()
+		await metrics_server.wait_closed()
+	protocol.sender.close()
+	transport.close()
+	cmd_executor.shutdown(wait=False, cancel_futures=True)
+	if capture:
+		capture.close()
+		print(f'Captured {capture.record_count} records to "{capture.path}".')
 
-def sender_task(group, frame_src, glyph_count, use_alpha, font_tex_path, clear=False):
-	"""A task to broadcast either a single frame or a sequence of frames."""
+
+def get_state():
+	"""Return the state of the streamer (see state.py): the walls, the
+	displays and the command of the stream each group plays, or of the
+	still image it shows. Must be called from the event loop's
+	thread."""
 	
-	global stop
-	global video_walls
-	
-	font_tex = Image.open(font_tex_path)
-	# Extract the palette from the font texture.
-	raw_font_pal = font_tex.getpalette()
-	# Shape it as an array of RGB pixels.
-	font_pal_rgb = np.array(raw_font_pal).reshape(-1, 3)
-	# Convert each pixel from RGB to BGR as cv2 uses BGR by default.
-	font_pal_bgr = font_pal_rgb[:, ::-1]
-	# Leave only the pixels that are present in the font texture.
-	font_pal_bgr = font_pal_bgr[(not use_alpha):glyph_count]
-	
-	
-	for frame in get_frames(frame_src):
-		if stop:
-			# Stop command received, stop this task.
-			break
+	streams = {}
+	for group, (cmd_args, session, wall) in list(stream_cmds.items()):
+		if session_manager.sessions.get(group) is session:
+			streams[group] = cmd_args
+		elif isinstance(session.frame_src, (np.ndarray, CachedTiles)) and (wall is not None) and (registry.get_wall(group) is wall):
+			# The image is still shown, on the same wall.
+			streams[group] = cmd_args
+	
+	return {
+		'registry': registry.snapshot(),
+		'streams': streams
+	}
+	
+	
+async def state_task():
+	"""Save the state to the state file as it changes, until
+	cancelled."""
+	
+	while True:
+		await asyncio.sleep(SAVE_INTERVAL)
+		await asyncio.to_thread(state_file.save, get_state())
 		
-		for wall in video_walls:
-			if wall.name == group:
-				# Reshape the image to fit the wall full resolution.
-				# We use cv2 to resize cause numpy would require additional steps.
-				frame = cv2.resize(
-					frame,
-					(wall.full_res[1], wall.full_res[0]),
-					interpolation=cv2.INTER_LINEAR
-				)
-				wall.set_frame(frame, font_pal_bgr, use_alpha=use_alpha)
-				wall.broadcast_last_frame()
-				
-				break
 		
-		# It may be useful to sync with the fps.
-		#time.sleep(fps / 1000)
-
-	if clear:
-		# Clear the screen by sending a blank frame.
-		frame = np.zeros(frame.shape)
-		wall.set_frame(frame, font_pal_bgr, use_alpha=use_alpha)
-		wall.broadcast_last_frame()
+def restore_state(state, protocol, cmd_executor):
+	"""Restore the walls and the displays of a saved state and start its
+	streams again, from the event loop's thread."""
+	
+	try:
+		wall_count, display_count = registry.restore(protocol.sender, state['registry'])
+		streams = state['streams']
+	except (KeyError, TypeError, ValueError) as e:
+		print(f'Could not restore the state from "{state_file.path}": {e}')
+		return
+	
+	print(f'Restored {wall_count} wall(s), {display_count} display(s) and {len(streams)} stream(s) from "{state_file.path}".')
+	loop = asyncio.get_running_loop()
+	for group, cmd_args in streams.items():
+		loop.run_in_executor(cmd_executor, handle_cmd, 'stream', cmd_args)
+
+
+def describe_display(addr):
+	"""Return the group, the position and the resolution of a display,
+	or None if it's not registered, for the captures (see
+	capture.py)."""
+	
+	entry = registry.displays.get(addr)
+	if entry is None:
+		return None
+	wall, position, _ = entry
+	return wall.name, position, wall.display_res
+	
+	
+async def replay_task(path, protocol, cmd_executor):
+	"""Re-drive the control messages of a capture (see capture.py) as
+	they were received, at the same pace, then stop."""
+	
+	loop = asyncio.get_running_loop()
+	try:
+		records = await asyncio.to_thread(lambda: list(CaptureReader(path).records(kinds=(CONTROL, COMMAND))))
+	except (OSError, ValueError) as e:
+		print(f'Could not replay "{path}": {e}')
+		request_stop()
+		return
+	
+	print(f'Replaying {len(records)} control messages from "{path}"...')
+	start_ts = loop.time()
+	for record in records:
+		delay = start_ts + record.ts - loop.time()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		
+		if record.kind == CONTROL:
+			protocol.datagram_received(record.data, record.addr)
+		else:
+			# Handled as the commands received remotely.
+			loop.run_in_executor(cmd_executor, run_cmd_line, record.data.decode())
+	
+	# Let the last frames go out.
+	await asyncio.sleep(REPLAY_TAIL)
+	print('Replay done.')
+	request_stop()
+
+
+def request_stop():
+	"""Tell all the tasks to stop asap. Can be called from any thread."""
+	
+	global stop
+	global stop_event
+	global loop
+	
+	stop = True
+	if stop_event:
+		loop.call_soon_threadsafe(stop_event.set)
 			
 
+def run_cmd_line(line):
+	"""Parse a command line typed on stdin, as command and arguments,
+	and process it."""
+	
+	if capture:
+		capture.write_command(line)
+	
+	split_inp = line.split(' ', 1)
+	cmd = split_inp[0]
+	args = shlex.split(split_inp[1]) if (len(split_inp) > 1) else []
+	handle_cmd(cmd, args)
+	
+	
 def control_task():
 	"""A task to listen for input on stdin, parses the input data as command
 	and arguments and processes it."""
@@ -329,16 +726,18 @@ def control_task():
 	try:
 		while not stop:
 			# NOTE: input() may prevent this thread from stopping.
-			split_inp = input('> ').split(' ', 1)
-			cmd = split_inp[0]
-			args = shlex.split(split_inp[1]) if (len(split_inp) > 1) else []
-			handle_cmd(cmd, args)
+			line = input('> ')
+			try:
+				run_cmd_line(line)
+			except Exception as e:
+				# Keep reading the commands.
+				print(f'Command failed: {e}')
 		
 	except EOFError:
 		# This error gets thrown when interrupting through the keyboard because of
 		# threading.
 		print('Stopping...')
-		stop = True
+		request_stop()
 
 
 
@@ -348,25 +747,49 @@ if __name__ == '__main__':
 
 	main_args = main_parser.parse_args(sys.argv[1:])
 
-	openai_api_key = os.environ.get('OPENAI_API_KEY')
-	ai_client = None
-	if openai_api_key:
-		ai_client = OpenAI(api_key=openai_api_key)
-		# Force submodule load so we don't risk it be loaded in an async task, as
-		# it would cause issues with the synchronicity.
-		_ = ai_client.images
+	# The frame source backends are loaded when a stream first needs
+	# them, unless told to load them now.
+	preload(main_args.preload)
 
-	video_walls = []
+	# The video walls and the remote displays.
+	registry = DisplayRegistry(
+		max_datagram_size=main_args.max_datagram_size,
+		display_budget=main_args.display_budget * 1024
+	)
+	
+	# The event loop shared by the network traffic and the streams.
+	loop = asyncio.new_event_loop()
+	# Set within the event loop to wake it up when told to stop.
+	stop_event = None
+	# Plays the streams of all the groups.
+	session_manager = SessionManager(registry.get_wall, loop)
+	# The sources played by several groups.
+	source_mux = SourceMux()
+	# The still images converted lately.
+	image_cache = ImageCache(
+		main_args.image_cache_size,
+		main_args.image_cache_dir or None,
+		main_args.image_cache_disk_size
+	)
+	# Records the traffic, to replay it (see replay.py).
+	capture = CaptureWriter(main_args.capture, {'argv': sys.argv[1:]}) if main_args.capture else None
+	# The state resumed on a restart, a replay starts from the capture's
+	# state instead.
+	state_file = StateFile(main_args.state_file) if (main_args.state_file and not main_args.replay) else None
+	# Group -> (the arguments of its stream command, its session, its
+	# wall), see get_state().
+	stream_cmds = {}
 
 	print()
 
-	# Start the task to listen for data and commands sent by clients.
-	listen_thread = threading.Thread(
-		target=listen_task,
-		args=(main_args.host, main_args.port)
-	)
-	# Start the input task.
-	control_thread = threading.Thread(target=control_task)
-
-	listen_thread.start()
-	control_thread.start()
\ No newline at end of file
+	# Start the input task, unless replaying a capture which has its
+	# commands already.
+	# It's a daemon as input() may prevent it from stopping.
+	if not main_args.replay:
+		control_thread = threading.Thread(target=control_task, daemon=True)
+		control_thread.start()
+	
+	# Listen for data and commands sent by clients and play the streams
+	# until told to stop.
+	loop.run_until_complete(listen_task(main_args.host, main_args.port))
+	loop.close()
\ No newline at end of file
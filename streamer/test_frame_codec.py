@@ -0,0 +1,204 @@
+"""
+Tests of the frame encodings against the reference decoder (see
+frame_codec.py).
+
+	py -m pytest test_frame_codec.py
+"""
+
+import numpy as np
+import pytest
+
+from frame_codec import FrameDecoder, FrameReassembler, encode_delta, encode_chunks, encode_rle, next_seq, MAX_DELTA_ROWS, MAX_SEQ, CHUNK_HEADER_SIZE, MIN_RUN, MAX_RUN, RLE_MARKER
+
+
+
+PIX_ROWS = 8
+PIX_COLS = 10
+
+
+def make_frame(rng, pix_rows=PIX_ROWS, pix_cols=PIX_COLS):
+	"""Return a random frame of printable glyphs."""
+	return rng.integers(32, 127, size=pix_rows * pix_cols, dtype=np.uint8).tobytes()
+
+
+def change_rows(rng, data, rows, pix_cols=PIX_COLS):
+	"""Return a frame with new glyphs on the given rows."""
+	glyphs = np.frombuffer(data, dtype=np.uint8).reshape(-1, pix_cols).copy()
+	for row in rows:
+		glyphs[row] = rng.integers(32, 127, size=pix_cols, dtype=np.uint8)
+	return glyphs.tobytes()
+
+
+def test_delta_frames_match_full_frames():
+	rng = np.random.default_rng(0)
+	decoder = FrameDecoder(PIX_ROWS, PIX_COLS)
+	frame = make_frame(rng)
+	decoder.decode(frame)
+
+	for rows in ([0], [PIX_ROWS - 1], [1, 2, 5], list(range(PIX_ROWS)), [3]):
+		next_frame = change_rows(rng, frame, rows)
+		packet = encode_delta(frame, next_frame, PIX_COLS)
+		assert b''.join(decoder.decode(packet)) == next_frame
+		# The full frame path shows the same.
+		assert b''.join(FrameDecoder(PIX_ROWS, PIX_COLS).decode(next_frame)) == next_frame
+		frame = next_frame
+
+
+def test_delta_frame_of_unchanged_frame():
+	rng = np.random.default_rng(1)
+	frame = make_frame(rng)
+	assert encode_delta(frame, frame, PIX_COLS) is None
+
+
+def test_delta_frame_too_tall():
+	rng = np.random.default_rng(2)
+	frame = make_frame(rng, MAX_DELTA_ROWS + 1, 2)
+	with pytest.raises(ValueError):
+		encode_delta(frame, change_rows(rng, frame, [MAX_DELTA_ROWS], 2), 2)
+
+
+# Chunks of 3 rows, the last one holds 2.
+CHUNK_SIZE = CHUNK_HEADER_SIZE + 3 * PIX_COLS
+
+
+def make_chunks(rng, seq):
+	"""Return a random frame and its chunks."""
+	frame = make_frame(rng)
+	return frame, encode_chunks(frame, PIX_COLS, CHUNK_SIZE, seq)
+
+
+def test_chunks_in_order():
+	rng = np.random.default_rng(3)
+	frame, chunks = make_chunks(rng, 1)
+	assert len(chunks) == 3
+	assert all(len(chunk) <= CHUNK_SIZE for chunk in chunks)
+
+	reassembler = FrameReassembler(PIX_ROWS, PIX_COLS)
+	assert reassembler.add_chunk(chunks[0]) is None
+	assert reassembler.add_chunk(chunks[1]) is None
+	assert b''.join(reassembler.add_chunk(chunks[2])) == frame
+	assert reassembler.frames == 1
+
+
+def test_chunks_reordered():
+	rng = np.random.default_rng(4)
+	frame, chunks = make_chunks(rng, 1)
+	reassembler = FrameReassembler(PIX_ROWS, PIX_COLS)
+	assert reassembler.add_chunk(chunks[2]) is None
+	assert reassembler.add_chunk(chunks[0]) is None
+	assert b''.join(reassembler.add_chunk(chunks[1])) == frame
+
+
+def test_chunk_lost():
+	rng = np.random.default_rng(5)
+	_, chunks = make_chunks(rng, 1)
+	next_frame, next_chunks = make_chunks(rng, 2)
+
+	decoder = FrameDecoder(PIX_ROWS, PIX_COLS)
+	shown = decoder.decode(chunks[0])
+	decoder.decode(chunks[2])
+	# The frame never completes, the display keeps showing what it did.
+	assert shown == [b''] * PIX_ROWS
+
+	# The next frame drops the incomplete one.
+	for chunk in next_chunks:
+		shown = decoder.decode(chunk)
+	assert b''.join(shown) == next_frame
+	assert decoder.reassembler.dropped_frames == 1
+	assert decoder.reassembler.frames == 1
+
+
+def test_chunk_duplicated():
+	rng = np.random.default_rng(6)
+	frame, chunks = make_chunks(rng, 1)
+	reassembler = FrameReassembler(PIX_ROWS, PIX_COLS)
+	assert reassembler.add_chunk(chunks[0]) is None
+	assert reassembler.add_chunk(chunks[0]) is None
+	assert reassembler.add_chunk(chunks[1]) is None
+	assert b''.join(reassembler.add_chunk(chunks[2])) == frame
+	# A duplicate of a complete frame doesn't show it again.
+	assert reassembler.add_chunk(chunks[1]) is None
+	assert reassembler.frames == 1
+
+
+def test_late_chunk_of_older_frame():
+	rng = np.random.default_rng(7)
+	_, old_chunks = make_chunks(rng, 1)
+	frame, chunks = make_chunks(rng, 2)
+
+	decoder = FrameDecoder(PIX_ROWS, PIX_COLS)
+	decoder.decode(old_chunks[0])
+	decoder.decode(chunks[0])
+	# The older frame's rows don't get mixed with the newer frame's.
+	decoder.decode(old_chunks[1])
+	decoder.decode(chunks[1])
+	decoder.decode(old_chunks[2])
+	assert b''.join(decoder.decode(chunks[2])) == frame
+	assert decoder.reassembler.late_chunks == 2
+	assert decoder.reassembler.dropped_frames == 1
+
+
+def test_sequence_wraps_around():
+	assert next_seq(0) == 1
+	assert next_seq(MAX_SEQ - 1) == MAX_SEQ
+	assert next_seq(MAX_SEQ) == 1
+
+	rng = np.random.default_rng(8)
+	decoder = FrameDecoder(PIX_ROWS, PIX_COLS)
+	seq = MAX_SEQ - 2
+	for _ in range(5):
+		frame, chunks = make_chunks(rng, seq)
+		for chunk in chunks:
+			shown = decoder.decode(chunk)
+		assert b''.join(shown) == frame
+		seq = next_seq(seq)
+	assert decoder.reassembler.frames == 5
+	assert decoder.reassembler.late_chunks == 0
+
+	# After the wrap around, a chunk of frame 255 is older than frame 2.
+	_, late_chunks = make_chunks(rng, MAX_SEQ)
+	assert decoder.decode(late_chunks[0]) == shown
+	assert decoder.reassembler.late_chunks == 1
+
+
+def decode_rle(data, pix_rows, pix_cols):
+	"""Return the frame a run-length encoded one shows."""
+	return b''.join(FrameDecoder(pix_rows, pix_cols).decode(data))
+
+
+@pytest.mark.parametrize('rows', [
+	# A run crossing from a row to the next.
+	[b'abcdexxxxx', b'xxxxxfghij'],
+	# Full row runs.
+	[b'x' * 10, b'y' * 10],
+	# Short runs left raw, around a long one.
+	[b'aabbbcccc ', b'  d  eeeee'],
+])
+def test_rle_round_trip(rows):
+	frame = b''.join(rows)
+	encoded = encode_rle(frame, len(rows[0]))
+	assert encoded[0] == RLE_MARKER
+	assert len(encoded) < len(frame)
+	assert decode_rle(encoded, len(rows), len(rows[0])) == frame
+
+
+def test_rle_random_frames_round_trip():
+	rng = np.random.default_rng(9)
+	for _ in range(50):
+		# Few glyphs, so that there are runs.
+		glyphs = rng.choice(np.frombuffer(b' #@', dtype=np.uint8), size=(PIX_ROWS, PIX_COLS), p=[0.8, 0.1, 0.1])
+		frame = glyphs.tobytes()
+		encoded = encode_rle(frame, PIX_COLS)
+		if encoded is not None:
+			assert decode_rle(encoded, PIX_ROWS, PIX_COLS) == frame
+
+
+def test_rle_of_incompressible_frame():
+	assert encode_rle(b'abcdefghij' * 2, 10) is None
+
+
+@pytest.mark.parametrize('pix_cols', [MAX_RUN, MAX_RUN + 1, MAX_RUN + MIN_RUN - 1, 600])
+def test_rle_runs_longer_than_a_byte(pix_cols):
+	frame = b'x' * pix_cols + b'ab' * (pix_cols // 2) + b'c' * (pix_cols % 2)
+	encoded = encode_rle(frame, pix_cols)
+	assert decode_rle(encoded, 2, pix_cols) == frame
\ No newline at end of file
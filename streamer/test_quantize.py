@@ -0,0 +1,51 @@
+"""
+Tests of the conversion of the frames to glyphs against the original
+per-pixel matcher (see utils.quantize_frame()).
+
+	py -m pytest test_quantize.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from font_palette import FontPalette
+from utils import quantize_frame
+
+
+
+FONT_TEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'media', 'indexed_color', 'palette_tex_color_1.bmp')
+
+
+def match_pixel(font_pal_bgr, color, use_alpha=False):
+	"""The original matcher, applied to each pixel: the glyph of the
+	palette color at the smallest euclidean distance."""
+
+	dists = np.sqrt(np.sum((font_pal_bgr - color) ** 2, axis=1))
+	return np.argmin(dists) + ord(' ') + (not use_alpha)
+
+
+def match_frame(font_pal_bgr, frame, use_alpha=False):
+	glyphs = np.empty(frame.shape[:2], dtype=np.uint8)
+	for row, col in np.ndindex(glyphs.shape):
+		glyphs[row, col] = match_pixel(font_pal_bgr, frame[row, col].astype(np.int64), use_alpha)
+	return glyphs
+
+
+@pytest.mark.parametrize('use_alpha', [False, True])
+@pytest.mark.parametrize('glyph_count', [16, 96])
+def test_quantize_frame_matches_original(use_alpha, glyph_count):
+	font_pal = FontPalette(FONT_TEX_PATH, glyph_count, use_alpha, lut_bits=0)
+	rng = np.random.default_rng(glyph_count + use_alpha)
+	frame = rng.integers(0, 256, (40, 50, 3), dtype=np.uint8)
+	# The palette colors themselves, and halfway between two of them
+	# (ties).
+	colors = font_pal.bgr.astype(np.int64)[:frame.shape[1]]
+	frame[0, :len(colors)] = colors
+	frame[1, :len(colors) - 1] = (colors[:-1] + colors[1:]) // 2
+
+	glyphs = quantize_frame(frame, font_pal.bgr, use_alpha)
+	assert glyphs.dtype == np.uint8
+	assert np.array_equal(glyphs, match_frame(font_pal.bgr, frame, use_alpha))
+	assert np.array_equal(font_pal.quantize(frame), glyphs)
\ No newline at end of file
@@ -0,0 +1,259 @@
+"""
+Convert frames to characters with a pool of worker processes, so that
+large video walls use more than one core.
+
+The frames are handed to the workers through shared memory rather than
+being pickled: each worker converts a band of rows of the shared frame
+and writes the glyphs to a shared buffer. The worker processes are
+started once for each number of workers and shared by all the streams,
+whatever their palette, so that starting a stream doesn't pay for
+spawning them again.
+
+Run this module to measure how converting frames scales with the
+number of workers on walls of different shapes (63x63 displays):
+
+	py tile_pool.py [--lut_bits N] [font_tex_path]
+
+It prints the frames converted per second in process and with 1, 2, 4
+and 8 workers, on 1x1, 2x2, 4x4 and 8x8 walls. No such table is
+recorded here: it only means something on a machine with at least as
+many cores as workers, and it hasn't been run on one yet. With the LUT
+converting is mostly bound by memory, so the in-process path (no
+workers) is expected to stay the fastest on small walls, the workers
+should pay off on large walls converted without a LUT.
+"""
+
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from font_palette import get_font_palette
+
+
+
+# The shared memory blocks the worker process is attached to, by name.
+worker_shms = {}
+# The names of the shared memory blocks of all the pools of the main
+# process, the workers detach from the other ones.
+live_shm_names = set()
+live_shm_names_lock = threading.Lock()
+# The pools of worker processes, by number of workers (see
+# get_executor()).
+executors = {}
+executors_lock = threading.Lock()
+
+
+def attach_shared_memory(name):
+	"""Attach to a shared memory block created by another process."""
+
+	try:
+		# Python 3.13+, leave the block's lifetime to its owner.
+		return shared_memory.SharedMemory(name=name, track=False)
+	except TypeError:
+		# The workers share the resource tracker of the main process,
+		# which unlinks the block when destroying it.
+		return shared_memory.SharedMemory(name=name)
+
+
+def get_worker_font_palette(font_pal_args):
+	"""Return the palette a band gets converted with in a worker
+	process, loaded the first time (see get_font_palette()).
+
+	The LUT is mapped from the file the main process saved, so its pages
+	are shared among the processes. The workers never build it, they
+	match the frames directly until the main process saved it."""
+
+	return get_font_palette(*font_pal_args, build_lut=False)
+
+
+def get_worker_buffers(frame_shm_name, glyphs_shm_name, live_names):
+	"""Return the shared frame and glyphs blocks with the given names,
+	attaching to them the first time.
+
+	The blocks of the other pools sharing the worker stay attached, the
+	worker detaches only from the blocks which aren't in live_names
+	anymore (their pool destroyed them)."""
+
+	for name in list(worker_shms):
+		if name not in live_names:
+			worker_shms.pop(name).close()
+
+	for name in (frame_shm_name, glyphs_shm_name):
+		if name not in worker_shms:
+			worker_shms[name] = attach_shared_memory(name)
+
+	return worker_shms[frame_shm_name], worker_shms[glyphs_shm_name]
+
+
+def convert_band(font_pal_args, frame_shm_name, glyphs_shm_name, live_names, res, row_start, row_end):
+	"""Convert a band of rows of the shared frame into the shared
+	glyphs buffer."""
+
+	font_pal = get_worker_font_palette(font_pal_args)
+	frame_shm, glyphs_shm = get_worker_buffers(frame_shm_name, glyphs_shm_name, live_names)
+	frame = np.ndarray((*res, 3), dtype=np.uint8, buffer=frame_shm.buf)
+	glyphs = np.ndarray(res, dtype=np.uint8, buffer=glyphs_shm.buf)
+	glyphs[row_start:row_end] = font_pal.quantize(frame[row_start:row_end])
+
+
+def get_executor(workers):
+	"""Return the pool of a given number of worker processes, starting
+	it the first time."""
+
+	with executors_lock:
+		executor = executors.get(workers)
+		if executor is None:
+			executor = executors[workers] = ProcessPoolExecutor(
+				max_workers=workers,
+				# Forking a process running several threads is unsafe,
+				# spawn the workers like on Windows.
+				mp_context=multiprocessing.get_context('spawn')
+			)
+	return executor
+
+
+def shutdown_executors():
+	"""Stop all the worker processes."""
+
+	with executors_lock:
+		stopped = list(executors.values())
+		executors.clear()
+	for executor in stopped:
+		executor.shutdown()
+
+
+class TileEncoderPool:
+	"""Convert frames to characters with worker processes.
+
+	It can be used in place of a FontPalette to convert the frames of a
+	video wall (see VideoWall.set_frame()). The worker processes are
+	shared with the other pools of the same size (see get_executor()),
+	each pool has its own shared buffers."""
+
+	def __init__(self, font_pal, workers=2):
+		self.font_pal = font_pal
+		self.font_pal_args = (font_pal.font_tex_path, font_pal.glyph_count, font_pal.use_alpha, font_pal.lut_bits)
+		self.workers = workers
+		self.executor = get_executor(workers)
+
+		# The shared buffers, (re)created for the resolution of the
+		# frames.
+		self.res = None
+		self.frame_shm = None
+		self.glyphs_shm = None
+
+
+	def alloc_buffers(self, res):
+		"""Create the shared buffers for frames of a given
+		resolution."""
+
+		# The workers detach from the old blocks with their next task.
+		self.free_buffers()
+
+		self.res = res
+		self.frame_shm = shared_memory.SharedMemory(create=True, size=res[0] * res[1] * 3)
+		self.glyphs_shm = shared_memory.SharedMemory(create=True, size=res[0] * res[1])
+		with live_shm_names_lock:
+			live_shm_names.update((self.frame_shm.name, self.glyphs_shm.name))
+
+
+	def free_buffers(self):
+		"""Destroy the shared buffers."""
+
+		for shm in (self.frame_shm, self.glyphs_shm):
+			if shm:
+				with live_shm_names_lock:
+					live_shm_names.discard(shm.name)
+				shm.close()
+				shm.unlink()
+		self.frame_shm = self.glyphs_shm = None
+		self.res = None
+
+
+	def quantize(self, frame):
+		"""Convert a BGR image (HxWx3) to the characters of the font
+		texture. Return an HxW uint8 array of ASCII codes."""
+
+		res = frame.shape[:2]
+		if res != self.res:
+			self.alloc_buffers(res)
+
+		shared_frame = np.ndarray((*res, 3), dtype=np.uint8, buffer=self.frame_shm.buf)
+		np.copyto(shared_frame, frame, casting='unsafe')
+
+		with live_shm_names_lock:
+			live_names = frozenset(live_shm_names)
+
+		# Split the frame in a band of rows for each worker.
+		bounds = np.linspace(0, res[0], self.workers + 1).astype(int)
+		futures = [
+			self.executor.submit(
+				convert_band,
+				self.font_pal_args,
+				self.frame_shm.name,
+				self.glyphs_shm.name,
+				live_names,
+				res,
+				row_start,
+				row_end
+			)
+			for row_start, row_end in zip(bounds[:-1], bounds[1:])
+			if row_end > row_start
+		]
+		wait(futures)
+		for future in futures:
+			# Raise the workers' errors, if any.
+			future.result()
+
+		glyphs = np.ndarray(res, dtype=np.uint8, buffer=self.glyphs_shm.buf)
+		return glyphs.copy()
+
+
+	def shutdown(self):
+		"""Destroy the shared buffers, the worker processes are kept
+		for the next pools (see shutdown_executors())."""
+		self.free_buffers()
+
+
+
+if __name__ == '__main__':
+	argparser = argparse.ArgumentParser(add_help=False)
+	argparser.add_argument('--help', action='help', help='Show this help message and exit')
+	argparser.add_argument('--lut_bits', type=int, default=8, help='Bits per channel of the color lookup table (0 = no table)')
+	argparser.add_argument('--frames', type=int, default=50, help='Frames converted for each measure')
+	argparser.add_argument('font_tex_path', type=str, nargs='?', default='../examples/media/indexed_color/palette_tex_color_1.bmp', help='Font texture path')
+	args = argparser.parse_args(sys.argv[1:])
+
+	font_pal = get_font_palette(args.font_tex_path, use_alpha=True, lut_bits=args.lut_bits)
+	if font_pal.lut_bits:
+		font_pal.get_lut()
+
+	shapes = [1, 2, 4, 8]
+	rng = np.random.default_rng(0)
+
+	print(f'Frames converted per second, walls of 63x63 displays ({args.frames} frames each):\n')
+	print('workers\t' + '\t'.join(f'{n}x{n}' for n in shapes))
+
+	for workers in [0, 1, 2, 4, 8]:
+		pool = TileEncoderPool(font_pal, workers) if workers else None
+		results = []
+		for n in shapes:
+			frame = rng.integers(0, 256, (n * 63, n * 63, 3), dtype=np.uint8)
+			encoder = pool or font_pal
+			# Warm up (worker start-up, buffers allocation).
+			encoder.quantize(frame)
+			start_ts = time.perf_counter()
+			for _ in range(args.frames):
+				encoder.quantize(frame)
+			results.append(args.frames / (time.perf_counter() - start_ts))
+		if pool:
+			pool.shutdown()
+			shutdown_executors()
+
+		print(f'{workers or "none"}\t' + '\t'.join(f'{fps:.0f}' for fps in results))
\ No newline at end of file
@@ -8,15 +8,48 @@ def find_next_power_of_2(n):
 	return (2 ** math.ceil(math.log(n, 2))) if n > 1 else 2
 
 
+def get_glyph_offset(use_alpha=False):
+	"""Get the code of the character matching the first color in a
+	palette.
+
+	Use only the glyphs after the "space" char as it is the first char
+	to be processed in a font texture. When the alpha color is not used
+	the palette lacks its first color, so skip one more char."""
+	return ord(' ') + (not use_alpha)
+
+
+def quantize_frame(frame, font_pal_bgr, use_alpha=False):
+	"""Convert a whole BGR image (HxWx3) to the characters within a
+	font texture based on its palette, in a single array operation.
+
+	Return an HxW uint8 array whose elements are already the ASCII
+	codes of the glyphs, so that its bytes can be sent as they are."""
+
+	# float32 holds every integer up to 2^24 exactly, way more than
+	# any sum of products of 8-bit channels, so the math below is
+	# exact while still being handled by the fast matrix routines.
+	pixels = np.asarray(frame).reshape(-1, 3).astype(np.float32)
+	font_pal_bgr = np.asarray(font_pal_bgr, dtype=np.float32)
+	
+	# The closest color is the one with the smallest squared distance:
+	# |c - p|^2 = |c|^2 - 2c.p + |p|^2
+	# |c|^2 is the same for every color in the palette so it doesn't
+	# affect the closest match and we can skip it. Being all integral,
+	# the comparison is exact and ties resolve to the first color like
+	# when comparing the actual distances.
+	dists = (font_pal_bgr ** 2).sum(axis=1) - 2 * (pixels @ font_pal_bgr.T)
+	closest_idxs = np.argmin(dists, axis=1)
+	
+	# Convert to char codes.
+	glyphs = (closest_idxs + get_glyph_offset(use_alpha)).astype(np.uint8)
+	
+	return glyphs.reshape(np.shape(frame)[:2])
+
+
 def get_char_match(font_pal_bgr, color, use_alpha=False):
 	"""Get the character from within a font texture based on its
 	palette representing the color which is the closest to the given
 	color."""
 
-	# Calculate the magnitudes to get the closest color in the palette.
-	dists = np.sqrt(np.sum((font_pal_bgr - color) ** 2, axis=1))
-	closest_idx = np.argmin(dists)
-	# Convert to char.
-	# Use only the glyphs after the "space" char as it is the first char
-	# to be processed in a font texture.
-	return np.array([chr(closest_idx + ord(' ') + (not use_alpha))])
\ No newline at end of file
+	glyph = quantize_frame(np.reshape(color, (1, 1, 3)), font_pal_bgr, use_alpha=use_alpha)
+	return np.array([chr(glyph[0, 0])])
\ No newline at end of file
@@ -1,17 +1,39 @@
 import time
+import hashlib
 
 import numpy as np
 
-from utils import get_char_match
+from frame_codec import encode_delta, encode_chunks, encode_rle, next_seq, CHUNK_HEADER_SIZE, MAX_DELTA_ROWS
+from bandwidth import TokenBucket
+from metrics import RateMeter
 
 
 
 class Display:
 	"""A remote display API."""
 	
-	def __init__(self, sock, addr, max_heartbeat_interval=10):
+	def __init__(self, sock, addr, max_heartbeat_interval=10, row_len=None, max_datagram_size=0, budget=0):
+		# A socket, or anything with sendto() (see fanout.py).
 		self.sock = sock
 		self.addr = addr
+		# The frames larger than max_datagram_size bytes get split in
+		# chunks of rows of row_len glyphs (see
+		# frame_codec.encode_chunks()), 0 to send each frame in a
+		# single datagram.
+		self.row_len = row_len
+		self.max_datagram_size = max_datagram_size
+		# The sequence number of the last frame sent in chunks.
+		self.chunk_seq = 0
+		# The datagrams the last frame was sent in.
+		self.last_datagrams = 0
+
+		# The bandwidth budget (see bandwidth.py), None if unlimited.
+		self.budget = None
+		self.set_budget(budget)
+		# The frames skipped to stay within the budget.
+		self.throttled = 0
+		# The frames actually sent, while the budget is set.
+		self.fps = RateMeter()
 		self.heartbeat()
 		# The max interval between heartbeats to keep this remote
 		# display alive.
@@ -19,45 +41,139 @@ class Display:
 		# video wall's matrix.
 		self.max_heartbeat_interval = max_heartbeat_interval
 		
+		# The last frame sent to this display, used to send only
+		# what changed.
+		self.last_sent = None
+		# The digest of the last frame sent to this display, used to
+		# tell if a frame changed.
+		self.last_digest = None
+		# When the last frame and the last whole frame were sent.
+		self.last_sent_ts = None
+		self.keyframe_ts = None
+		
 
 	def heartbeat(self):
 		"""Called when a heartbeat is received, mark this display
 		alive."""
-		self.heartbeat_ts = time.time()
+		self.heartbeat_ts = time.monotonic()
+		
+
+	def is_alive(self, now=None):
+		"""True if this display was alive at a given time (from
+		time.monotonic()), now by default."""
+		if now is None:
+			now = time.monotonic()
+		return (now - self.heartbeat_ts) < self.max_heartbeat_interval
+		
+
+	def has_pending(self):
+		"""True if the last datagram queued for this display wasn't
+		sent yet, it may still get replaced by a newer one (see
+		fanout.FanoutSender)."""
+		is_pending = getattr(self.sock, 'is_pending', None)
+		return bool(is_pending and is_pending(self.addr))
+		
+
+	def set_budget(self, rate):
+		"""Limit the bandwidth this display takes to rate bytes per
+		second, 0 for no limit."""
+		self.budget = TokenBucket(rate) if rate else None
 		
 
 	@property
 	def alive(self):
 		"""True if this display is alive."""
-		return (time.time() - self.heartbeat_ts) < self.max_heartbeat_interval
-		
-
-	def set_frame(self, frame, font_pal_bgr, use_alpha=False):
-		"""Convert an np image to its textual representation based
-		on the font texture's palette and send it to the remote
-		display."""
-
-		# Convert the frame to characters based on the font
-		# texture's palette.
-		processed_image = np.vectorize(
-			lambda color: get_char_match(
-				font_pal_bgr,
-				color,
-				use_alpha=use_alpha
-			),
-			signature='(3)->(1)'
-		)(frame)
-		# Make it so all the elements are represented by a byte
-		# [S]tring of length [1].
-		processed_image = processed_image.astype('S1')
-		
-		self.sock.sendto(processed_image.tobytes(), self.addr)
+		return self.is_alive()
+		
+
+	def is_up_to_date(self, digest, refresh_interval):
+		"""True if the frame with the given digest is the last one
+		sent to this display, less than refresh_interval seconds
+		ago."""
+		return (
+			(digest == self.last_digest)
+			and ((time.monotonic() - self.last_sent_ts) < refresh_interval)
+		)
+		
+
+	def send_frame(self, data, digest=None, rle_data=None):
+		"""Send an already encoded frame (the textual representation
+		of an image) to the remote display, in chunks if it's larger
+		than max_datagram_size.
+
+		rle_data is the same frame run-length encoded, if it's smaller
+		(see frame_codec.encode_rle()), sent instead when it fits a
+		datagram.
+		Return the number of bytes sent."""
+
+		if rle_data and ((not self.max_datagram_size) or (len(rle_data) <= self.max_datagram_size)):
+			self.sock.sendto(rle_data, self.addr)
+			size = len(rle_data)
+			self.last_datagrams = 1
+		elif self.max_datagram_size and (len(data) > self.max_datagram_size):
+			self.chunk_seq = next_seq(self.chunk_seq)
+			datagrams = encode_chunks(data, self.row_len, self.max_datagram_size, self.chunk_seq)
+			sendmany = getattr(self.sock, 'sendmany', None)
+			if sendmany:
+				# Queued as one frame (see fanout.FanoutSender).
+				sendmany(datagrams, self.addr)
+			else:
+				for datagram in datagrams:
+					self.sock.sendto(datagram, self.addr)
+			size = sum(map(len, datagrams))
+			self.last_datagrams = len(datagrams)
+		else:
+			self.sock.sendto(data, self.addr)
+			size = len(data)
+			self.last_datagrams = 1
+
+		self.last_sent = data
+		self.last_digest = digest
+		self.last_sent_ts = self.keyframe_ts = time.monotonic()
+		return size
+		
+
+	def send_delta(self, data, row_len, keyframe_interval=2, digest=None, rle_data=None):
+		"""Send only the rows of an encoded frame which changed since
+		the last frame sent to this display.
+
+		A whole frame (a keyframe) is sent instead every
+		keyframe_interval seconds, so that a display recovers from
+		lost datagrams, or when it would take fewer bytes, or when
+		the frame it would be relative to is still waiting to be sent
+		(it could get replaced), or when it wouldn't fit a datagram, or
+		when the frame has more rows than a delta frame can address.
+		Return the number of bytes sent, 0 if nothing changed."""
+
+		if (
+			(self.last_sent is None)
+			or ((len(data) // row_len) > MAX_DELTA_ROWS)
+			or (len(self.last_sent) != len(data))
+			or ((time.monotonic() - self.keyframe_ts) >= keyframe_interval)
+			or self.has_pending()
+		):
+			return self.send_frame(data, digest, rle_data)
+		
+		packet = encode_delta(self.last_sent, data, row_len)
+		if packet is None:
+			# Nothing changed.
+			return 0
+		
+		if (len(packet) >= len(rle_data or data)) or (self.max_datagram_size and (len(packet) > self.max_datagram_size)):
+			return self.send_frame(data, digest, rle_data)
+		else:
+			self.sock.sendto(packet, self.addr)
+			self.last_datagrams = 1
+			self.last_sent = data
+			self.last_digest = digest
+			self.last_sent_ts = time.monotonic()
+			return len(packet)
 			
 
 class VideoWall:
 	"""A matrix of remote displays."""
 	
-	def __init__(self, shape, display_res, name='', max_heartbeat_interval=10):
+	def __init__(self, shape, display_res, name='', max_heartbeat_interval=10, max_datagram_size=0, display_budget=0):
 		self.matrix = np.empty(shape=shape, dtype=list)
 		# Initialize each slot in the matrix with an empty list.
 		# Each list will contain all the client displays in the
@@ -70,10 +186,25 @@ class VideoWall:
 		# The group name.
 		self.name = name
 		
+		# The encoded bytes of each tile of the last frame.
 		# Used for replication when a new client (a new remote
 		# display) joins.
-		self.last_frame = None
+		self.last_tiles = None
+		# The digest of each tile of the last frame, used to tell
+		# which tiles changed.
+		self.last_digests = None
+		# The run-length encoded bytes of each tile of the last frame,
+		# None for the tiles (or the frames) not worth it.
+		self.last_rle_tiles = None
 		self.max_heartbeat_interval = max_heartbeat_interval
+		# The max size of the datagrams sent to the displays, the tiles
+		# larger than that get split in chunks of rows (0 = no limit).
+		if max_datagram_size and (max_datagram_size < (CHUNK_HEADER_SIZE + display_res[1])):
+			raise ValueError(f'A datagram of {max_datagram_size} bytes can\'t hold a row of {display_res[1]} glyphs')
+		self.max_datagram_size = max_datagram_size
+		# The bandwidth budget of each display, in bytes per second
+		# (0 = no limit).
+		self.display_budget = display_budget
 		
 
 	@property
@@ -86,72 +217,157 @@ class VideoWall:
 		)
 		
 
-	def set_frame(self, frame, font_pal_bgr, use_alpha=False):
-		"""Store a frame for replication.
+	def set_frame(self, frame, font_pal):
+		"""Convert a frame to its textual representation based on
+		the font texture's palette and store the resulting bytes of
+		each tile for replication.
 
 		This doesn't automatically send the frame to the remote
 		displays, use broadcast_last_frame() for that. This way the
 		stored frame can also be replicated to clients who may
 		connect later on."""
+		self.set_tiles(*self.convert_frame(frame, font_pal))
+		
 
-		self.last_frame = frame
-		self.last_font_pal_bgr = font_pal_bgr
-		self.last_use_alpha = use_alpha
+	def convert_frame(self, frame, font_pal):
+		"""Convert a frame to its textual representation based on
+		the font texture's palette, without storing it. Return the
+		bytes of each tile and their digests.
+		
+		Each tile gets converted only once, no matter how many
+		displays share its position."""
+
+		# Convert the whole frame to characters at once.
+		# The characters are represented by their ASCII codes, which
+		# makes them already the bytes to send.
+		glyphs = font_pal.quantize(frame)
+		
+		# Split the frame according to the matrix, so that
+		# tiles[row, col] is the tile at that position in the matrix.
+		tiles = glyphs.reshape(
+			self.matrix.shape[0],
+			self.display_res[0],
+			self.matrix.shape[1],
+			self.display_res[1]
+		).swapaxes(1, 2)
+		
+		last_tiles = np.empty(shape=self.matrix.shape, dtype=object)
+		last_digests = np.empty(shape=self.matrix.shape, dtype=object)
+		for row in range(self.matrix.shape[0]):
+			for col in range(self.matrix.shape[1]):
+				last_tiles[row, col] = tiles[row, col].tobytes()
+				last_digests[row, col] = hashlib.blake2b(
+					last_tiles[row, col],
+					digest_size=8
+				).digest()
+		
+		return last_tiles, last_digests
+		
+
+	def set_tiles(self, tiles, digests, rle_tiles=None):
+		"""Store the tiles of a converted frame for replication (see
+		convert_frame()), and optionally the run-length encoded tiles
+		(see encode_rle_tiles())."""
+		self.last_tiles = tiles
+		self.last_digests = digests
+		self.last_rle_tiles = rle_tiles
+		
+
+	def encode_rle_tiles(self, tiles):
+		"""Run-length encode the tiles of a converted frame. Return the
+		encoded bytes of each tile, None for the tiles which wouldn't
+		get smaller."""
+
+		rle_tiles = np.empty(shape=self.matrix.shape, dtype=object)
+		for position in np.ndindex(*self.matrix.shape):
+			rle_tiles[position] = encode_rle(tiles[position], self.display_res[1])
+		return rle_tiles
 		
 
 	# We assume the resolution of each display is the same.
 	def add_display(self, sock, addr, position=(0, 0), send_last_frame=True):
 		"""Add a remote display to the matrix at a
 		given position and replicate the stored frame if
-		send_last_frame is True."""
+		send_last_frame is True. Return the display."""
 
 		disp = Display(
 			sock=sock,
 			addr=addr,
-			max_heartbeat_interval=self.max_heartbeat_interval
+			max_heartbeat_interval=self.max_heartbeat_interval,
+			row_len=self.display_res[1],
+			max_datagram_size=self.max_datagram_size,
+			budget=self.display_budget
 		)
 		self.matrix[position].append(disp)
 		
 		# Replicate the stored frame to the newly created display.
-		if send_last_frame and (self.last_frame is not None):
-			frame_part = self.last_frame[
-				position[0] * self.display_res[0] : (position[0] + 1) * self.display_res[0],
-				position[1] * self.display_res[1] : (position[1] + 1) * self.display_res[1]
-			]
-			disp.set_frame(
-				frame_part,
-				self.last_font_pal_bgr,
-				use_alpha=self.last_use_alpha
-			)
-		
-		
-	def broadcast_last_frame(self):
-		"""Split the last frame according to the matrix and send it
-		to the remote displays."""
+		if send_last_frame and (self.last_tiles is not None):
+			disp.send_frame(self.last_tiles[position], self.last_digests[position])
+		
+		return disp
+		
+		
+	def remove_display(self, disp, position):
+		"""Remove a remote display from the matrix."""
+		if disp in self.matrix[position]:
+			self.matrix[position].remove(disp)
+		
+		
+	def set_display_budget(self, rate):
+		"""Limit the bandwidth each display takes to rate bytes per
+		second, 0 for no limit."""
+		self.display_budget = rate
+		for displays in self.matrix.flat:
+			for disp in displays:
+				disp.set_budget(rate)
+		
+		
+	def broadcast_last_frame(self, keyframe_interval=None, refresh_interval=0):
+		"""Send each tile of the last frame to the remote displays
+		at its position in the matrix.
+		
+		If keyframe_interval is set, only the rows which changed are
+		sent (see Display.send_delta()).
+		If refresh_interval is set, a tile which didn't change since
+		it was last sent to a display is sent again only after
+		refresh_interval seconds, so that lost datagrams eventually
+		get replaced.
+		A display which went over its bandwidth budget skips the frame
+		(see bandwidth.py).
+		
+		Dead displays are not checked here, they are expected to be
+		removed apart (see DisplayRegistry.expire()).
+		
+		Return the number of datagrams and bytes sent."""
+		datagrams = sent_bytes = 0
+		now = time.monotonic()
 		for row in range(self.matrix.shape[0]):
 			for col in range(self.matrix.shape[1]):
 				
 				# Get the last frame tile based on this position in the matrix.
-				tile = self.last_frame[
-					row * self.display_res[0] : (row + 1) * self.display_res[0],
-					col * self.display_res[1] : (col + 1) * self.display_res[1]
-				]
+				tile = self.last_tiles[row, col]
+				digest = self.last_digests[row, col]
+				rle_tile = self.last_rle_tiles[row, col] if self.last_rle_tiles is not None else None
 				
-				dead_displays = []
 				for disp in self.matrix[row, col]:
-					if disp.alive:
-						# This display is still alive, send it the
-						# frame tile.
-						disp.set_frame(
-							tile,
-							self.last_font_pal_bgr,
-							use_alpha=self.last_use_alpha
-						)
+					# Send the frame tile to the display, unless it has
+					# it already.
+					if refresh_interval and disp.is_up_to_date(digest, refresh_interval):
+						continue
+					
+					if disp.budget and not disp.budget.is_ready(now):
+						disp.throttled += 1
+						continue
+					
+					if keyframe_interval is None:
+						size = disp.send_frame(tile, digest, rle_tile)
 					else:
-						# We didn't receive a heartbeat from this
-						# display recently, queue it for deletion.
-						dead_displays.append(disp)
-				
-				# Remove the dead displays from the matrix.
-				for disp in dead_displays:
-					self.matrix[row, col].remove(disp)
\ No newline at end of file
+						size = disp.send_delta(tile, self.display_res[1], keyframe_interval, digest, rle_tile)
+					if size:
+						datagrams += disp.last_datagrams
+						sent_bytes += size
+						if disp.budget:
+							disp.budget.consume(size)
+							disp.fps.mark(now)
+		
+		return datagrams, sent_bytes
\ No newline at end of file